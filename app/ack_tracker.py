@@ -0,0 +1,35 @@
+from collections import deque
+from typing import Deque
+from typing import Optional
+from typing import Set
+
+
+class AckTracker:
+    """Tracks out-of-order completions and yields the highest tag safe to ack with multiple=True.
+
+    Not thread-safe: call it from the connection thread only.
+    """
+
+    def __init__(self, batch_size: int) -> None:
+        self._batch_size = max(1, batch_size)
+        self._pending: Deque[int] = deque()
+        self._done: Set[int] = set()
+        self._ready = 0
+        self._ready_tag: Optional[int] = None
+
+    def delivered(self, delivery_tag: int) -> None:
+        self._pending.append(delivery_tag)
+
+    def completed(self, delivery_tag: int) -> Optional[int]:
+        self._done.add(delivery_tag)
+        while self._pending and self._pending[0] in self._done:
+            head = self._pending.popleft()
+            self._done.discard(head)
+            self._ready += 1
+            self._ready_tag = head
+        if self._ready and (self._ready >= self._batch_size or not self._pending):
+            ack_tag = self._ready_tag
+            self._ready = 0
+            self._ready_tag = None
+            return ack_tag
+        return None
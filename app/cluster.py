@@ -0,0 +1,191 @@
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+
+import pika
+from pydantic_core import to_json
+
+from app import crud
+from app import schemas
+from app.config import settings
+from app.db import SessionLocal
+from app.events import event_bus
+from app.fleet_state import fleet_state
+from app.mq_handlers import public_key_store
+from app.mq_publisher import CommandPublisher
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], None]
+
+# Every node keeps its fleet view current from these, whether or not anyone there is streaming.
+SHARED_EVENTS = {"servers"}
+# Nodes with streaming clients announce themselves; other events are only forwarded while one does.
+LISTENER_ANNOUNCE_INTERVAL = 10.0
+LISTENER_TTL = 3 * LISTENER_ANNOUNCE_INTERVAL
+
+
+class ClusterBus:
+    """Broadcasts cache invalidations and change events to every node over a fanout exchange.
+
+    Each node consumes from its own exclusive queue and skips its own messages. Delivery is
+    best effort: after a reconnect the reconnect hooks resync whatever may have been missed.
+    """
+
+    def __init__(self, url: str, exchange: str, max_pending: int = 10000) -> None:
+        self.node_id = uuid.uuid4().hex
+        self._url = url
+        self._exchange = exchange
+        self._publisher = CommandPublisher(url=url, exchange=exchange, pool_size=1, exchange_type="fanout")
+        # Broadcasts are queued so API handlers and consumer threads never block on RabbitMQ.
+        self._outbox: "queue.Queue[bytes]" = queue.Queue(maxsize=max_pending)
+        self._handlers: Dict[str, Handler] = {}
+        self._reconnect_hooks: List[Callable[[], None]] = []
+        self._started = False
+
+    def on(self, kind: str, handler: Handler) -> None:
+        self._handlers[kind] = handler
+
+    def on_reconnect(self, hook: Callable[[], None]) -> None:
+        self._reconnect_hooks.append(hook)
+
+    def broadcast(self, kind: str, data: Dict[str, Any]) -> None:
+        if not self._started:
+            # Nothing drains the outbox before start(), e.g. with CLUSTER_BROADCAST off.
+            return
+        body = to_json({"node": self.node_id, "kind": kind, "data": data})
+        try:
+            self._outbox.put_nowait(body)
+        except queue.Full:
+            logger.warning(f"cluster_broadcast_dropped: {kind}")
+
+    def start(self) -> None:
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self._send_loop, name="cluster-send", daemon=True).start()
+        threading.Thread(target=self._listen_loop, name="cluster-listen", daemon=True).start()
+
+    def close(self) -> None:
+        self._publisher.close()
+
+    def _send_loop(self) -> None:
+        while True:
+            body = self._outbox.get()
+            try:
+                self._publisher.publish("", body)
+            except Exception:
+                logger.warning("cluster_broadcast_error", exc_info=True)
+                time.sleep(1)
+
+    def _listen_loop(self) -> None:
+        connected_before = False
+        while True:
+            try:
+                connection = pika.BlockingConnection(pika.URLParameters(self._url))
+                channel = connection.channel()
+                channel.exchange_declare(exchange=self._exchange, exchange_type="fanout", durable=True)
+                queue_name = channel.queue_declare(queue="", exclusive=True, auto_delete=True).method.queue
+                channel.queue_bind(queue=queue_name, exchange=self._exchange)
+                if connected_before:
+                    self._run_reconnect_hooks()
+                connected_before = True
+                channel.basic_consume(queue=queue_name, on_message_callback=self._on_message, auto_ack=True)
+                channel.start_consuming()
+            except Exception:
+                logger.exception("cluster_listener_error")
+                time.sleep(3)
+
+    def _run_reconnect_hooks(self) -> None:
+        for hook in self._reconnect_hooks:
+            try:
+                hook()
+            except Exception:
+                logger.exception("cluster_resync_error")
+
+    def _on_message(self, ch, method, properties, body: bytes) -> None:
+        try:
+            message = json.loads(body)
+            if message.get("node") == self.node_id:
+                return
+            handler = self._handlers.get(message.get("kind"))
+            if handler is not None:
+                handler(message["data"])
+        except Exception:
+            logger.exception("cluster_message_error")
+
+
+cluster_bus = ClusterBus(settings.rabbitmq_url, settings.cluster_exchange)
+
+
+def broadcast_key_change(hostname: str) -> None:
+    cluster_bus.broadcast("public_key", {"hostname": hostname})
+
+
+_remote_listeners_until = 0.0
+
+
+def _forward_wanted(event_type: str) -> bool:
+    return event_type in SHARED_EVENTS or time.monotonic() < _remote_listeners_until
+
+
+def _forward_event(event_type: str, payload: str) -> None:
+    cluster_bus.broadcast("event", {"type": event_type, "payload": payload})
+
+
+def _apply_listening(data: Dict[str, Any]) -> None:
+    global _remote_listeners_until
+    _remote_listeners_until = time.monotonic() + LISTENER_TTL
+
+
+def _announce_listeners() -> None:
+    announced = None
+    while True:
+        if not event_bus.has_subscribers():
+            announced = None
+        elif announced is None or time.monotonic() - announced >= LISTENER_ANNOUNCE_INTERVAL:
+            cluster_bus.broadcast("listening", {})
+            announced = time.monotonic()
+        time.sleep(1)
+
+
+def _apply_event(data: Dict[str, Any]) -> None:
+    if data["type"] == "servers":
+        fleet_state.merge(schemas.ServerOut.model_validate(item) for item in json.loads(data["payload"]))
+    event_bus.deliver((data["type"], data["payload"]))
+
+
+def _apply_key_change(data: Dict[str, Any]) -> None:
+    public_key_store.invalidate(data.get("hostname"))
+
+
+def _resync(reload_fleet: bool) -> None:
+    public_key_store.invalidate()
+    if reload_fleet:
+        with SessionLocal() as db:
+            fleet_state.load(crud.get_servers(db))
+
+
+def join_cluster(reload_fleet: bool) -> None:
+    """Shares local events with other nodes and applies theirs.
+
+    Server changes are always shared; task, result and progress events only while some other
+    node has streaming clients, so ingest does not encode them for nobody.
+
+    Nodes that do not consume heartbeats themselves should pass ``reload_fleet`` so the
+    fleet is reloaded from the database after a reconnect, when updates may have been missed.
+    """
+    event_bus.set_forward(_forward_event, _forward_wanted)
+    cluster_bus.on("event", _apply_event)
+    cluster_bus.on("listening", _apply_listening)
+    cluster_bus.on("public_key", _apply_key_change)
+    cluster_bus.on_reconnect(lambda: _resync(reload_fleet))
+    cluster_bus.start()
+    threading.Thread(target=_announce_listeners, name="cluster-announce", daemon=True).start()
@@ -1,12 +1,36 @@
-from datetime import datetime, timezone
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from typing import Dict
+from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Set
+from typing import Tuple
 
+from sqlalchemy import and_
+from sqlalchemy import bindparam
+from sqlalchemy import case
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import or_
 from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy import Select
+from sqlalchemy import Update
+from sqlalchemy.dialects.mysql import Insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import Executable
 
+from app import heartbeat_history
 from app import models
+from app import result_store
 from app import schemas
+from app.config import settings
+from app.fleet_state import as_utc
 
 
 def get_servers(db: Session) -> List[models.Server]:
@@ -30,8 +54,41 @@ def create_server(db: Session, server_in: schemas.ServerCreate) -> models.Server
     return server
 
 
-def list_tasks(db: Session) -> List[models.Task]:
-    return list(db.execute(select(models.Task).order_by(models.Task.created_at.desc())).scalars().all())
+def list_tasks_stmt(
+    limit: int,
+    after: Optional[Tuple[datetime, int]] = None,
+    status: Optional[str] = None,
+    target_type: Optional[str] = None,
+    target: Optional[str] = None,
+    user: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+) -> Select:
+    stmt = select(models.Task)
+    if status:
+        stmt = stmt.where(models.Task.status == status)
+    if target_type:
+        stmt = stmt.where(models.Task.target_type == target_type)
+    if target:
+        stmt = stmt.where(models.Task.target == target)
+    if user:
+        stmt = stmt.where(models.Task.user == user)
+    if created_after:
+        stmt = stmt.where(models.Task.created_at >= created_after)
+    if created_before:
+        stmt = stmt.where(models.Task.created_at < created_before)
+    if after:
+        created_at, row_id = after
+        # Expanded form of (created_at, id) < (:created_at, :id) that MySQL turns into an index range.
+        stmt = stmt.where(
+            models.Task.created_at <= created_at,
+            or_(models.Task.created_at < created_at, models.Task.id < row_id),
+        )
+    return stmt.order_by(models.Task.created_at.desc(), models.Task.id.desc()).limit(limit)
+
+
+def list_tasks(db: Session, limit: int, **filters: Any) -> List[models.Task]:
+    return list(db.execute(list_tasks_stmt(limit, **filters)).scalars().all())
 
 
 def create_task(db: Session, task: models.Task) -> models.Task:
@@ -41,6 +98,13 @@ def create_task(db: Session, task: models.Task) -> models.Task:
     return task
 
 
+def create_tasks(db: Session, tasks: List[Dict[str, Any]]) -> None:
+    if not tasks:
+        return
+    db.execute(insert(models.Task), tasks)
+    db.commit()
+
+
 def get_task_by_id(db: Session, task_id: str) -> Optional[models.Task]:
     return db.execute(select(models.Task).where(models.Task.task_id == task_id)).scalars().first()
 
@@ -52,25 +116,278 @@ def update_task_status(db: Session, task_id: str, status: str) -> None:
         db.commit()
 
 
-def create_task_result(
+def transition_tasks_stmt(
+    task_ids: List[str],
+    status: str,
+    allowed_from: List[str],
+    exclude_target_types: Iterable[str] = (),
+) -> Update:
+    """Compiles one state-machine step into a conditional UPDATE; its rowcount tells which rows moved."""
+    stmt = (
+        update(models.Task)
+        .where(models.Task.task_id.in_(task_ids), models.Task.status.in_(allowed_from))
+        .values(status=status)
+    )
+    if exclude_target_types:
+        stmt = stmt.where(models.Task.target_type.notin_(sorted(exclude_target_types)))
+    return stmt
+
+
+def transition_tasks(db: Session, task_ids: List[str], status: str, allowed_from: List[str]) -> int:
+    if not task_ids:
+        return 0
+    rowcount = db.execute(transition_tasks_stmt(task_ids, status, allowed_from)).rowcount
+    db.commit()
+    return rowcount
+
+
+def transition_task(
     db: Session,
+    task_id: str,
+    status: str,
+    allowed_from: List[str],
+    exclude_target_types: Iterable[str] = (),
+) -> bool:
+    stmt = transition_tasks_stmt([task_id], status, allowed_from, exclude_target_types)
+    moved = db.execute(stmt).rowcount == 1
+    db.commit()
+    return moved
+
+
+def task_states_stmt(task_ids: List[str]) -> Select:
+    return select(models.Task.task_id, models.Task.status, models.Task.target_type).where(
+        models.Task.task_id.in_(task_ids)
+    )
+
+
+def task_states(db: Session, task_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+    """Maps task_id to (status, target_type) for the tasks that exist."""
+    return {task_id: (status, target_type) for task_id, status, target_type in db.execute(task_states_stmt(task_ids))}
+
+
+def list_server_groups_stmt(groups: Optional[List[str]] = None) -> Select:
+    """(hostname, group) of every server, or only of those in groups when given."""
+    stmt = select(models.Server.hostname, models.Server.group)
+    if groups is not None:
+        stmt = stmt.where(models.Server.group.in_(groups))
+    return stmt
+
+
+def list_server_groups(db: Session, groups: Optional[List[str]] = None) -> List[Tuple[str, Optional[str]]]:
+    return db.execute(list_server_groups_stmt(groups)).all()
+
+
+def fanout_rows(hosts_by_task: Dict[str, List[str]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Builds the task_executions and task_progress rows written at dispatch."""
+    now = datetime.now(timezone.utc)
+    executions = [
+        {"task_id": task_id, "hostname": hostname, "status": "pending", "updated_at": now}
+        for task_id, hostnames in hosts_by_task.items()
+        for hostname in hostnames
+    ]
+    progress = [
+        {"task_id": task_id, "expected": len(hostnames), "received": 0, "done": 0, "failed": 0, "updated_at": now}
+        for task_id, hostnames in hosts_by_task.items()
+    ]
+    return executions, progress
+
+
+def create_fanout(db: Session, hosts_by_task: Dict[str, List[str]]) -> None:
+    if not hosts_by_task:
+        return
+    executions, progress = fanout_rows(hosts_by_task)
+    if executions:
+        db.execute(insert(models.TaskExecution), executions)
+    db.execute(insert(models.TaskProgress), progress)
+    db.commit()
+
+
+def record_execution(
+    db: Session,
+    task_id: str,
+    hostname: str,
+    exit_code: Optional[int],
+    result_uid: Optional[str],
+) -> str:
+    """Marks one host of a fan-out task as finished.
+
+    Returns "expected" for a host that was targeted at dispatch, "unexpected" for one
+    that was not and "duplicate" when the host had already reported.
+    """
+    values = {
+        "status": "done" if exit_code == 0 else "failed",
+        "exit_code": exit_code,
+        "result_uid": result_uid,
+        "updated_at": datetime.now(timezone.utc),
+    }
+    stmt = (
+        update(models.TaskExecution)
+        .where(
+            models.TaskExecution.task_id == task_id,
+            models.TaskExecution.hostname == hostname,
+            models.TaskExecution.status == "pending",
+        )
+        .values(**values)
+    )
+    if db.execute(stmt).rowcount:
+        db.commit()
+        return "expected"
+    exists = db.execute(
+        select(models.TaskExecution.id).where(
+            models.TaskExecution.task_id == task_id,
+            models.TaskExecution.hostname == hostname,
+        )
+    ).first()
+    if exists:
+        db.rollback()
+        return "duplicate"
+    db.add(models.TaskExecution(task_id=task_id, hostname=hostname, **values))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return "duplicate"
+    return "unexpected"
+
+
+def apply_fanout_progress(db: Session, deltas: Dict[str, Dict[str, int]]) -> List[schemas.TaskProgressOut]:
+    """Adds counter deltas to task_progress in one executemany and returns the updated rows.
+
+    The rows are read back before the commit, so once it succeeds nothing can fail and
+    tempt the caller into applying the same deltas twice.
+    """
+    if not deltas:
+        return []
+    stmt = (
+        update(models.TaskProgress)
+        .where(models.TaskProgress.task_id == bindparam("b_task_id"))
+        .values(
+            expected=models.TaskProgress.expected + bindparam("b_expected"),
+            received=models.TaskProgress.received + bindparam("b_received"),
+            done=models.TaskProgress.done + bindparam("b_done"),
+            failed=models.TaskProgress.failed + bindparam("b_failed"),
+            updated_at=bindparam("b_updated_at"),
+        )
+    )
+    now = datetime.now(timezone.utc)
+    db.connection().execute(
+        stmt,
+        [
+            {
+                "b_task_id": task_id,
+                "b_expected": delta["expected"],
+                "b_received": delta["received"],
+                "b_done": delta["done"],
+                "b_failed": delta["failed"],
+                "b_updated_at": now,
+            }
+            for task_id, delta in deltas.items()
+        ],
+    )
+    rows = db.execute(select(models.TaskProgress).where(models.TaskProgress.task_id.in_(list(deltas)))).scalars()
+    progress = [schemas.TaskProgressOut.model_validate(row) for row in rows]
+    db.commit()
+    return progress
+
+
+def get_task_progress(db: Session, task_id: str) -> Optional[models.TaskProgress]:
+    return db.execute(select(models.TaskProgress).where(models.TaskProgress.task_id == task_id)).scalars().first()
+
+
+def list_task_executions_stmt(task_id: str, status: Optional[str] = None) -> Select:
+    stmt = select(models.TaskExecution).where(models.TaskExecution.task_id == task_id)
+    if status:
+        stmt = stmt.where(models.TaskExecution.status == status)
+    return stmt.order_by(models.TaskExecution.hostname)
+
+
+def list_task_executions(db: Session, task_id: str, status: Optional[str] = None) -> List[models.TaskExecution]:
+    return list(db.execute(list_task_executions_stmt(task_id, status)).scalars().all())
+
+
+def task_result_values(
     task_id: str,
     exit_code: Optional[int],
     stdout: Optional[str],
     stderr: Optional[str],
     timestamp: Optional[datetime],
-) -> models.TaskResult:
-    result = models.TaskResult(
-        task_id=task_id,
-        exit_code=exit_code,
-        stdout=stdout,
-        stderr=stderr,
-        timestamp=timestamp or datetime.now(timezone.utc),
-    )
-    db.add(result)
-    db.commit()
-    db.refresh(result)
-    return result
+    hostname: Optional[str] = None,
+    result_uid: Optional[str] = None,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    result_uid = result_uid or uuid.uuid4().hex
+    stdout_preview, stdout_size, stdout_chunks = result_store.split_output(
+        stdout, settings.result_preview_bytes, settings.result_chunk_bytes
+    )
+    stderr_preview, stderr_size, stderr_chunks = result_store.split_output(
+        stderr, settings.result_preview_bytes, settings.result_chunk_bytes
+    )
+    result = {
+        "task_id": task_id,
+        "hostname": hostname,
+        "result_uid": result_uid,
+        "exit_code": exit_code,
+        "stdout": stdout_preview,
+        "stderr": stderr_preview,
+        "stdout_size": stdout_size,
+        "stderr_size": stderr_size,
+        "stdout_truncated": bool(stdout_chunks),
+        "stderr_truncated": bool(stderr_chunks),
+        "timestamp": timestamp or datetime.now(timezone.utc),
+    }
+    chunks = [
+        {
+            "result_uid": result_uid,
+            "stream": stream,
+            "seq": seq,
+            "offset": offset,
+            "raw_size": raw_size,
+            "data": data,
+        }
+        for stream, stream_chunks in (("stdout", stdout_chunks), ("stderr", stderr_chunks))
+        for seq, (offset, raw_size, data) in enumerate(stream_chunks)
+    ]
+    return result, chunks
+
+
+def insert_task_results(db: Session, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Inserts parsed results and their output chunks with one executemany each, without committing.
+
+    A result's idempotency key becomes its result_uid, and rows whose uid already exists are
+    left untouched, so a redelivered result is a no-op. Returns the rows in input order;
+    nothing is read back.
+    """
+    rows: List[Dict[str, Any]] = []
+    chunks: List[Dict[str, Any]] = []
+    for result in results:
+        row, row_chunks = task_result_values(
+            result["task_id"],
+            result["exit_code"],
+            result["stdout"],
+            result["stderr"],
+            result["timestamp"],
+            result["hostname"],
+            result.get("idempotency_key"),
+        )
+        rows.append(row)
+        chunks.extend(row_chunks)
+    if rows:
+        stmt = mysql_insert(models.TaskResult)
+        db.execute(stmt.on_duplicate_key_update(result_uid=stmt.inserted.result_uid), rows)
+    if chunks:
+        stmt = mysql_insert(models.TaskResultChunk)
+        db.execute(stmt.on_duplicate_key_update(result_uid=stmt.inserted.result_uid), chunks)
+    return rows
+
+
+def existing_result_uids(db: Session, result_uids: Iterable[str]) -> Set[str]:
+    uids = sorted(result_uids)
+    if not uids:
+        return set()
+    return set(db.execute(select(models.TaskResult.result_uid).where(models.TaskResult.result_uid.in_(uids))).scalars())
+
+
+def get_task_result_by_uid(db: Session, result_uid: str) -> Optional[models.TaskResult]:
+    return db.execute(select(models.TaskResult).where(models.TaskResult.result_uid == result_uid)).scalars().first()
 
 
 def list_task_results(db: Session, task_id: str) -> List[models.TaskResult]:
@@ -79,6 +396,55 @@ def list_task_results(db: Session, task_id: str) -> List[models.TaskResult]:
     )
 
 
+def results_by_task_stmt(task_ids: List[str]) -> Select:
+    return (
+        select(models.TaskResult)
+        .where(models.TaskResult.task_id.in_(task_ids))
+        .order_by(models.TaskResult.task_id, models.TaskResult.id)
+    )
+
+
+def group_results_by_task(
+    task_ids: List[str],
+    results: Iterable[models.TaskResult],
+) -> Dict[str, List[models.TaskResult]]:
+    grouped: Dict[str, List[models.TaskResult]] = {task_id: [] for task_id in task_ids}
+    for result in results:
+        grouped[result.task_id].append(result)
+    return grouped
+
+
+def list_results_by_task(db: Session, task_ids: List[str]) -> Dict[str, List[models.TaskResult]]:
+    if not task_ids:
+        return {}
+    return group_results_by_task(task_ids, db.execute(results_by_task_stmt(task_ids)).scalars())
+
+
+def result_failed(exit_code: Optional[int]) -> bool:
+    # A result without an exit code is not counted as failed, matching count_results_by_task_stmt.
+    return exit_code is not None and exit_code != 0
+
+
+def count_results_by_task_stmt(task_ids: List[str]) -> Select:
+    exit_code = models.TaskResult.exit_code
+    return (
+        select(
+            models.TaskResult.task_id,
+            func.count(),
+            func.sum(case((and_(exit_code.is_not(None), exit_code != 0), 1), else_=0)),
+        )
+        .where(models.TaskResult.task_id.in_(task_ids))
+        .group_by(models.TaskResult.task_id)
+    )
+
+
+def count_results_by_task(db: Session, task_ids: List[str]) -> Dict[str, Tuple[int, int]]:
+    if not task_ids:
+        return {}
+    rows = db.execute(count_results_by_task_stmt(task_ids))
+    return {task_id: (int(total), int(failed or 0)) for task_id, total, failed in rows}
+
+
 def update_heartbeat(
     db: Session,
     hostname: str,
@@ -100,6 +466,173 @@ def update_heartbeat(
     return server
 
 
+def mark_servers_offline(db: Session, hostnames: List[str], cutoff: datetime) -> int:
+    """Moves hosts to offline in one UPDATE, skipping any that sent a heartbeat after cutoff."""
+    if not hostnames:
+        return 0
+    cutoff = cutoff.astimezone(timezone.utc).replace(tzinfo=None)
+    stmt = (
+        update(models.Server)
+        .where(
+            models.Server.hostname.in_(hostnames),
+            models.Server.status != "offline",
+            or_(models.Server.last_heartbeat < cutoff, models.Server.last_heartbeat.is_(None)),
+        )
+        .values(status="offline")
+    )
+    rowcount = db.execute(stmt).rowcount
+    db.commit()
+    return rowcount
+
+
+def heartbeat_upsert_stmt(heartbeats: List[Dict[str, Any]]) -> Insert:
+    """Upserts one beat per host; a beat older than the stored one leaves the row as it is.
+
+    Redelivered batches can carry beats older than what is stored, and moving last_heartbeat
+    backwards would let the liveness sweep mark a live host offline.
+    """
+    created_at = datetime.now(timezone.utc)
+    stmt = mysql_insert(models.Server).values(
+        [
+            {
+                "hostname": heartbeat["hostname"],
+                "status": heartbeat["status"],
+                "last_heartbeat": heartbeat["timestamp"],
+                "cpu_usage": heartbeat["cpu_usage"],
+                "memory_usage": heartbeat["memory_usage"],
+                "created_at": created_at,
+            }
+            for heartbeat in heartbeats
+        ]
+    )
+    newer = or_(models.Server.last_heartbeat.is_(None), stmt.inserted.last_heartbeat >= models.Server.last_heartbeat)
+    # MySQL applies these in order and later ones see earlier results, so last_heartbeat goes last.
+    stmt = stmt.on_duplicate_key_update(
+        [
+            (name, case((newer, getattr(stmt.inserted, name)), else_=getattr(models.Server, name)))
+            for name in ("status", "cpu_usage", "memory_usage", "last_heartbeat")
+        ]
+    )
+    return stmt
+
+
+def stored_samples_stmt(samples: List[Dict[str, Any]]) -> Select:
+    """(hostname, ts) of already stored samples that may overlap the batch, read from the host/ts index."""
+    return select(models.HeartbeatSample.hostname, models.HeartbeatSample.ts).where(
+        models.HeartbeatSample.hostname.in_(sorted({sample["hostname"] for sample in samples})),
+        models.HeartbeatSample.ts.between(
+            min(sample["ts"] for sample in samples),
+            max(sample["ts"] for sample in samples),
+        ),
+    )
+
+
+def heartbeat_history_stmts(samples: List[Dict[str, Any]]) -> List[Executable]:
+    """Appends new raw samples and adds them to the 1m/5m/1h rollups in place.
+
+    Only samples that are not stored yet may be passed, or the additive rollups would count
+    them twice; the unique (hostname, ts) index fails a concurrent duplicate instead.
+    """
+    if not samples:
+        return []
+    stmt = mysql_insert(models.HeartbeatRollup).values(heartbeat_history.rollup_rows(samples))
+    stmt = stmt.on_duplicate_key_update(
+        samples=models.HeartbeatRollup.samples + stmt.inserted.samples,
+        cpu_sum=models.HeartbeatRollup.cpu_sum + stmt.inserted.cpu_sum,
+        cpu_max=func.greatest(models.HeartbeatRollup.cpu_max, stmt.inserted.cpu_max),
+        memory_sum=models.HeartbeatRollup.memory_sum + stmt.inserted.memory_sum,
+        memory_max=func.greatest(models.HeartbeatRollup.memory_max, stmt.inserted.memory_max),
+    )
+    return [insert(models.HeartbeatSample).values(samples), stmt]
+
+
+def upsert_heartbeats(db: Session, heartbeats: List[Dict[str, Any]], history: List[Dict[str, Any]]) -> None:
+    """Upserts the latest beat per host and records every beat in ``history`` not stored yet."""
+    if not heartbeats:
+        return
+    db.execute(heartbeat_upsert_stmt(heartbeats))
+    samples = heartbeat_history.sample_rows(history)
+    if samples:
+        samples = heartbeat_history.unseen_samples(samples, db.execute(stored_samples_stmt(samples)))
+    for stmt in heartbeat_history_stmts(samples):
+        db.execute(stmt)
+    db.commit()
+
+
+def prune_heartbeat_history(db: Session, now: datetime, batch_size: int) -> int:
+    """Deletes samples and rollups past their retention in LIMITed chunks to keep locks short."""
+    now = now.astimezone(timezone.utc).replace(tzinfo=None)
+    targets = [
+        (
+            models.HeartbeatSample,
+            models.HeartbeatSample.ts < now - timedelta(seconds=settings.heartbeat_raw_retention),
+        )
+    ]
+    for resolution, retention in settings.heartbeat_rollup_retention.items():
+        targets.append(
+            (
+                models.HeartbeatRollup,
+                and_(
+                    models.HeartbeatRollup.resolution == resolution,
+                    models.HeartbeatRollup.bucket < now - timedelta(seconds=retention),
+                ),
+            )
+        )
+    deleted = 0
+    for model, condition in targets:
+        stmt = delete(model).where(condition).with_dialect_options(mysql_limit=batch_size)
+        while True:
+            rowcount = db.execute(stmt).rowcount
+            db.commit()
+            deleted += rowcount
+            if rowcount < batch_size:
+                break
+    return deleted
+
+
+def heartbeat_series_stmt(
+    resolution: int,
+    start: datetime,
+    end: datetime,
+    hostname: Optional[str] = None,
+    group: Optional[str] = None,
+) -> Select:
+    rollup = models.HeartbeatRollup
+    stmt = (
+        select(
+            rollup.bucket,
+            func.sum(rollup.samples),
+            func.sum(rollup.cpu_sum),
+            func.max(rollup.cpu_max),
+            func.sum(rollup.memory_sum),
+            func.max(rollup.memory_max),
+        )
+        .where(rollup.resolution == resolution, rollup.bucket >= start, rollup.bucket < end)
+        .group_by(rollup.bucket)
+        .order_by(rollup.bucket)
+    )
+    if hostname:
+        stmt = stmt.where(rollup.hostname == hostname)
+    if group:
+        stmt = stmt.where(rollup.hostname.in_(select(models.Server.hostname).where(models.Server.group == group)))
+    return stmt
+
+
+def heartbeat_points(rows: Iterable[Any]) -> List[schemas.HeartbeatPoint]:
+    return [
+        schemas.HeartbeatPoint(
+            bucket=as_utc(bucket),
+            samples=int(samples),
+            cpu_avg=cpu_sum / samples,
+            cpu_max=cpu_max,
+            memory_avg=memory_sum / samples,
+            memory_max=memory_max,
+        )
+        for bucket, samples, cpu_sum, cpu_max, memory_sum, memory_max in rows
+        if samples
+    ]
+
+
 def list_client_public_keys(db: Session) -> List[models.ClientPublicKey]:
     return list(db.execute(select(models.ClientPublicKey)).scalars().all())
 
@@ -110,6 +643,12 @@ def get_client_public_key(db: Session, hostname: str) -> Optional[models.ClientP
     ).scalars().first()
 
 
+def get_client_public_key_updated_at(db: Session, hostname: str) -> Optional[datetime]:
+    return db.execute(
+        select(models.ClientPublicKey.updated_at).where(models.ClientPublicKey.hostname == hostname)
+    ).scalar()
+
+
 def upsert_client_public_key(
     db: Session,
     hostname: str,
@@ -0,0 +1,194 @@
+from datetime import datetime, timezone
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud
+from app import heartbeat_history
+from app import models
+from app import schemas
+
+
+async def get_server_by_hostname(db: AsyncSession, hostname: str) -> Optional[models.Server]:
+    return (await db.execute(select(models.Server).where(models.Server.hostname == hostname))).scalars().first()
+
+
+async def create_server(db: AsyncSession, server_in: schemas.ServerCreate) -> models.Server:
+    server = models.Server(
+        hostname=server_in.hostname,
+        ip=server_in.ip,
+        group=server_in.group,
+        status="unknown",
+        created_at=datetime.now(timezone.utc),
+    )
+    db.add(server)
+    await db.commit()
+    return server
+
+
+async def list_server_groups(db: AsyncSession, groups: Optional[List[str]] = None) -> List[Tuple[str, Optional[str]]]:
+    return list((await db.execute(crud.list_server_groups_stmt(groups))).all())
+
+
+async def list_tasks(db: AsyncSession, limit: int, **filters: Any) -> List[models.Task]:
+    return list((await db.execute(crud.list_tasks_stmt(limit, **filters))).scalars().all())
+
+
+async def create_task(db: AsyncSession, task: models.Task) -> models.Task:
+    db.add(task)
+    await db.commit()
+    return task
+
+
+async def create_tasks(db: AsyncSession, tasks: List[Dict[str, Any]]) -> None:
+    if not tasks:
+        return
+    await db.execute(insert(models.Task), tasks)
+    await db.commit()
+
+
+async def get_task_by_id(db: AsyncSession, task_id: str) -> Optional[models.Task]:
+    return (await db.execute(select(models.Task).where(models.Task.task_id == task_id))).scalars().first()
+
+
+async def transition_tasks(db: AsyncSession, task_ids: List[str], status: str, allowed_from: List[str]) -> int:
+    if not task_ids:
+        return 0
+    rowcount = (await db.execute(crud.transition_tasks_stmt(task_ids, status, allowed_from))).rowcount
+    await db.commit()
+    return rowcount
+
+
+async def transition_task(
+    db: AsyncSession,
+    task_id: str,
+    status: str,
+    allowed_from: List[str],
+    exclude_target_types: Iterable[str] = (),
+) -> bool:
+    stmt = crud.transition_tasks_stmt([task_id], status, allowed_from, exclude_target_types)
+    moved = (await db.execute(stmt)).rowcount == 1
+    await db.commit()
+    return moved
+
+
+async def create_fanout(db: AsyncSession, hosts_by_task: Dict[str, List[str]]) -> None:
+    if not hosts_by_task:
+        return
+    executions, progress = crud.fanout_rows(hosts_by_task)
+    if executions:
+        await db.execute(insert(models.TaskExecution), executions)
+    await db.execute(insert(models.TaskProgress), progress)
+    await db.commit()
+
+
+async def get_task_progress(db: AsyncSession, task_id: str) -> Optional[models.TaskProgress]:
+    return (
+        await db.execute(select(models.TaskProgress).where(models.TaskProgress.task_id == task_id))
+    ).scalars().first()
+
+
+async def list_task_executions(
+    db: AsyncSession,
+    task_id: str,
+    status: Optional[str] = None,
+) -> List[models.TaskExecution]:
+    return list((await db.execute(crud.list_task_executions_stmt(task_id, status))).scalars().all())
+
+
+async def get_task_result_by_uid(db: AsyncSession, result_uid: str) -> Optional[models.TaskResult]:
+    return (
+        await db.execute(select(models.TaskResult).where(models.TaskResult.result_uid == result_uid))
+    ).scalars().first()
+
+
+async def list_task_results(db: AsyncSession, task_id: str) -> List[models.TaskResult]:
+    return list(
+        (await db.execute(select(models.TaskResult).where(models.TaskResult.task_id == task_id))).scalars().all()
+    )
+
+
+async def list_results_by_task(db: AsyncSession, task_ids: List[str]) -> Dict[str, List[models.TaskResult]]:
+    if not task_ids:
+        return {}
+    results = (await db.execute(crud.results_by_task_stmt(task_ids))).scalars()
+    return crud.group_results_by_task(task_ids, results)
+
+
+async def count_results_by_task(db: AsyncSession, task_ids: List[str]) -> Dict[str, Tuple[int, int]]:
+    if not task_ids:
+        return {}
+    rows = await db.execute(crud.count_results_by_task_stmt(task_ids))
+    return {task_id: (int(total), int(failed or 0)) for task_id, total, failed in rows}
+
+
+async def upsert_heartbeats(db: AsyncSession, heartbeats: List[Dict[str, Any]], history: List[Dict[str, Any]]) -> None:
+    if not heartbeats:
+        return
+    await db.execute(crud.heartbeat_upsert_stmt(heartbeats))
+    samples = heartbeat_history.sample_rows(history)
+    if samples:
+        samples = heartbeat_history.unseen_samples(samples, await db.execute(crud.stored_samples_stmt(samples)))
+    for stmt in crud.heartbeat_history_stmts(samples):
+        await db.execute(stmt)
+    await db.commit()
+
+
+async def heartbeat_series(
+    db: AsyncSession,
+    resolution: int,
+    start: datetime,
+    end: datetime,
+    hostname: Optional[str] = None,
+    group: Optional[str] = None,
+) -> List[schemas.HeartbeatPoint]:
+    rows = await db.execute(crud.heartbeat_series_stmt(resolution, start, end, hostname, group))
+    return crud.heartbeat_points(rows)
+
+
+async def list_client_public_keys(db: AsyncSession) -> List[models.ClientPublicKey]:
+    return list((await db.execute(select(models.ClientPublicKey))).scalars().all())
+
+
+async def get_client_public_key(db: AsyncSession, hostname: str) -> Optional[models.ClientPublicKey]:
+    return (
+        await db.execute(select(models.ClientPublicKey).where(models.ClientPublicKey.hostname == hostname))
+    ).scalars().first()
+
+
+async def upsert_client_public_key(
+    db: AsyncSession,
+    hostname: str,
+    public_key_pem: str,
+) -> models.ClientPublicKey:
+    now = datetime.now(timezone.utc)
+    record = await get_client_public_key(db, hostname)
+    if record:
+        record.public_key_pem = public_key_pem
+        record.updated_at = now
+    else:
+        record = models.ClientPublicKey(
+            hostname=hostname,
+            public_key_pem=public_key_pem,
+            created_at=now,
+            updated_at=now,
+        )
+        db.add(record)
+    await db.commit()
+    return record
+
+
+async def delete_client_public_key(db: AsyncSession, hostname: str) -> bool:
+    record = await get_client_public_key(db, hostname)
+    if not record:
+        return False
+    await db.delete(record)
+    await db.commit()
+    return True
@@ -1,17 +1,89 @@
+import time
+from typing import Any
+from typing import Dict
+
 from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from app.config import settings
+from app.db_pool import InstrumentedAsyncQueuePool
+from app.db_pool import InstrumentedQueuePool
+from app.db_pool import count_overflow
+from app.metrics import db_commit_seconds
+
+
+def _pool_options(pool_size: int, max_overflow: int) -> Dict[str, Any]:
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        # Recycling below MySQL's wait_timeout replaces a pre-ping round trip on every checkout.
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
 
+# Message consumers and background flushers write through their own pool so ingestion
+# bursts cannot starve API requests of connections.
 engine = create_engine(
     settings.database_url,
-    pool_pre_ping=True,
     future=True,
+    poolclass=InstrumentedQueuePool,
     connect_args={
         "init_command": "SET time_zone = '+08:00'",
         "read_default_file": None
-    }
+    },
+    **_pool_options(settings.ingest_db_pool_size, settings.ingest_db_max_overflow),
 )
+count_overflow(engine)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
 Base = declarative_base()
+
+async_engine = create_async_engine(
+    settings.async_database_url,
+    poolclass=InstrumentedAsyncQueuePool,
+    connect_args={
+        "init_command": "SET time_zone = '+08:00'",
+    },
+    **_pool_options(settings.db_pool_size, settings.db_max_overflow),
+)
+count_overflow(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+ingest_async_engine = create_async_engine(
+    settings.async_database_url,
+    poolclass=InstrumentedAsyncQueuePool,
+    connect_args={
+        "init_command": "SET time_zone = '+08:00'",
+    },
+    **_pool_options(settings.ingest_db_pool_size, settings.ingest_db_max_overflow),
+)
+count_overflow(ingest_async_engine.sync_engine)
+IngestAsyncSessionLocal = async_sessionmaker(bind=ingest_async_engine, autoflush=False, expire_on_commit=False)
+
+
+# AsyncSession commits run through a sync Session as well, so this covers both engines.
+@event.listens_for(Session, "before_commit")
+def _commit_started(session: Session) -> None:
+    session.info["commit_started"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def _commit_finished(session: Session) -> None:
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        db_commit_seconds.observe(time.perf_counter() - started)
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    pools = {
+        "api": async_engine.sync_engine.pool,
+        "ingest": engine.pool,
+        "ingest_async": ingest_async_engine.sync_engine.pool,
+    }
+    return {name: pool.stats() for name, pool in pools.items() if hasattr(pool, "stats")}
@@ -0,0 +1,89 @@
+import threading
+import time
+from typing import Any
+from typing import Dict
+
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.pool import QueuePool
+
+
+class _InstrumentedPool:
+    """Counts checkout wait time, overflow connections and checkout timeouts of a QueuePool.
+
+    Overflow is recorded by the listener count_overflow attaches to the engine.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._overflow_events = 0
+        self._timeouts = 0
+
+    def connect(self) -> Any:
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self._checkouts += 1
+            self._wait_total += waited
+            if waited > self._wait_max:
+                self._wait_max = waited
+        return connection
+
+    def record_overflow(self) -> None:
+        with self._stats_lock:
+            self._overflow_events += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            checkouts = self._checkouts
+            wait_total = self._wait_total
+            wait_max = self._wait_max
+            overflow_events = self._overflow_events
+            timeouts = self._timeouts
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": max(0, self.overflow()),
+            "checkouts": checkouts,
+            "checkout_wait_seconds_total": wait_total,
+            "checkout_wait_seconds_max": wait_max,
+            "overflow_events": overflow_events,
+            "timeouts": timeouts,
+        }
+
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def count_overflow(engine: Engine) -> None:
+    """Counts connections opened beyond pool_size on an engine with an instrumented pool.
+
+    Listening on the engine keeps the count working after dispose() replaces the pool.
+    """
+
+    def on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+        pool = engine.pool
+        # The pool has already reserved the new connection when it is opened, so a
+        # positive overflow() means this one is beyond pool_size.
+        if isinstance(pool, _InstrumentedPool) and pool.overflow() > 0:
+            pool.record_overflow()
+
+    event.listen(engine, "connect", on_connect)
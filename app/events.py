@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import threading
+from typing import Any
+from typing import Callable
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from pydantic_core import to_json
+
+logger = logging.getLogger(__name__)
+
+Event = Tuple[str, str]
+
+
+class Subscription:
+    def __init__(self, bus: "EventBus", loop: asyncio.AbstractEventLoop, max_pending: int) -> None:
+        self._bus = bus
+        self._loop = loop
+        self._queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=max_pending)
+
+    def _push(self, event: Event) -> None:
+        if self._queue.full():
+            # A client that cannot keep up drops its backlog and reloads a full snapshot.
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            event = ("resync", "{}")
+        self._queue.put_nowait(event)
+
+    def deliver(self, event: Event) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._push, event)
+        except RuntimeError:
+            self.close()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    """Fans out change events from consumer threads to streaming API clients."""
+
+    def __init__(self, max_pending: int = 1000) -> None:
+        self._lock = threading.Lock()
+        self._subscribers: Set[Subscription] = set()
+        self._max_pending = max_pending
+        self._forward: Optional[Callable[[str, str], None]] = None
+        self._forward_wanted: Callable[[str], bool] = lambda event_type: True
+
+    def set_forward(
+        self,
+        forward: Optional[Callable[[str, str], None]],
+        wanted: Optional[Callable[[str], bool]] = None,
+    ) -> None:
+        """Also hands locally published events to ``forward``, e.g. to reach other nodes.
+
+        ``wanted`` is asked per event type before anything is encoded; by default every event is forwarded.
+        """
+        self._forward = forward
+        self._forward_wanted = wanted or (lambda event_type: True)
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self, asyncio.get_running_loop(), self._max_pending)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def publish(self, event_type: str, data: Any) -> None:
+        forward = self._forward
+        if forward is not None and not self._forward_wanted(event_type):
+            forward = None
+        if not self._subscribers and forward is None:
+            return
+        try:
+            event = (event_type, to_json(data).decode("utf-8"))
+        except Exception:
+            logger.exception("event_encode_error")
+            return
+        if forward is not None:
+            forward(*event)
+        self.deliver(event)
+
+    def deliver(self, event: Event) -> None:
+        """Passes an already encoded event to local subscribers only."""
+        if not self._subscribers:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+
+event_bus = EventBus()
@@ -0,0 +1,69 @@
+import threading
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
+
+FANOUT_TARGETS = {"group", "all"}
+
+_COUNTERS = ("expected", "received", "done", "failed")
+
+
+class FanoutProgress:
+    """Unflushed per-task fan-out counters, added to task_progress in batches.
+
+    Results for one broadcast arrive from many hosts at once; counting them here and
+    flushing one UPDATE per task per interval keeps them off the task_progress row.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._deltas: Dict[str, Dict[str, int]] = {}
+        # Fully received tasks whose move to done failed; no later delta would name them again.
+        self._finished: Set[str] = set()
+
+    def record(self, task_id: str, succeeded: bool, unexpected: bool = False) -> None:
+        with self._lock:
+            delta = self._deltas.get(task_id)
+            if delta is None:
+                delta = self._deltas[task_id] = dict.fromkeys(_COUNTERS, 0)
+            if unexpected:
+                delta["expected"] += 1
+            delta["received"] += 1
+            delta["done" if succeeded else "failed"] += 1
+
+    def pending(self, task_id: str) -> Optional[Dict[str, int]]:
+        with self._lock:
+            delta = self._deltas.get(task_id)
+            return dict(delta) if delta else None
+
+    def drain(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        return deltas
+
+    def restore(self, deltas: Dict[str, Dict[str, int]]) -> None:
+        """Puts back deltas whose flush failed so they are retried with the next one."""
+        with self._lock:
+            for task_id, delta in deltas.items():
+                current = self._deltas.setdefault(task_id, dict.fromkeys(_COUNTERS, 0))
+                for name in _COUNTERS:
+                    current[name] += delta[name]
+
+    def retry_finished(self, task_ids: Iterable[str]) -> None:
+        """Keeps fully received tasks whose transition to done failed for the next flush."""
+        with self._lock:
+            self._finished.update(task_ids)
+
+    def drain_finished(self) -> List[str]:
+        with self._lock:
+            finished, self._finished = self._finished, set()
+        return sorted(finished)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._deltas)
+
+
+fanout_progress = FanoutProgress()
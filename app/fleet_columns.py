@@ -0,0 +1,173 @@
+import math
+from datetime import datetime
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+_P95 = 0.95
+
+
+class FleetColumns:
+    """Columnar copy of the fleet keyed by host index, for vectorized per-group statistics.
+
+    Not thread-safe on its own; FleetState updates and reads it under its lock.
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self._index: Dict[str, int] = {}
+        self._group_codes: Dict[Optional[str], int] = {}
+        self._group_names: List[Optional[str]] = []
+        self._size = 0
+        self._group = np.zeros(capacity, dtype=np.int32)
+        self._cpu = np.full(capacity, np.nan)
+        self._memory = np.full(capacity, np.nan)
+        self._last_seen = np.full(capacity, np.nan)
+        self._offline = np.zeros(capacity, dtype=bool)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _slot(self, hostname: str) -> int:
+        slot = self._index.get(hostname)
+        if slot is not None:
+            return slot
+        if self._size == len(self._group):
+            self._grow()
+        slot = self._index[hostname] = self._size
+        self._size += 1
+        return slot
+
+    def _grow(self) -> None:
+        capacity = len(self._group) * 2
+        self._group = np.resize(self._group, capacity)
+        self._offline = np.resize(self._offline, capacity)
+        for name in ("_cpu", "_memory", "_last_seen"):
+            grown = np.full(capacity, np.nan)
+            grown[:self._size] = getattr(self, name)[:self._size]
+            setattr(self, name, grown)
+
+    def _group_code(self, group: Optional[str]) -> int:
+        code = self._group_codes.get(group)
+        if code is None:
+            code = self._group_codes[group] = len(self._group_names)
+            self._group_names.append(group)
+        return code
+
+    def set(
+        self,
+        hostname: str,
+        group: Optional[str],
+        status: str,
+        last_heartbeat: Optional[datetime],
+        cpu_usage: Optional[float],
+        memory_usage: Optional[float],
+    ) -> None:
+        slot = self._slot(hostname)
+        self._group[slot] = self._group_code(group)
+        self._offline[slot] = status == "offline"
+        self._last_seen[slot] = last_heartbeat.timestamp() if last_heartbeat else np.nan
+        self._cpu[slot] = np.nan if cpu_usage is None else cpu_usage
+        self._memory[slot] = np.nan if memory_usage is None else memory_usage
+
+    def summarize(self, now: float, stale_after: float) -> Tuple[Dict[str, Optional[float]], List[Dict]]:
+        """Returns fleet-wide stats and one entry per group, computed over all hosts at once."""
+        size = self._size
+        groups = self._group[:size]
+        offline = self._offline[:size]
+        last_seen = self._last_seen[:size]
+        group_count = len(self._group_names)
+
+        # NaN compares False, so hosts that never sent a heartbeat are stale as well.
+        stale = ~offline & ~(last_seen >= now - stale_after)
+        hosts = np.bincount(groups, minlength=group_count)
+        stale_counts = np.bincount(groups, weights=stale, minlength=group_count)
+        offline_counts = np.bincount(groups, weights=offline, minlength=group_count)
+        cpu_avg, cpu_p95, cpu_all = _group_stats(self._cpu[:size], groups, group_count)
+        memory_avg, memory_p95, memory_all = _group_stats(self._memory[:size], groups, group_count)
+
+        fleet = {
+            "group": None,
+            "hosts": size,
+            "stale": int(stale.sum()),
+            "offline": int(offline.sum()),
+            "cpu_avg": cpu_all[0],
+            "cpu_p95": cpu_all[1],
+            "memory_avg": memory_all[0],
+            "memory_p95": memory_all[1],
+        }
+        # One tolist() per column is much cheaper than indexing NumPy scalars per group.
+        columns = zip(
+            self._group_names,
+            hosts.tolist(),
+            stale_counts.tolist(),
+            offline_counts.tolist(),
+            cpu_avg.tolist(),
+            cpu_p95.tolist(),
+            memory_avg.tolist(),
+            memory_p95.tolist(),
+        )
+        per_group = [
+            {
+                "group": name,
+                "hosts": count,
+                "stale": int(stale_count),
+                "offline": int(offline_count),
+                "cpu_avg": _optional(group_cpu_avg),
+                "cpu_p95": _optional(group_cpu_p95),
+                "memory_avg": _optional(group_memory_avg),
+                "memory_p95": _optional(group_memory_p95),
+            }
+            for (
+                name,
+                count,
+                stale_count,
+                offline_count,
+                group_cpu_avg,
+                group_cpu_p95,
+                group_memory_avg,
+                group_memory_p95,
+            ) in columns
+            if count
+        ]
+        return fleet, per_group
+
+
+def _group_stats(
+    values: np.ndarray,
+    groups: np.ndarray,
+    group_count: int,
+) -> Tuple[np.ndarray, np.ndarray, Tuple[Optional[float], Optional[float]]]:
+    """Per-group mean and nearest-rank p95 of the non-NaN values, plus the fleet-wide pair."""
+    valid = ~np.isnan(values)
+    values = values[valid]
+    groups = groups[valid]
+    counts = np.bincount(groups, minlength=group_count)
+    sums = np.bincount(groups, weights=values, minlength=group_count)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+
+    p95 = np.full(group_count, np.nan)
+    if not len(values):
+        return means, p95, (None, None)
+
+    # Offsetting each value by group * span lays every group out as a contiguous ascending
+    # run after one flat sort, which is several times faster than lexsort.
+    low = values.min()
+    span = values.max() - low + 1.0
+    ordered = np.sort(groups * span + (values - low))
+    starts = np.cumsum(counts) - counts
+    present = np.flatnonzero(counts)
+    positions = starts[present] + np.ceil(_P95 * counts[present]).astype(np.int64) - 1
+    p95[present] = ordered[positions] - present * span + low
+
+    rank = math.ceil(_P95 * len(values)) - 1
+    fleet_p95 = float(np.partition(values, rank)[rank])
+    return means, p95, (float(values.mean()), fleet_p95)
+
+
+def _optional(value: float) -> Optional[float]:
+    # NaN is the only value that differs from itself.
+    return None if value != value else value
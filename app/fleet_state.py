@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from pydantic import TypeAdapter
+
+from app import models
+from app import schemas
+from app.config import settings
+from app.events import event_bus
+from app.fleet_columns import FleetColumns
+from app.liveness import DeadlineIndex
+
+_servers_adapter = TypeAdapter(List[schemas.ServerOut])
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Naive DATETIME values read back from MySQL were written as UTC.
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=timezone.utc)
+
+
+class FleetState:
+    """Process-local view of the servers table, kept current by the heartbeat consumer."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._servers: Dict[str, schemas.ServerOut] = {}
+        self._changed: Set[str] = set()
+        self._version = 0
+        self._snapshot_version = -1
+        self._snapshot: Tuple[bytes, str] = (b"[]", "")
+        self._columns = FleetColumns()
+        self._deadlines = DeadlineIndex()
+
+    def load(self, servers: Iterable[models.Server]) -> None:
+        loaded = {server.hostname: self._from_model(server) for server in servers}
+        columns = FleetColumns(max(1024, len(loaded)))
+        deadlines = DeadlineIndex()
+        for record in loaded.values():
+            self._set_columns(columns, record)
+            self._track_liveness(deadlines, record)
+        with self._lock:
+            # Only records that differ from ours go out, so a periodic reload stays cheap to stream.
+            self._changed.update(hostname for hostname, record in loaded.items() if self._servers.get(hostname) != record)
+            self._servers = loaded
+            self._columns = columns
+            self._deadlines = deadlines
+            self._version += 1
+
+    def upsert_server(self, server: models.Server) -> None:
+        record = self._from_model(server)
+        with self._lock:
+            self._servers[record.hostname] = record
+            self._set_columns(self._columns, record)
+            self._track_liveness(self._deadlines, record)
+            self._changed.add(record.hostname)
+            self._version += 1
+
+    def merge(self, records: Iterable[schemas.ServerOut]) -> None:
+        """Applies records broadcast by another node without queueing change events for them.
+
+        Heartbeat fields are only taken from a record that is at least as recent as ours.
+        """
+        with self._lock:
+            for record in records:
+                current = self._servers.get(record.hostname)
+                if (
+                    current is not None
+                    and current.last_heartbeat is not None
+                    and (record.last_heartbeat is None or record.last_heartbeat < current.last_heartbeat)
+                ):
+                    record = current.model_copy(update={"ip": record.ip, "group": record.group})
+                self._servers[record.hostname] = record
+                self._set_columns(self._columns, record)
+                self._track_liveness(self._deadlines, record)
+            self._version += 1
+
+    def apply_heartbeat(self, heartbeat: Dict[str, Any]) -> bool:
+        hostname = heartbeat["hostname"]
+        timestamp = as_utc(heartbeat["timestamp"])
+        with self._lock:
+            current = self._servers.get(hostname)
+            if current is None:
+                current = schemas.ServerOut(
+                    hostname=hostname,
+                    ip=None,
+                    group=None,
+                    status="unknown",
+                    last_heartbeat=None,
+                    cpu_usage=None,
+                    memory_usage=None,
+                )
+            elif current.last_heartbeat and timestamp < current.last_heartbeat:
+                return False
+            record = self._servers[hostname] = current.model_copy(
+                update={
+                    "status": heartbeat["status"],
+                    "last_heartbeat": timestamp,
+                    "cpu_usage": heartbeat["cpu_usage"],
+                    "memory_usage": heartbeat["memory_usage"],
+                }
+            )
+            self._set_columns(self._columns, record)
+            self._track_liveness(self._deadlines, record)
+            self._changed.add(hostname)
+            self._version += 1
+        return True
+
+    def expire(self, cutoff: datetime) -> List[str]:
+        """Marks hosts whose last heartbeat is older than cutoff offline and returns them."""
+        with self._lock:
+            expired = self._deadlines.pop_expired(cutoff.timestamp())
+            for hostname in expired:
+                record = self._servers[hostname] = self._servers[hostname].model_copy(update={"status": "offline"})
+                self._set_columns(self._columns, record)
+                self._changed.add(hostname)
+            if expired:
+                self._version += 1
+        return expired
+
+    def get(self, hostname: str) -> Optional[schemas.ServerOut]:
+        with self._lock:
+            return self._servers.get(hostname)
+
+    def servers(self) -> List[schemas.ServerOut]:
+        with self._lock:
+            return list(self._servers.values())
+
+    def drain_changes(self) -> List[schemas.ServerOut]:
+        with self._lock:
+            changed = [self._servers[hostname] for hostname in self._changed if hostname in self._servers]
+            self._changed = set()
+        return changed
+
+    def snapshot(self) -> Tuple[bytes, str]:
+        """Returns the JSON body of GET /api/servers and its ETag, rebuilt only after a change."""
+        with self._lock:
+            if self._snapshot_version == self._version:
+                return self._snapshot
+            version = self._version
+            servers = list(self._servers.values())
+        body = _servers_adapter.dump_json(servers)
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        with self._lock:
+            if version > self._snapshot_version:
+                self._snapshot_version = version
+                self._snapshot = (body, etag)
+        return body, etag
+
+    def summarize(self, stale_after: float) -> schemas.FleetSummary:
+        """Fleet and per-group CPU/memory statistics plus stale/offline counts."""
+        now = datetime.now(timezone.utc).timestamp()
+        with self._lock:
+            fleet, groups = self._columns.summarize(now, stale_after)
+        return schemas.FleetSummary(
+            fleet=schemas.GroupSummary(**fleet),
+            groups=[schemas.GroupSummary(**group) for group in groups],
+        )
+
+    @staticmethod
+    def _set_columns(columns: FleetColumns, record: schemas.ServerOut) -> None:
+        columns.set(
+            record.hostname,
+            record.group,
+            record.status,
+            record.last_heartbeat,
+            record.cpu_usage,
+            record.memory_usage,
+        )
+
+    @staticmethod
+    def _track_liveness(deadlines: DeadlineIndex, record: schemas.ServerOut) -> None:
+        if record.last_heartbeat is None or record.status == "offline":
+            deadlines.discard(record.hostname)
+        else:
+            deadlines.touch(record.hostname, record.last_heartbeat.timestamp())
+
+    @staticmethod
+    def _from_model(server: models.Server) -> schemas.ServerOut:
+        return schemas.ServerOut(
+            hostname=server.hostname,
+            ip=server.ip,
+            group=server.group,
+            status=server.status,
+            last_heartbeat=as_utc(server.last_heartbeat),
+            cpu_usage=server.cpu_usage,
+            memory_usage=server.memory_usage,
+        )
+
+
+fleet_state = FleetState()
+
+
+async def pump_server_changes() -> None:
+    """Publishes coalesced server changes every STREAM_SERVER_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(settings.stream_server_interval)
+        changes = fleet_state.drain_changes()
+        if changes:
+            event_bus.publish("servers", changes)
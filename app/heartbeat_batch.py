@@ -0,0 +1,57 @@
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+class HeartbeatBatch:
+    """Buffers heartbeat deliveries and keeps only the latest beat per hostname.
+
+    Every beat is also kept in delivery order for the heartbeat history; only the
+    servers upsert is coalesced.
+    """
+
+    def __init__(self, max_size: int, max_delay: float) -> None:
+        self._max_size = max(1, max_size)
+        self._max_delay = max_delay
+        self._latest: Dict[str, Dict[str, Any]] = {}
+        self._history: List[Dict[str, Any]] = []
+        self._count = 0
+        self._last_tag: Optional[int] = None
+        self._first_at = 0.0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, delivery_tag: int, heartbeat: Optional[Dict[str, Any]]) -> None:
+        if self._count == 0:
+            self._first_at = time.monotonic()
+        self._count += 1
+        self._last_tag = delivery_tag
+        if not heartbeat:
+            return
+        self._history.append(heartbeat)
+        hostname = heartbeat["hostname"]
+        current = self._latest.get(hostname)
+        if current is None or heartbeat["timestamp"] >= current["timestamp"]:
+            self._latest[hostname] = heartbeat
+
+    def due(self) -> bool:
+        if self._count == 0:
+            return False
+        if self._count >= self._max_size:
+            return True
+        return time.monotonic() - self._first_at >= self._max_delay
+
+    def drain(self) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Optional[int]]:
+        """Returns the latest beat per host, every beat received, and the last delivery tag."""
+        heartbeats = list(self._latest.values())
+        history = self._history
+        last_tag = self._last_tag
+        self._latest = {}
+        self._history = []
+        self._count = 0
+        self._last_tag = None
+        return heartbeats, history, last_tag
@@ -0,0 +1,100 @@
+import math
+from datetime import datetime, timezone
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+# Rollup resolutions in seconds: 1m, 5m and 1h.
+RESOLUTIONS = (60, 300, 3600)
+
+
+def _utc_naive(value: datetime) -> datetime:
+    # DATETIME columns hold naive UTC, as for Server.last_heartbeat.
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def bucket_start(value: datetime, resolution: int) -> datetime:
+    value = _utc_naive(value)
+    epoch = int(value.replace(tzinfo=timezone.utc).timestamp())
+    return datetime.fromtimestamp(epoch - epoch % resolution, timezone.utc).replace(tzinfo=None)
+
+
+def _numeric(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _has_usage(heartbeat: Dict[str, Any]) -> bool:
+    return _numeric(heartbeat.get("cpu_usage")) and _numeric(heartbeat.get("memory_usage"))
+
+
+def sample_rows(heartbeats: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """One raw sample per (hostname, second) for heartbeats that carry numeric CPU and memory usage.
+
+    Timestamps are cut to whole seconds, the precision of the ts column, so a redelivered
+    beat always maps to the key of the stored sample.
+    """
+    rows: Dict[Tuple[str, datetime], Dict[str, Any]] = {}
+    for heartbeat in heartbeats:
+        if not _has_usage(heartbeat):
+            continue
+        ts = _utc_naive(heartbeat["timestamp"]).replace(microsecond=0)
+        rows.setdefault((heartbeat["hostname"], ts), {
+            "hostname": heartbeat["hostname"],
+            "ts": ts,
+            "cpu_usage": heartbeat["cpu_usage"],
+            "memory_usage": heartbeat["memory_usage"],
+        })
+    return list(rows.values())
+
+
+def unseen_samples(samples: List[Dict[str, Any]], stored: Iterable[Tuple[str, datetime]]) -> List[Dict[str, Any]]:
+    """Drops samples whose (hostname, ts) is already stored, e.g. from a redelivered batch."""
+    stored_keys = {(hostname, ts) for hostname, ts in stored}
+    return [sample for sample in samples if (sample["hostname"], sample["ts"]) not in stored_keys]
+
+
+def rollup_rows(samples: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Pre-aggregates new samples into one row per (resolution, hostname, bucket) for an additive upsert.
+
+    Samples without numeric usage are skipped rather than failing the whole flush.
+    """
+    rows: Dict[Tuple[int, str, datetime], Dict[str, Any]] = {}
+    for sample in samples:
+        if not _has_usage(sample):
+            continue
+        cpu = float(sample["cpu_usage"])
+        memory = float(sample["memory_usage"])
+        for resolution in RESOLUTIONS:
+            key = (resolution, sample["hostname"], bucket_start(sample["ts"], resolution))
+            row = rows.get(key)
+            if row is None:
+                rows[key] = {
+                    "resolution": resolution,
+                    "hostname": key[1],
+                    "bucket": key[2],
+                    "samples": 1,
+                    "cpu_sum": cpu,
+                    "cpu_max": cpu,
+                    "memory_sum": memory,
+                    "memory_max": memory,
+                }
+                continue
+            row["samples"] += 1
+            row["cpu_sum"] += cpu
+            row["cpu_max"] = max(row["cpu_max"], cpu)
+            row["memory_sum"] += memory
+            row["memory_max"] = max(row["memory_max"], memory)
+    return list(rows.values())
+
+
+def choose_resolution(start: datetime, end: datetime, max_points: int) -> int:
+    """Returns the finest rollup that covers start..end in at most max_points buckets."""
+    span = (_utc_naive(end) - _utc_naive(start)).total_seconds()
+    for resolution in RESOLUTIONS:
+        if span / resolution <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
@@ -0,0 +1,50 @@
+import heapq
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+
+class DeadlineIndex:
+    """Min-heap of hosts ordered by last heartbeat, with at most one live entry per host.
+
+    A newer heartbeat only updates the recorded time; the host's heap entry is moved
+    forward when it reaches the top. A sweep therefore pops just the entries that came
+    due instead of scanning every host.
+    """
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, str]] = []
+        self._last_seen: Dict[str, float] = {}
+        # Time of each host's live heap entry; any other entry for the host is stale.
+        self._scheduled: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._last_seen)
+
+    def touch(self, hostname: str, last_seen: float) -> None:
+        self._last_seen[hostname] = last_seen
+        scheduled = self._scheduled.get(hostname)
+        if scheduled is None or last_seen < scheduled:
+            self._scheduled[hostname] = last_seen
+            heapq.heappush(self._heap, (last_seen, hostname))
+
+    def discard(self, hostname: str) -> None:
+        self._last_seen.pop(hostname, None)
+
+    def pop_expired(self, cutoff: float) -> List[str]:
+        """Removes and returns hosts whose last heartbeat is older than cutoff."""
+        expired = []
+        while self._heap and self._heap[0][0] < cutoff:
+            scheduled, hostname = heapq.heappop(self._heap)
+            if self._scheduled.get(hostname) != scheduled:
+                continue
+            last_seen = self._last_seen.get(hostname)
+            if last_seen is not None and last_seen >= cutoff:
+                self._scheduled[hostname] = last_seen
+                heapq.heappush(self._heap, (last_seen, hostname))
+                continue
+            del self._scheduled[hostname]
+            if last_seen is not None:
+                del self._last_seen[hostname]
+                expired.append(hostname)
+        return expired
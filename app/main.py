@@ -1,46 +1,149 @@
+import asyncio
+import logging
+import time
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Generator
+from typing import AsyncGenerator
+from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Tuple
 
 import uvicorn
 from fastapi import Depends
 from fastapi import FastAPI
 from fastapi import HTTPException
+from fastapi import Query
+from fastapi import Request
+from fastapi import Response
 from fastapi import status
 from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import crud
+from app import crud_async
+from app import metrics as metrics_registry
 from app import models
 from app import schemas
+from app.cluster import broadcast_key_change
+from app.cluster import cluster_bus
+from app.cluster import join_cluster
+from app.config import settings
+from app.db import AsyncSessionLocal
 from app.db import Base
 from app.db import SessionLocal
 from app.db import engine
-from app.mq import publish_command
+from app.db import pool_stats
+from app.events import event_bus
+from app.fanout_progress import FANOUT_TARGETS
+from app.fanout_progress import fanout_progress
+from app.fleet_state import as_utc
+from app.fleet_state import fleet_state
+from app.fleet_state import pump_server_changes
+from app.heartbeat_history import RESOLUTIONS
+from app.heartbeat_history import bucket_start
+from app.heartbeat_history import choose_resolution
+from app.metrics import http_request_seconds
+from app.metrics import render_gauges
+from app.mq import batch_publisher
+from app.mq import drain_consumers
+from app.mq import publish_command_async
+from app.mq import publish_commands_async
+from app.mq import publisher
 from app.mq import start_consumers
+from app.mq_handlers import public_key_store
+from app.result_store import iter_output
+from app.result_store import parse_range
+from app.schema_upgrade import upgrade_schema
+from app.util.cursor_util import decode_cursor
+from app.util.cursor_util import encode_cursor
 from app.util.sign_util import load_public_key_from_pem
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title="DevOps Control Plane")
 
 static_dir = Path(__file__).resolve().parent.parent / "static"
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # The route template keeps label cardinality bounded, unlike the raw path.
+    route = request.scope.get("route")
+    http_request_seconds.observe(
+        time.perf_counter() - started,
+        request.method,
+        getattr(route, "path", "unmatched"),
+        str(response.status_code),
+    )
+    return response
+
+
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+def fleet_reload_needed() -> bool:
+    """Whether this process misses heartbeats and must refresh its fleet view from the database.
+
+    Without cluster broadcasts an API process only sees the heartbeats it consumes itself:
+    none with EMBEDDED_CONSUMERS off, and only a share of them under several uvicorn workers.
+    """
+    return not settings.cluster_broadcast and (not settings.embedded_consumers or settings.web_concurrency > 1)
+
+
+def reload_fleet() -> None:
+    with SessionLocal() as db:
+        fleet_state.load(crud.get_servers(db))
+
+
+async def reload_fleet_periodically() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(settings.fleet_reload_interval)
+        try:
+            await loop.run_in_executor(None, reload_fleet)
+        except Exception:
+            logger.exception("fleet_reload_error")
 
 
 @app.on_event("startup")
 def startup() -> None:
     Base.metadata.create_all(bind=engine)
-    start_consumers()
+    upgrade_schema(engine)
+    reload_fleet()
+    if settings.cluster_broadcast:
+        join_cluster(reload_fleet=not settings.embedded_consumers)
+    # With EMBEDDED_CONSUMERS off the API is stateless and consumers run in `python -m app.worker`.
+    if settings.embedded_consumers:
+        start_consumers()
+
+
+@app.on_event("startup")
+async def start_stream_pump() -> None:
+    app.state.stream_pump = asyncio.create_task(pump_server_changes())
+    if fleet_reload_needed():
+        logger.warning(
+            "Heartbeats are not all seen by this process; set CLUSTER_BROADCAST=true. "
+            f"Reloading the server list from the database every {settings.fleet_reload_interval}s instead."
+        )
+        app.state.fleet_reload = asyncio.create_task(reload_fleet_periodically())
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    if settings.embedded_consumers:
+        await drain_consumers(settings.consumer_shutdown_timeout)
+    publisher.close()
+    batch_publisher.close()
+    cluster_bus.close()
 
 
 @app.get("/")
@@ -53,95 +156,435 @@ def health() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/api/health/pools")
+async def health_pools() -> dict:
+    return pool_stats()
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    pools = pool_stats()
+    lines = [metrics_registry.render().rstrip("\n")]
+    for key, documentation in (
+        ("checked_out", "Connections currently checked out."),
+        ("overflow", "Connections open beyond pool_size."),
+        ("checkouts", "Connections checked out since start."),
+        ("checkout_wait_seconds_total", "Total time spent waiting for a connection."),
+        ("overflow_events", "Overflow connections opened since start."),
+        ("timeouts", "Checkouts that timed out waiting for a connection."),
+    ):
+        samples = {(name,): stats[key] for name, stats in pools.items()}
+        lines.extend(render_gauges(f"db_pool_{key}", documentation, ["pool"], samples))
+    return Response(content="\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/servers", response_model=List[schemas.ServerOut])
-def list_servers(db: Session = Depends(get_db)) -> List[models.Server]:
-    return crud.get_servers(db)
+async def list_servers(request: Request) -> Response:
+    body, etag = fleet_state.snapshot()
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+@app.get("/api/fleet/summary", response_model=schemas.FleetSummary)
+async def fleet_summary(stale_after: Optional[float] = Query(None, gt=0)) -> schemas.FleetSummary:
+    return fleet_state.summarize(stale_after or settings.fleet_stale_after)
 
 
 @app.post("/api/servers", response_model=schemas.ServerOut, status_code=status.HTTP_201_CREATED)
-def create_server(server_in: schemas.ServerCreate, db: Session = Depends(get_db)) -> models.Server:
-    existing = crud.get_server_by_hostname(db, server_in.hostname)
+async def create_server(server_in: schemas.ServerCreate, db: AsyncSession = Depends(get_db)) -> models.Server:
+    existing = await crud_async.get_server_by_hostname(db, server_in.hostname)
     if existing:
         raise HTTPException(status_code=409, detail="hostname already exists")
-    return crud.create_server(db, server_in)
+    server = await crud_async.create_server(db, server_in)
+    fleet_state.upsert_server(server)
+    return server
+
+
+async def load_heartbeat_series(
+    db: AsyncSession,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    resolution: Optional[int],
+    hostname: Optional[str] = None,
+    group: Optional[str] = None,
+) -> schemas.HeartbeatSeries:
+    # Query strings may carry naive or offset timestamps; naive ones are taken as UTC.
+    end = as_utc(end) or datetime.now(timezone.utc)
+    start = as_utc(start) or end - timedelta(hours=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if resolution is None:
+        resolution = choose_resolution(start, end, settings.heartbeat_series_max_points)
+    elif resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {list(RESOLUTIONS)}")
+    points = await crud_async.heartbeat_series(
+        db,
+        resolution,
+        bucket_start(start, resolution),
+        bucket_start(end, resolution) + timedelta(seconds=resolution),
+        hostname=hostname,
+        group=group,
+    )
+    return schemas.HeartbeatSeries(hostname=hostname, group=group, resolution=resolution, points=points)
 
 
-@app.get("/api/tasks", response_model=List[schemas.TaskOut])
-def list_tasks(db: Session = Depends(get_db)) -> List[models.Task]:
-    return crud.list_tasks(db)
+@app.get("/api/servers/{hostname}/heartbeats", response_model=schemas.HeartbeatSeries)
+async def get_server_heartbeats(
+    hostname: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+) -> schemas.HeartbeatSeries:
+    return await load_heartbeat_series(db, start, end, resolution, hostname=hostname)
+
+
+@app.get("/api/groups/{group}/heartbeats", response_model=schemas.HeartbeatSeries)
+async def get_group_heartbeats(
+    group: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+) -> schemas.HeartbeatSeries:
+    return await load_heartbeat_series(db, start, end, resolution, group=group)
+
+
+async def load_task_page(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    target_type: Optional[str] = None,
+    target: Optional[str] = None,
+    user: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+) -> Tuple[List[models.Task], Optional[str]]:
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    tasks = await crud_async.list_tasks(
+        db,
+        limit + 1,
+        after=after,
+        status=status,
+        target_type=target_type,
+        target=target,
+        user=user,
+        created_after=created_after,
+        created_before=created_before,
+    )
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_cursor(tasks[-1].created_at, tasks[-1].id)
+    return tasks, next_cursor
+
+
+@app.get("/api/tasks", response_model=schemas.TaskPage)
+async def list_tasks(
+    page: Tuple[List[models.Task], Optional[str]] = Depends(load_task_page),
+) -> schemas.TaskPage:
+    tasks, next_cursor = page
+    return schemas.TaskPage(
+        items=[schemas.TaskOut.model_validate(task) for task in tasks],
+        next_cursor=next_cursor,
+    )
 
 
-@app.post("/api/commands", response_model=schemas.TaskOut, status_code=status.HTTP_201_CREATED)
-def create_command(command_in: schemas.CommandCreate, db: Session = Depends(get_db)) -> models.Task:
-    target_type = command_in.target_type
+@app.get("/api/tasks/with-results", response_model=schemas.TaskWithResultsPage)
+async def list_tasks_with_results(
+    summary: bool = False,
+    page: Tuple[List[models.Task], Optional[str]] = Depends(load_task_page),
+    db: AsyncSession = Depends(get_db),
+) -> schemas.TaskWithResultsPage:
+    tasks, next_cursor = page
+    task_ids = [task.task_id for task in tasks]
+    items = []
+    if summary:
+        counts = await crud_async.count_results_by_task(db, task_ids)
+        for task in tasks:
+            item = schemas.TaskWithResults.model_validate(task)
+            item.result_count, item.failed_count = counts.get(task.task_id, (0, 0))
+            items.append(item)
+    else:
+        results = await crud_async.list_results_by_task(db, task_ids)
+        for task in tasks:
+            item = schemas.TaskWithResults.model_validate(task)
+            item.results = [schemas.TaskResultOut.model_validate(result) for result in results[task.task_id]]
+            item.result_count = len(item.results)
+            item.failed_count = sum(1 for result in item.results if crud.result_failed(result.exit_code))
+            items.append(item)
+    return schemas.TaskWithResultsPage(items=items, next_cursor=next_cursor)
+
+
+def command_routing_key(target_type: str, target: Optional[str]) -> str:
     if target_type not in {"node", "group", "all"}:
-        raise HTTPException(status_code=400, detail="invalid target_type")
-    routing_key = "cmd.all"
-    target = command_in.target
-    if target_type == "node":
-        if not target:
-            raise HTTPException(status_code=400, detail="target required for node")
-        routing_key = f"cmd.node.{target}"
-    elif target_type == "group":
-        if not target:
-            raise HTTPException(status_code=400, detail="target required for group")
-        routing_key = f"cmd.group.{target}"
+        raise ValueError("invalid target_type")
+    if target_type == "all":
+        return "cmd.all"
+    if not target:
+        raise ValueError(f"target required for {target_type}")
+    return f"cmd.{target_type}.{target}"
+
+
+def command_payload(task_id: str, command_in: schemas.CommandCreate) -> dict:
+    return {
+        "task_id": task_id,
+        "command": command_in.command,
+        "timeout": command_in.timeout,
+        "user": command_in.user,
+        "timestamp": int(datetime.now(timezone.utc).timestamp())
+    }
+
+
+async def fanout_hosts(db: AsyncSession, tasks: List[Tuple[str, str, Optional[str]]]) -> Dict[str, List[str]]:
+    """Maps each group/all (task_id, target_type, target) to the hostnames it targets."""
+    tasks = [task for task in tasks if task[1] in FANOUT_TARGETS]
+    if not tasks:
+        return {}
+    # Only an "all" target needs the whole servers table.
+    groups = None if any(target_type == "all" for _, target_type, _ in tasks) else sorted({task[2] for task in tasks})
+    hosts_by_group: Dict[Optional[str], List[str]] = {}
+    everyone = []
+    for hostname, group in await crud_async.list_server_groups(db, groups):
+        hosts_by_group.setdefault(group, []).append(hostname)
+        everyone.append(hostname)
+    return {
+        task_id: everyone if target_type == "all" else hosts_by_group.get(target, [])
+        for task_id, target_type, target in tasks
+    }
+
+
+def no_hosts_error(target_type: str, target: Optional[str]) -> str:
+    return "no servers registered" if target_type == "all" else f"no servers in group {target}"
+
+
+@app.post("/api/commands", response_model=schemas.TaskOut, status_code=status.HTTP_201_CREATED)
+async def create_command(command_in: schemas.CommandCreate, db: AsyncSession = Depends(get_db)) -> models.Task:
+    try:
+        routing_key = command_routing_key(command_in.target_type, command_in.target)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
     task_id = uuid.uuid4().hex
+    # A fan-out to no hosts would never receive a result and never complete.
+    hosts_by_task = await fanout_hosts(db, [(task_id, command_in.target_type, command_in.target)])
+    if hosts_by_task and not hosts_by_task[task_id]:
+        raise HTTPException(status_code=400, detail=no_hosts_error(command_in.target_type, command_in.target))
     task = models.Task(
         task_id=task_id,
-        target_type=target_type,
-        target=target,
+        target_type=command_in.target_type,
+        target=command_in.target,
         command=command_in.command,
         timeout=command_in.timeout,
         user=command_in.user,
         status="sent",
         created_at=datetime.now(timezone.utc),
     )
-    crud.create_task(db, task)
-    payload = {
-        "task_id": task_id,
-        "command": command_in.command,
-        "timeout": command_in.timeout,
-        "user": command_in.user,
-        "timestamp": int(datetime.now(timezone.utc).timestamp())
-    }
-    publish_command(payload, routing_key)
+    await crud_async.create_task(db, task)
+    await crud_async.create_fanout(db, hosts_by_task)
+    event_bus.publish("task", schemas.TaskOut.model_validate(task))
+    await publish_command_async(command_payload(task_id, command_in), routing_key)
     return task
 
 
+@app.post("/api/commands/batch", response_model=schemas.CommandBatchOut)
+async def create_command_batch(batch_in: schemas.CommandBatchCreate, db: AsyncSession = Depends(get_db)) -> schemas.CommandBatchOut:
+    if not batch_in.items:
+        raise HTTPException(status_code=400, detail="items required")
+    if len(batch_in.items) > settings.command_batch_max:
+        raise HTTPException(status_code=400, detail=f"too many commands (max {settings.command_batch_max})")
+
+    created_at = datetime.now(timezone.utc)
+    items: List[schemas.CommandBatchItemOut] = []
+    rows = []
+    messages = []
+    for index, command_in in enumerate(batch_in.items):
+        try:
+            routing_key = command_routing_key(command_in.target_type, command_in.target)
+        except ValueError as exc:
+            items.append(schemas.CommandBatchItemOut(index=index, status="rejected", error=str(exc)))
+            continue
+        task_id = uuid.uuid4().hex
+        rows.append({
+            "task_id": task_id,
+            "target_type": command_in.target_type,
+            "target": command_in.target,
+            "command": command_in.command,
+            "timeout": command_in.timeout,
+            "user": command_in.user,
+            "status": "pending",
+            "created_at": created_at,
+        })
+        messages.append((command_payload(task_id, command_in), routing_key))
+        items.append(schemas.CommandBatchItemOut(index=index, task_id=task_id, status="pending"))
+
+    hosts_by_task = await fanout_hosts(db, [(row["task_id"], row["target_type"], row["target"]) for row in rows])
+    empty = {task_id for task_id, hostnames in hosts_by_task.items() if not hostnames}
+    if empty:
+        for item in items:
+            if item.task_id in empty:
+                command_in = batch_in.items[item.index]
+                item.task_id = None
+                item.status = "rejected"
+                item.error = no_hosts_error(command_in.target_type, command_in.target)
+        kept = [index for index, row in enumerate(rows) if row["task_id"] not in empty]
+        rows = [rows[index] for index in kept]
+        messages = [messages[index] for index in kept]
+        hosts_by_task = {task_id: hostnames for task_id, hostnames in hosts_by_task.items() if hostnames}
+
+    # Rows exist before publishing so results can never arrive for an unknown task.
+    await crud_async.create_tasks(db, rows)
+    await crud_async.create_fanout(db, hosts_by_task)
+    errors = await publish_commands_async(messages)
+
+    pending = [item for item in items if item.task_id]
+    for item, error in zip(pending, errors):
+        item.status = "failed" if error else "sent"
+        if error:
+            item.error = str(error) or type(error).__name__
+    sent_ids = [item.task_id for item in pending if item.status == "sent"]
+    failed_ids = [item.task_id for item in pending if item.status == "failed"]
+    await crud_async.transition_tasks(db, sent_ids, "sent", ["pending"])
+    await crud_async.transition_tasks(db, failed_ids, "failed", ["pending"])
+
+    for row, item in zip(rows, pending):
+        event_bus.publish("task", schemas.TaskOut(**{**row, "status": item.status}))
+    return schemas.CommandBatchOut(
+        total=len(items),
+        sent=len(sent_ids),
+        failed=len(items) - len(sent_ids),
+        items=items,
+    )
+
+
 @app.get("/api/tasks/{task_id}/results", response_model=List[schemas.TaskResultOut])
-def get_results(task_id: str, db: Session = Depends(get_db)) -> List[models.TaskResult]:
-    return crud.list_task_results(db, task_id)
+async def get_results(task_id: str, db: AsyncSession = Depends(get_db)) -> List[models.TaskResult]:
+    return await crud_async.list_task_results(db, task_id)
+
+
+@app.get("/api/tasks/{task_id}/progress", response_model=schemas.TaskProgressOut)
+async def get_task_progress(task_id: str, db: AsyncSession = Depends(get_db)) -> schemas.TaskProgressOut:
+    progress = await crud_async.get_task_progress(db, task_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="progress not found")
+    out = schemas.TaskProgressOut.model_validate(progress)
+    # Counts recorded by this process but not flushed yet.
+    pending = fanout_progress.pending(task_id)
+    if pending:
+        out = out.model_copy(update={name: getattr(out, name) + value for name, value in pending.items()})
+    return out
+
+
+@app.get("/api/tasks/{task_id}/executions", response_model=List[schemas.TaskExecutionOut])
+async def list_task_executions(
+    task_id: str,
+    status: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_db),
+) -> List[models.TaskExecution]:
+    return await crud_async.list_task_executions(db, task_id, status)
+
+
+@app.get("/api/results/{result_uid}/{stream}")
+async def get_result_output(
+    result_uid: str,
+    stream: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+) -> Response:
+    if stream not in {"stdout", "stderr"}:
+        raise HTTPException(status_code=404, detail="unknown output stream")
+    result = await crud_async.get_task_result_by_uid(db, result_uid)
+    if not result:
+        raise HTTPException(status_code=404, detail="result not found")
+    chunked = getattr(result, f"{stream}_truncated")
+    inline = b"" if chunked else (getattr(result, stream) or "").encode("utf-8")
+    size = getattr(result, f"{stream}_size") if chunked else len(inline)
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(
+            status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    start, end = byte_range or (0, size - 1)
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(end - start + 1)}
+    status_code = status.HTTP_200_OK
+    if byte_range:
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    media_type = "text/plain; charset=utf-8"
+    if not chunked:
+        return Response(content=inline[start:end + 1], status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(
+        iter_output(AsyncSessionLocal, result_uid, stream, start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type,
+    )
+
+
+@app.get("/api/stream")
+async def stream(request: Request) -> StreamingResponse:
+    subscription = event_bus.subscribe()
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                event = await subscription.get(timeout=15)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event_type, data = event
+                yield f"event: {event_type}\ndata: {data}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/api/client-keys", response_model=List[schemas.ClientPublicKeyOut])
-def list_client_keys(db: Session = Depends(get_db)) -> List[models.ClientPublicKey]:
-    return crud.list_client_public_keys(db)
+async def list_client_keys(db: AsyncSession = Depends(get_db)) -> List[models.ClientPublicKey]:
+    return await crud_async.list_client_public_keys(db)
 
 
 @app.get("/api/client-keys/{hostname}", response_model=schemas.ClientPublicKeyOut)
-def get_client_key(hostname: str, db: Session = Depends(get_db)) -> models.ClientPublicKey:
-    record = crud.get_client_public_key(db, hostname)
+async def get_client_key(hostname: str, db: AsyncSession = Depends(get_db)) -> models.ClientPublicKey:
+    record = await crud_async.get_client_public_key(db, hostname)
     if not record:
         raise HTTPException(status_code=404, detail="public key not found")
     return record
 
 
 @app.put("/api/client-keys/{hostname}", response_model=schemas.ClientPublicKeyOut)
-def upsert_client_key(
+async def upsert_client_key(
     hostname: str,
     key_in: schemas.ClientPublicKeyIn,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> models.ClientPublicKey:
     if not load_public_key_from_pem(key_in.public_key_pem):
         raise HTTPException(status_code=400, detail="invalid public key pem")
-    return crud.upsert_client_public_key(db, hostname, key_in.public_key_pem)
+    record = await crud_async.upsert_client_public_key(db, hostname, key_in.public_key_pem)
+    public_key_store.invalidate(hostname)
+    broadcast_key_change(hostname)
+    return record
 
 
 @app.delete("/api/client-keys/{hostname}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_client_key(hostname: str, db: Session = Depends(get_db)) -> None:
-    deleted = crud.delete_client_public_key(db, hostname)
+async def delete_client_key(hostname: str, db: AsyncSession = Depends(get_db)) -> None:
+    deleted = await crud_async.delete_client_public_key(db, hostname)
+    public_key_store.invalidate(hostname)
+    broadcast_key_change(hostname)
     if not deleted:
         raise HTTPException(status_code=404, detail="public key not found")
 
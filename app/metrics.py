@@ -0,0 +1,184 @@
+import bisect
+import threading
+import time
+from abc import ABC
+from abc import abstractmethod
+from contextlib import contextmanager
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric(ABC):
+    """Base for metrics whose series are written to a per-thread shard and summed on scrape.
+
+    Only the owning thread writes to a shard, so the hot path takes no lock.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards_lock = threading.Lock()
+        self._shards: List[Dict[LabelValues, List[float]]] = []
+        registry.append(self)
+
+    def _series(self, labels: LabelValues) -> List[float]:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        series = shard.get(labels)
+        if series is None:
+            series = shard[labels] = self._new_series()
+        return series
+
+    @abstractmethod
+    def _new_series(self) -> List[float]:
+        """Zeroed storage for one label set."""
+
+    def _merged(self) -> Dict[LabelValues, List[float]]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        merged: Dict[LabelValues, List[float]] = {}
+        for shard in shards:
+            for labels, series in list(shard.items()):
+                total = merged.get(labels)
+                if total is None:
+                    merged[labels] = list(series)
+                else:
+                    for index, value in enumerate(series):
+                        total[index] += value
+        return merged
+
+    def _label_text(self, labels: LabelValues, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, series in sorted(self._merged().items()):
+            lines.extend(self._render_series(labels, series))
+        return lines
+
+    @abstractmethod
+    def _render_series(self, labels: LabelValues, series: List[float]) -> List[str]:
+        """Exposition lines for one label set."""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        # Text format 0.0.4 needs the HELP/TYPE family name to match the _total sample name.
+        if not name.endswith("_total"):
+            name = f"{name}_total"
+        super().__init__(name, documentation, labelnames)
+
+    def _new_series(self) -> List[float]:
+        return [0.0]
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._series(labels)[0] += amount
+
+    def _render_series(self, labels: LabelValues, series: List[float]) -> List[str]:
+        return [f"{self.name}{self._label_text(labels)} {_format(series[0])}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self) -> List[float]:
+        # One slot per bucket plus +Inf, then the sum.
+        return [0.0] * (len(self.buckets) + 2)
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series(labels)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def _render_series(self, labels: LabelValues, series: List[float]) -> List[str]:
+        lines = []
+        cumulative = 0.0
+        for bound, count in zip(self.buckets + (float("inf"),), series):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _format(bound)
+            bucket_labels = self._label_text(labels, 'le="' + le + '"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {_format(cumulative)}")
+        lines.append(f"{self.name}_sum{self._label_text(labels)} {_format(series[-1])}")
+        lines.append(f"{self.name}_count{self._label_text(labels)} {_format(cumulative)}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render_gauges(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str],
+    samples: Dict[LabelValues, float],
+) -> List[str]:
+    """Renders values read at scrape time, such as connection pool counts."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in sorted(samples.items()):
+        pairs = ",".join(f'{label}="{_escape(item)}"' for label, item in zip(labelnames, labels))
+        lines.append(f"{name}{{{pairs}}} {_format(value)}" if pairs else f"{name} {_format(value)}")
+    return lines
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+registry: List[_Metric] = []
+
+mq_messages = Counter("mq_messages_total", "Messages consumed per queue.", ["queue"])
+mq_handler_seconds = Histogram("mq_handler_seconds", "Time spent handling one message.", ["queue"])
+signature_verify_seconds = Histogram("signature_verify_seconds", "Time spent verifying a message signature.")
+db_commit_seconds = Histogram("db_commit_seconds", "Time spent in Session.commit, including the flush.")
+publish_seconds = Histogram("publish_seconds", "Time spent publishing commands to RabbitMQ.", ["mode"])
+http_request_seconds = Histogram(
+    "http_request_seconds",
+    "API request latency until the response starts.",
+    ["method", "route", "status"],
+)
@@ -1,11 +1,16 @@
 from datetime import datetime, timezone
 
+from sqlalchemy import BigInteger
+from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import Float
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import LargeBinary
 from sqlalchemy import String
 from sqlalchemy import Text
+from sqlalchemy import false
 
 from app.db import Base
 
@@ -24,6 +29,40 @@ class Server(Base):
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
 
 
+class HeartbeatSample(Base):
+    __tablename__ = "heartbeat_samples"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    hostname = Column(String(128), nullable=False)
+    ts = Column(DateTime, nullable=False)
+    cpu_usage = Column(Float, nullable=False)
+    memory_usage = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ux_heartbeat_samples_host_ts", "hostname", "ts", unique=True),
+        Index("ix_heartbeat_samples_ts", "ts"),
+    )
+
+
+class HeartbeatRollup(Base):
+    __tablename__ = "heartbeat_rollups"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    resolution = Column(Integer, nullable=False)
+    hostname = Column(String(128), nullable=False)
+    bucket = Column(DateTime, nullable=False)
+    samples = Column(Integer, nullable=False)
+    cpu_sum = Column(Float, nullable=False)
+    cpu_max = Column(Float, nullable=False)
+    memory_sum = Column(Float, nullable=False)
+    memory_max = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ux_heartbeat_rollups_res_host_bucket", "resolution", "hostname", "bucket", unique=True),
+        Index("ix_heartbeat_rollups_res_bucket", "resolution", "bucket"),
+    )
+
+
 class Task(Base):
     __tablename__ = "tasks"
 
@@ -37,18 +76,76 @@ class Task(Base):
     status = Column(String(32), nullable=False, default="pending")
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
 
+    __table_args__ = (
+        Index("ix_tasks_created_at_id", "created_at", "id"),
+        Index("ix_tasks_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_tasks_target_created_at_id", "target_type", "target", "created_at", "id"),
+        Index("ix_tasks_user_created_at_id", "user", "created_at", "id"),
+    )
+
 
 class TaskResult(Base):
     __tablename__ = "task_results"
 
     id = Column(Integer, primary_key=True, index=True)
     task_id = Column(String(64), index=True, nullable=False)
+    hostname = Column(String(128), nullable=True)
+    result_uid = Column(String(64), unique=True, index=True, nullable=True)
     exit_code = Column(Integer, nullable=True)
     stdout = Column(Text, nullable=True)
     stderr = Column(Text, nullable=True)
+    stdout_size = Column(Integer, nullable=True)
+    stderr_size = Column(Integer, nullable=True)
+    stdout_truncated = Column(Boolean, nullable=False, default=False, server_default=false())
+    stderr_truncated = Column(Boolean, nullable=False, default=False, server_default=false())
     timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
 
 
+class TaskExecution(Base):
+    __tablename__ = "task_executions"
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(String(64), nullable=False)
+    hostname = Column(String(128), nullable=False)
+    status = Column(String(32), nullable=False, default="pending")
+    exit_code = Column(Integer, nullable=True)
+    result_uid = Column(String(64), nullable=True)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    __table_args__ = (
+        Index("ux_task_executions_task_host", "task_id", "hostname", unique=True),
+        Index("ix_task_executions_task_status", "task_id", "status"),
+    )
+
+
+class TaskProgress(Base):
+    __tablename__ = "task_progress"
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(String(64), unique=True, index=True, nullable=False)
+    expected = Column(Integer, nullable=False, default=0)
+    received = Column(Integer, nullable=False, default=0)
+    done = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+class TaskResultChunk(Base):
+    __tablename__ = "task_result_chunks"
+
+    id = Column(Integer, primary_key=True)
+    result_uid = Column(String(64), nullable=False)
+    stream = Column(String(8), nullable=False)
+    seq = Column(Integer, nullable=False)
+    offset = Column(Integer, nullable=False)
+    raw_size = Column(Integer, nullable=False)
+    data = Column(LargeBinary(length=16777215), nullable=False)
+
+    __table_args__ = (
+        Index("ux_task_result_chunks_uid_stream_seq", "result_uid", "stream", "seq", unique=True),
+    )
+
+
 class ClientPublicKey(Base):
     __tablename__ = "client_public_keys"
 
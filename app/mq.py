@@ -1,17 +1,45 @@
+import asyncio
+import functools
 import json
 import logging
 import threading
 import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Any
+from typing import Callable
+from typing import Deque
 from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
 
 import pika
 
+from app.ack_tracker import AckTracker
 from app.config import settings
-from app.mq_handlers import handle_heartbeat_message
-from app.mq_handlers import handle_result_message
-from app.mq_handlers import handle_status_message
+from app.fleet_state import fleet_state
+from app.heartbeat_batch import HeartbeatBatch
+from app.metrics import mq_handler_seconds
+from app.metrics import mq_messages
+from app.metrics import publish_seconds
+from app.mq_handlers import flush_fanout_progress
+from app.mq_handlers import parse_heartbeat_message
+from app.mq_handlers import parse_result_message
+from app.mq_handlers import parse_status_message
+from app.mq_handlers import prune_heartbeat_history
+from app.mq_handlers import store_heartbeats
+from app.mq_handlers import store_result
+from app.mq_handlers import store_results
+from app.mq_handlers import store_status
+from app.mq_handlers import store_statuses
+from app.mq_handlers import sweep_liveness
+from app.mq_publisher import CommandPublisher
+from app.parse_pool import ParserPool
+from app.result_batch import ResultBatch
 from app.util.sign_util import RSASigner
 
 signer = RSASigner(
@@ -19,46 +47,176 @@ signer = RSASigner(
     enabled=settings.sign_enabled,
 )
 
+publisher = CommandPublisher(
+    url=settings.rabbitmq_url,
+    exchange=settings.sys_cmd_exchange,
+    pool_size=settings.publisher_pool_size,
+    confirm_delivery=settings.publisher_confirms,
+)
+
+# Batches always use confirms so every item can report whether the broker accepted it.
+batch_publisher = CommandPublisher(
+    url=settings.rabbitmq_url,
+    exchange=settings.sys_cmd_exchange,
+    pool_size=settings.publisher_pool_size,
+    confirm_delivery=True,
+)
+
+# RSA signing never runs on the event loop.
+_sign_executor = ThreadPoolExecutor(max_workers=settings.sign_workers, thread_name_prefix="signer")
+
 logger = logging.getLogger(__name__)
 
+# Consumer loops wake up at least this often to notice a shutdown request.
+_STOP_POLL_INTERVAL = 1.0
+_stopping = threading.Event()
+_threads: List[threading.Thread] = []
+_parser_pools: Dict[str, ParserPool] = {}
 
-def publish_command(payload: Dict[str, Any], routing_key: str) -> None:
-    connection = pika.BlockingConnection(pika.URLParameters(settings.rabbitmq_url))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=settings.sys_cmd_exchange, exchange_type="topic", durable=True)
-    
+
+def build_command_headers(hostname: Optional[str] = None) -> Dict[str, Any]:
     timestamp = int(datetime.now(timezone.utc).timestamp())
-    
-    hostname = payload.get("hostname", "aliyun_linux_2g")
-    sign_data = {
-        "hostname": hostname,
-        "timestamp": timestamp
-    }
-    
-    signature = signer.sign(sign_data)
-    
+    signature = signer.sign_header(hostname or settings.sign_hostname, timestamp)
     if not signature:
         logging.error("Failed to sign message")
-    
-    headers = {
+    return {
         "x-signature": signature,
         "x-timestamp": timestamp
     }
-    
-    channel.basic_publish(
-        exchange=settings.sys_cmd_exchange,
-        routing_key=routing_key,
-        body=json.dumps(payload).encode("utf-8"),
-        properties=pika.BasicProperties(
-            delivery_mode=2,
-            headers=headers
-        ),
+
+
+def _command_properties(headers: Dict[str, Any]) -> pika.BasicProperties:
+    return pika.BasicProperties(
+        delivery_mode=2,
+        headers=headers
     )
-    connection.close()
+
+
+def publish_command(
+    payload: Dict[str, Any],
+    routing_key: str,
+    headers: Optional[Dict[str, Any]] = None,
+) -> None:
+    if headers is None:
+        headers = build_command_headers(payload.get("hostname"))
+    with publish_seconds.time("single"):
+        publisher.publish(
+            routing_key,
+            json.dumps(payload).encode("utf-8"),
+            _command_properties(headers),
+        )
+
+
+def publish_commands(
+    messages: List[Tuple[Dict[str, Any], str]],
+    headers: Optional[Dict[str, Any]] = None,
+) -> List[Optional[Exception]]:
+    """Publishes a batch of (payload, routing_key) under one signature over one confirmed channel."""
+    if headers is None:
+        headers = build_command_headers()
+    properties = _command_properties(headers)
+    with publish_seconds.time("batch"):
+        return batch_publisher.publish_many(
+            [(routing_key, json.dumps(payload).encode("utf-8"), properties) for payload, routing_key in messages]
+        )
+
+
+async def build_command_headers_async(hostname: Optional[str] = None) -> Dict[str, Any]:
+    return await asyncio.get_running_loop().run_in_executor(_sign_executor, build_command_headers, hostname)
+
+
+async def publish_command_async(payload: Dict[str, Any], routing_key: str) -> None:
+    headers = await build_command_headers_async(payload.get("hostname"))
+    await asyncio.get_running_loop().run_in_executor(None, publish_command, payload, routing_key, headers)
+
+
+async def publish_commands_async(messages: List[Tuple[Dict[str, Any], str]]) -> List[Optional[Exception]]:
+    headers = await build_command_headers_async()
+    return await asyncio.get_running_loop().run_in_executor(None, publish_commands, messages, headers)
+
+
+def _parse_later(
+    pool: Optional[ParserPool],
+    parse: Callable[[bytes, Any], Optional[Dict[str, Any]]],
+    body: bytes,
+    properties: Any,
+) -> "Future[Optional[Dict[str, Any]]]":
+    if pool is not None:
+        return pool.submit(body, properties)
+    future: "Future[Optional[Dict[str, Any]]]" = Future()
+    try:
+        future.set_result(parse(body, properties))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+def _stop_requested(channel: Any, method: Any) -> bool:
+    """True once shutdown began; a delivery already taken from the consumer goes back to the queue.
+
+    channel.cancel() only requeues what pika still buffers, not the delivery handed to us.
+    """
+    if not _stopping.is_set():
+        return False
+    if method is not None:
+        channel.basic_reject(delivery_tag=method.delivery_tag, requeue=True)
+    return True
+
+
+def _run_worker_pool(
+    connection: pika.BlockingConnection,
+    channel: Any,
+    queue: str,
+    parse: Callable[[bytes, Any], Optional[Dict[str, Any]]],
+    apply: Callable[[Dict[str, Any]], bool],
+    workers: int,
+    prefetch: int,
+    error_log: str,
+) -> None:
+    prefetch = max(1, prefetch)
+    tracker = AckTracker(min(settings.consumer_ack_batch, prefetch))
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=queue)
+
+    def on_done(delivery_tag: int) -> None:
+        ack_tag = tracker.completed(delivery_tag)
+        if ack_tag is not None:
+            channel.basic_ack(delivery_tag=ack_tag, multiple=True)
+
+    def work(delivery_tag: int, properties: Any, body: bytes) -> None:
+        mq_messages.inc(queue)
+        try:
+            with mq_handler_seconds.time(queue):
+                parsed = parse(body, properties)
+                if parsed:
+                    apply(parsed)
+        except Exception:
+            logger.exception(error_log)
+        try:
+            connection.add_callback_threadsafe(functools.partial(on_done, delivery_tag))
+        except Exception:
+            # The connection is gone; the broker redelivers unacked messages.
+            logger.warning(f"{queue}_ack_dropped", exc_info=True)
+
+    channel.basic_qos(prefetch_count=prefetch)
+    try:
+        for method, properties, body in channel.consume(queue=queue, inactivity_timeout=_STOP_POLL_INTERVAL):
+            if _stop_requested(channel, method):
+                break
+            if method is not None:
+                tracker.delivered(method.delivery_tag)
+                executor.submit(work, method.delivery_tag, properties, body)
+        # Draining: no new deliveries, let in-flight handlers finish, then run their queued acks.
+        channel.cancel()
+        executor.shutdown(wait=True)
+        connection.process_data_events(time_limit=0)
+    finally:
+        executor.shutdown(wait=False)
 
 
 def _consume_results() -> None:
-    while True:
+    pool = _parser_pools.get("result")
+    parse = pool.parse if pool else parse_result_message
+    while not _stopping.is_set():
         try:
             connection = pika.BlockingConnection(pika.URLParameters(settings.rabbitmq_url))
             channel = connection.channel()
@@ -66,53 +224,161 @@ def _consume_results() -> None:
             channel.queue_declare(queue=settings.result_queue, durable=True)
             channel.queue_bind(queue=settings.result_queue, exchange=settings.sys_result_exchange, routing_key="result.#")
 
-            def callback(ch, method, properties, body) -> None:
-                try:
-                    handle_result_message(body, properties)
-                except Exception:
-                    logger.exception("result_message_handler_error")
-                finally:
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue=settings.result_queue, on_message_callback=callback)
-            channel.start_consuming()
+            if settings.result_batch_size > 1:
+                _consume_batches(
+                    channel,
+                    settings.result_queue,
+                    pool,
+                    parse_result_message,
+                    store_results,
+                    settings.result_batch_size,
+                    settings.result_flush_interval,
+                    "result_message_handler_error",
+                )
+            else:
+                _run_worker_pool(
+                    connection,
+                    channel,
+                    settings.result_queue,
+                    parse,
+                    store_result,
+                    settings.result_workers,
+                    settings.result_prefetch,
+                    "result_message_handler_error",
+                )
+            connection.close()
         except Exception:
             logger.exception("result_consumer_error")
-            time.sleep(3)
+            _stopping.wait(3)
+
+
+def _collect(
+    queue: str,
+    pending: "Deque[Tuple[int, float, Future[Optional[Dict[str, Any]]]]]",
+    batch: Any,
+    error_log: str,
+    apply: Optional[Callable[[Dict[str, Any]], Any]] = None,
+) -> None:
+    """Moves parsed deliveries into the batch in delivery order.
+
+    Handler time runs from when the parse was started, so in-process parsing, or the
+    round trip through a parser pool, is counted along with ``apply``.
+    """
+    while pending:
+        delivery_tag, started, future = pending.popleft()
+        parsed = None
+        try:
+            parsed = future.result()
+            if parsed and apply is not None:
+                apply(parsed)
+        except Exception:
+            logger.exception(error_log)
+        mq_handler_seconds.observe(time.perf_counter() - started, queue)
+        batch.add(delivery_tag, parsed)
+
+
+def _flush_batch(channel: Any, batch: ResultBatch, store: Callable[[List[Dict[str, Any]]], None]) -> None:
+    items, last_tag = batch.drain()
+    if last_tag is None:
+        return
+    store(items)
+    # Failed rows are logged and dropped, as in the per-message path, so the batch is acked.
+    channel.basic_ack(delivery_tag=last_tag, multiple=True)
+
+
+def _consume_batches(
+    channel: Any,
+    queue: str,
+    pool: Optional[ParserPool],
+    parse: Callable[[bytes, Any], Optional[Dict[str, Any]]],
+    store: Callable[[List[Dict[str, Any]]], None],
+    batch_size: int,
+    flush_interval: float,
+    error_log: str,
+) -> None:
+    batch = ResultBatch(batch_size, flush_interval)
+    # With a parser pool a whole batch is decoded in parallel before it is collected.
+    window = batch_size if pool else 1
+    pending: "Deque[Tuple[int, float, Future[Optional[Dict[str, Any]]]]]" = deque()
+    channel.basic_qos(prefetch_count=batch_size)
+    for method, properties, body in channel.consume(
+        queue=queue,
+        inactivity_timeout=min(flush_interval, _STOP_POLL_INTERVAL),
+    ):
+        if _stop_requested(channel, method):
+            break
+        if method is not None:
+            mq_messages.inc(queue)
+            started = time.perf_counter()
+            pending.append((method.delivery_tag, started, _parse_later(pool, parse, body, properties)))
+        if method is None or len(pending) >= window:
+            _collect(queue, pending, batch, error_log)
+        if batch.due():
+            _flush_batch(channel, batch, store)
+    channel.cancel()
+    _collect(queue, pending, batch, error_log)
+    _flush_batch(channel, batch, store)
+
+
+def _flush_heartbeats(channel: Any, batch: HeartbeatBatch) -> None:
+    heartbeats, history, last_tag = batch.drain()
+    if last_tag is None:
+        return
+    try:
+        store_heartbeats(heartbeats, history)
+    except Exception:
+        logger.exception("heartbeat_flush_error")
+        channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+        time.sleep(1)
+        return
+    channel.basic_ack(delivery_tag=last_tag, multiple=True)
 
 
 def _consume_heartbeat() -> None:
-    while True:
+    queue = settings.monitor_queue
+    pool = _parser_pools.get("heartbeat")
+    window = settings.heartbeat_batch_size if pool else 1
+    while not _stopping.is_set():
         try:
             connection = pika.BlockingConnection(pika.URLParameters(settings.rabbitmq_url))
             channel = connection.channel()
             channel.exchange_declare(exchange=settings.sys_monitor_exchange, exchange_type="topic", durable=True)
-            channel.queue_declare(queue=settings.monitor_queue, durable=True)
+            channel.queue_declare(queue=queue, durable=True)
             channel.queue_bind(
-                queue=settings.monitor_queue,
+                queue=queue,
                 exchange=settings.sys_monitor_exchange,
                 routing_key=settings.heartbeat_routing_key,
             )
 
-            def callback(ch, method, properties, body) -> None:
-                try:
-                    handle_heartbeat_message(body, properties)
-                except Exception:
-                    logger.exception("heartbeat_message_handler_error")
-                finally:
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue=settings.monitor_queue, on_message_callback=callback)
-            channel.start_consuming()
+            batch = HeartbeatBatch(settings.heartbeat_batch_size, settings.heartbeat_flush_interval)
+            pending: "Deque[Tuple[int, float, Future[Optional[Dict[str, Any]]]]]" = deque()
+            channel.basic_qos(prefetch_count=max(1, settings.heartbeat_batch_size))
+            for method, properties, body in channel.consume(
+                queue=queue,
+                inactivity_timeout=min(settings.heartbeat_flush_interval, _STOP_POLL_INTERVAL),
+            ):
+                if _stop_requested(channel, method):
+                    break
+                if method is not None:
+                    mq_messages.inc(queue)
+                    started = time.perf_counter()
+                    pending.append((method.delivery_tag, started, _parse_later(pool, parse_heartbeat_message, body, properties)))
+                if method is None or len(pending) >= window:
+                    _collect(queue, pending, batch, "heartbeat_message_handler_error", fleet_state.apply_heartbeat)
+                if batch.due():
+                    _flush_heartbeats(channel, batch)
+            channel.cancel()
+            _collect(queue, pending, batch, "heartbeat_message_handler_error", fleet_state.apply_heartbeat)
+            _flush_heartbeats(channel, batch)
+            connection.close()
         except Exception:
             logger.exception("heartbeat_consumer_error")
-            time.sleep(3)
+            _stopping.wait(3)
 
 
 def _consume_status() -> None:
-    while True:
+    pool = _parser_pools.get("status")
+    while not _stopping.is_set():
         try:
             connection = pika.BlockingConnection(pika.URLParameters(settings.rabbitmq_url))
             channel = connection.channel()
@@ -124,23 +390,109 @@ def _consume_status() -> None:
                 routing_key=settings.status_routing_key,
             )
 
-            def callback(ch, method, properties, body) -> None:
-                try:
-                    handle_status_message(body, properties)
-                except Exception:
-                    logger.exception("status_message_handler_error")
-                finally:
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue=settings.status_queue, on_message_callback=callback)
-            channel.start_consuming()
+            if settings.status_batch_size > 1:
+                _consume_batches(
+                    channel,
+                    settings.status_queue,
+                    pool,
+                    parse_status_message,
+                    store_statuses,
+                    settings.status_batch_size,
+                    settings.status_flush_interval,
+                    "status_message_handler_error",
+                )
+            else:
+                _run_worker_pool(
+                    connection,
+                    channel,
+                    settings.status_queue,
+                    pool.parse if pool else parse_status_message,
+                    store_status,
+                    settings.status_workers,
+                    settings.status_prefetch,
+                    "status_message_handler_error",
+                )
+            connection.close()
         except Exception:
             logger.exception("status_consumer_error")
-            time.sleep(3)
+            _stopping.wait(3)
+
+
+def _flush_fanout_progress() -> None:
+    while not _stopping.wait(settings.fanout_flush_interval):
+        try:
+            flush_fanout_progress()
+        except Exception:
+            logger.exception("fanout_progress_flusher_error")
+
+
+def _prune_heartbeat_history() -> None:
+    while not _stopping.wait(settings.heartbeat_retention_interval):
+        try:
+            prune_heartbeat_history()
+        except Exception:
+            logger.exception("heartbeat_retention_error")
+
+
+def _sweep_liveness() -> None:
+    retry: Set[str] = set()
+    while not _stopping.wait(settings.liveness_sweep_interval):
+        try:
+            sweep_liveness(retry)
+        except Exception:
+            logger.exception("liveness_sweep_error")
+
+
+def _start(target: Callable[[], None], name: str) -> None:
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    _threads.append(thread)
 
 
 def start_consumers() -> None:
-    threading.Thread(target=_consume_results, daemon=True).start()
-    threading.Thread(target=_consume_heartbeat, daemon=True).start()
-    threading.Thread(target=_consume_status, daemon=True).start()
+    for kind, processes in (
+        ("result", settings.result_processes),
+        ("status", settings.status_processes),
+        ("heartbeat", settings.heartbeat_processes),
+    ):
+        if processes > 0 and kind not in _parser_pools:
+            _parser_pools[kind] = ParserPool(kind, processes)
+    _start(_flush_fanout_progress, "fanout-progress")
+    _start(_prune_heartbeat_history, "heartbeat-retention")
+    _start(_sweep_liveness, "liveness-sweep")
+    if settings.consumer_engine == "asyncio":
+        from app.mq_async import start_async_consumers
+
+        start_async_consumers(_parser_pools)
+        return
+    _start(_consume_results, "consume-results")
+    _start(_consume_heartbeat, "consume-heartbeat")
+    _start(_consume_status, "consume-status")
+
+
+async def drain_consumers(timeout: float) -> None:
+    if settings.consumer_engine == "asyncio":
+        from app.mq_async import stop_async_consumers
+
+        await stop_async_consumers(timeout)
+    await asyncio.get_running_loop().run_in_executor(None, stop_consumers, timeout)
+
+
+def stop_consumers(timeout: float) -> None:
+    """Stops consuming, waits for in-flight messages to be handled and acked, then flushes counters.
+
+    The asyncio engine is drained separately by mq_async.stop_async_consumers.
+    """
+    _stopping.set()
+    deadline = time.monotonic() + timeout
+    for thread in _threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    alive = [thread.name for thread in _threads if thread.is_alive()]
+    if alive:
+        logger.warning(f"consumer_drain_timeout: {alive}")
+    try:
+        flush_fanout_progress()
+    except Exception:
+        logger.exception("fanout_progress_flusher_error")
+    for pool in _parser_pools.values():
+        pool.shutdown()
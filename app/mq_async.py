@@ -0,0 +1,286 @@
+import asyncio
+import logging
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import aio_pika
+from aio_pika.abc import AbstractIncomingMessage
+from aio_pika.abc import AbstractQueue
+
+from app import crud_async
+from app.ack_tracker import AckTracker
+from app.config import settings
+from app.db import IngestAsyncSessionLocal
+from app.fleet_state import fleet_state
+from app.heartbeat_batch import HeartbeatBatch
+from app.metrics import mq_handler_seconds
+from app.metrics import mq_messages
+from app.mq_handlers import TASK_TRANSITION_SOURCES
+from app.mq_handlers import db_outage
+from app.mq_handlers import history_by_host
+from app.mq_handlers import ingest_results
+from app.mq_handlers import parse_heartbeat_message
+from app.mq_handlers import parse_result_message
+from app.mq_handlers import parse_status_message
+from app.mq_handlers import status_applied
+from app.mq_handlers import transition_miss
+from app.parse_pool import ParserPool
+
+logger = logging.getLogger(__name__)
+
+_consumer_task: Optional["asyncio.Task[None]"] = None
+_stop_requested = asyncio.Event()
+_parser_pools: Dict[str, ParserPool] = {}
+# Message handlers still running, awaited on shutdown so their acks go out.
+_inflight: Set["asyncio.Task[Any]"] = set()
+
+
+async def apply_result_async(result: Dict[str, Any]) -> bool:
+    async with IngestAsyncSessionLocal() as db:
+        return (await db.run_sync(ingest_results, [result]))[0]
+
+
+async def apply_status_async(update: Dict[str, Any]) -> bool:
+    task_id = update["task_id"]
+    status = update["status"]
+    async with IngestAsyncSessionLocal() as db:
+        if not await crud_async.transition_task(db, task_id, status, TASK_TRANSITION_SOURCES[status]):
+            task = await crud_async.get_task_by_id(db, task_id)
+            return transition_miss(task.status if task else None, task_id, status)
+    status_applied(update)
+    return True
+
+
+async def store_heartbeats_async(heartbeats: List[Dict[str, Any]], history: List[Dict[str, Any]]) -> None:
+    """Async counterpart of mq_handlers.store_heartbeats, with the same per-host fallback."""
+    try:
+        async with IngestAsyncSessionLocal() as db:
+            await crud_async.upsert_heartbeats(db, heartbeats, history)
+        return
+    except Exception as exc:
+        if db_outage(exc):
+            raise
+        logger.exception("heartbeat_batch_error")
+    grouped = history_by_host(history)
+    for heartbeat in heartbeats:
+        try:
+            async with IngestAsyncSessionLocal() as db:
+                await crud_async.upsert_heartbeats(db, [heartbeat], grouped.get(heartbeat["hostname"], []))
+        except Exception as exc:
+            if db_outage(exc):
+                raise
+            logger.error(f"Dropping heartbeat from {heartbeat['hostname']}: {exc}")
+
+
+async def _declare(
+    connection: aio_pika.abc.AbstractConnection,
+    exchange_name: str,
+    queue_name: str,
+    routing_key: str,
+    prefetch: int,
+) -> AbstractQueue:
+    channel = await connection.channel()
+    await channel.set_qos(prefetch_count=max(1, prefetch))
+    exchange = await channel.declare_exchange(exchange_name, aio_pika.ExchangeType.TOPIC, durable=True)
+    queue = await channel.declare_queue(queue_name, durable=True)
+    await queue.bind(exchange, routing_key=routing_key)
+    return queue
+
+
+async def _consume_concurrently(
+    queue: AbstractQueue,
+    parse: Callable[[bytes, Any], Optional[Dict[str, Any]]],
+    apply: Callable[[Dict[str, Any]], Awaitable[bool]],
+    prefetch: int,
+    error_log: str,
+    pool: Optional[ParserPool] = None,
+) -> str:
+    loop = asyncio.get_running_loop()
+    tracker = AckTracker(min(settings.consumer_ack_batch, max(1, prefetch)))
+
+    async def on_message(message: AbstractIncomingMessage) -> None:
+        task = asyncio.current_task()
+        _inflight.add(task)
+        tracker.delivered(message.delivery_tag)
+        mq_messages.inc(queue.name)
+        try:
+            with mq_handler_seconds.time(queue.name):
+                # Decoding and RSA verification stay off the event loop.
+                if pool is not None:
+                    parsed = await asyncio.wrap_future(pool.submit(message.body, message))
+                else:
+                    parsed = await loop.run_in_executor(None, parse, message.body, message)
+                if parsed:
+                    await apply(parsed)
+        except Exception:
+            logger.exception(error_log)
+        try:
+            ack_tag = tracker.completed(message.delivery_tag)
+            if ack_tag is not None:
+                await message.channel.basic_ack(delivery_tag=ack_tag, multiple=True)
+        finally:
+            _inflight.discard(task)
+
+    return await queue.consume(on_message)
+
+
+async def _flush_heartbeats_async(channel: Any, batch: HeartbeatBatch) -> None:
+    heartbeats, history, last_tag = batch.drain()
+    if last_tag is None:
+        return
+    try:
+        await store_heartbeats_async(heartbeats, history)
+    except Exception:
+        logger.exception("heartbeat_flush_error")
+        await channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+        await asyncio.sleep(1)
+        return
+    await channel.basic_ack(delivery_tag=last_tag, multiple=True)
+
+
+def _timed_parse_heartbeat(queue_name: str, body: bytes, properties: Any) -> Optional[Dict[str, Any]]:
+    with mq_handler_seconds.time(queue_name):
+        return parse_heartbeat_message(body, properties)
+
+
+async def _consume_heartbeats(queue: AbstractQueue, consumers: List[Tuple[AbstractQueue, str]]) -> None:
+    loop = asyncio.get_running_loop()
+    arrivals: "asyncio.Queue[Any]" = asyncio.Queue()
+    pool = _parser_pools.get("heartbeat")
+
+    async def on_message(message: AbstractIncomingMessage) -> None:
+        # Parsing runs concurrently, the batch is still filled in delivery order.
+        mq_messages.inc(queue.name)
+        if pool is not None:
+            parsed = asyncio.wrap_future(pool.submit(message.body, message))
+        else:
+            parsed = loop.run_in_executor(None, _timed_parse_heartbeat, queue.name, message.body, message)
+        arrivals.put_nowait((message, parsed))
+
+    consumers.append((queue, await queue.consume(on_message)))
+    batch = HeartbeatBatch(settings.heartbeat_batch_size, settings.heartbeat_flush_interval)
+    channel = None
+    while True:
+        try:
+            message, parsed = await asyncio.wait_for(
+                arrivals.get(),
+                timeout=min(settings.heartbeat_flush_interval, 1.0),
+            )
+        except asyncio.TimeoutError:
+            message = None
+            if _stop_requested.is_set():
+                # The consumer is cancelled by now and every delivery has been collected.
+                break
+        if message is not None:
+            heartbeat = None
+            try:
+                heartbeat = await parsed
+                if heartbeat:
+                    fleet_state.apply_heartbeat(heartbeat)
+            except Exception:
+                logger.exception("heartbeat_message_handler_error")
+            batch.add(message.delivery_tag, heartbeat)
+            channel = message.channel
+        if channel is not None and batch.due():
+            await _flush_heartbeats_async(channel, batch)
+    if channel is not None:
+        await _flush_heartbeats_async(channel, batch)
+
+
+async def _drain(consumers: List[Tuple[AbstractQueue, str]], heartbeat_task: "asyncio.Task[None]") -> None:
+    for queue, consumer_tag in consumers:
+        await queue.cancel(consumer_tag)
+    if _inflight:
+        await asyncio.wait(list(_inflight))
+    await heartbeat_task
+
+
+async def run_async_consumers() -> None:
+    while not _stop_requested.is_set():
+        try:
+            connection = await aio_pika.connect(settings.rabbitmq_url)
+            heartbeat_task = None
+            consumers: List[Tuple[AbstractQueue, str]] = []
+            try:
+                result_queue = await _declare(
+                    connection,
+                    settings.sys_result_exchange,
+                    settings.result_queue,
+                    "result.#",
+                    settings.result_prefetch,
+                )
+                result_tag = await _consume_concurrently(
+                    result_queue,
+                    parse_result_message,
+                    apply_result_async,
+                    settings.result_prefetch,
+                    "result_message_handler_error",
+                    _parser_pools.get("result"),
+                )
+                consumers.append((result_queue, result_tag))
+                status_queue = await _declare(
+                    connection,
+                    settings.sys_result_exchange,
+                    settings.status_queue,
+                    settings.status_routing_key,
+                    settings.status_prefetch,
+                )
+                status_tag = await _consume_concurrently(
+                    status_queue,
+                    parse_status_message,
+                    apply_status_async,
+                    settings.status_prefetch,
+                    "status_message_handler_error",
+                    _parser_pools.get("status"),
+                )
+                consumers.append((status_queue, status_tag))
+                monitor_queue = await _declare(
+                    connection,
+                    settings.sys_monitor_exchange,
+                    settings.monitor_queue,
+                    settings.heartbeat_routing_key,
+                    settings.heartbeat_batch_size,
+                )
+                heartbeat_task = asyncio.create_task(_consume_heartbeats(monitor_queue, consumers))
+                stop_requested = asyncio.ensure_future(_stop_requested.wait())
+                await asyncio.wait(
+                    [heartbeat_task, asyncio.ensure_future(connection.closed()), stop_requested],
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if stop_requested.done():
+                    await _drain(consumers, heartbeat_task)
+                elif heartbeat_task.done():
+                    heartbeat_task.result()
+            finally:
+                if heartbeat_task is not None:
+                    heartbeat_task.cancel()
+                await connection.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("async_consumer_error")
+        if not _stop_requested.is_set():
+            await asyncio.sleep(3)
+
+
+def start_async_consumers(parser_pools: Optional[Dict[str, ParserPool]] = None) -> None:
+    global _consumer_task
+    _parser_pools.update(parser_pools or {})
+    _consumer_task = asyncio.get_running_loop().create_task(run_async_consumers())
+
+
+async def stop_async_consumers(timeout: float) -> None:
+    """Cancels the queue consumers and waits for in-flight messages to be handled and acked."""
+    _stop_requested.set()
+    if _consumer_task is None:
+        return
+    try:
+        await asyncio.wait_for(_consumer_task, timeout)
+    except asyncio.TimeoutError:
+        logger.warning("consumer_drain_timeout")
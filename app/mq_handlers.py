@@ -1,17 +1,59 @@
 import json
 import logging
-from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.exc import DataError
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 
 from app import crud
+from app import models
+from app import schemas
 from app.config import settings
 from app.db import SessionLocal
+from app.events import event_bus
+from app.fanout_progress import FANOUT_TARGETS
+from app.fanout_progress import fanout_progress
+from app.fleet_state import fleet_state
+from app.metrics import signature_verify_seconds
+from app.result_dedup import RecentKeys
+from app.result_dedup import result_key
 from app.security.public_key_store import PublicKeyStore
-from app.util.sign_util import verify_with_public_key
+from app.util.sign_util import SignatureVerifier
 
 logger = logging.getLogger(__name__)
 
-public_key_store = PublicKeyStore()
+public_key_store = PublicKeyStore(
+    SessionLocal,
+    ttl=settings.public_key_cache_ttl,
+    max_entries=settings.public_key_cache_size,
+    version_check_interval=settings.public_key_version_check_interval,
+)
+signature_verifier = SignatureVerifier(
+    window=settings.sign_verify_cache_window,
+    max_entries=settings.sign_verify_cache_size,
+    enabled=settings.sign_enabled,
+)
+recent_results = RecentKeys(settings.result_dedup_cache_size)
+
+TASK_TRANSITIONS: Dict[str, Set[str]] = {
+    "pending": {"sent", "received", "rejected", "failed"},
+    "sent": {"received", "rejected"},
+    "received": {"done", "rejected"},
+    "rejected": set(),
+    "done": set(),
+    # The command could not be published to the broker.
+    "failed": set(),
+}
+# Sorted so each transition binds the same IN list and reuses one cached statement.
+TASK_TRANSITION_SOURCES: Dict[str, List[str]] = {
+    status: sorted(source for source, targets in TASK_TRANSITIONS.items() if status in targets)
+    for status in TASK_TRANSITIONS
+}
+RESULT_DONE_FROM = ["pending", "received", "sent"]
 
 
 def _decode_json(body: bytes) -> Optional[Dict[str, Any]]:
@@ -37,115 +79,436 @@ def _verify_message_if_needed(
         "hostname": hostname,
         "timestamp": header_timestamp,
     }
-    with SessionLocal() as db:
-        public_key = public_key_store.get_public_key(db, hostname)
-    verified = verify_with_public_key(
-        verify_data,
-        signature,
-        public_key,
-        settings.sign_enabled,
-    )
+    public_key = public_key_store.get_public_key(hostname)
+    with signature_verify_seconds.time():
+        verified = signature_verifier.verify(verify_data, signature, public_key)
     if not verified:
         logger.error(failure_log)
     return verified
 
 
-def handle_result_message(body: bytes, properties: Any) -> bool:
+def transition_miss(current_status: Optional[str], task_id: str, status: str) -> bool:
+    """Explains a conditional transition that matched no row; repeating the current status is accepted."""
+    if current_status is None:
+        logger.error(f"Task not found: {task_id}")
+        return False
+    if current_status == status:
+        return True
+    logger.error(f"Invalid status transition: {current_status} -> {status}")
+    return False
+
+
+def parse_result_message(body: bytes, properties: Any) -> Optional[Dict[str, Any]]:
     data = _decode_json(body)
     if not data:
-        return False
+        return None
     if not _verify_message_if_needed(data, properties, "Failed to verify message signature"):
+        return None
+    ts = data.get("timestamp")
+    return {
+        "task_id": data.get("task_id"),
+        "hostname": data.get("hostname"),
+        "idempotency_key": result_key(data, getattr(properties, "message_id", None), body),
+        "exit_code": data.get("exit_code"),
+        "stdout": data.get("stdout"),
+        "stderr": data.get("stderr"),
+        "timestamp": datetime.fromtimestamp(ts, timezone.utc) if isinstance(ts, (int, float)) else datetime.now(timezone.utc),
+    }
+
+
+def apply_result(db: Session, result: Dict[str, Any]) -> bool:
+    return ingest_results(db, [result])[0]
+
+
+def ingest_results(db: Session, results: List[Dict[str, Any]]) -> List[bool]:
+    outcomes, fanout = commit_results(db, results)
+    return record_fanout_results(db, outcomes, fanout)
+
+
+def commit_results(
+    db: Session,
+    results: List[Dict[str, Any]],
+) -> Tuple[List[bool], List[Tuple[int, Dict[str, Any]]]]:
+    """Stores results and completes their single-host tasks in one transaction.
+
+    Results and output chunks go in with one executemany each and tasks move to done with
+    one conditional UPDATE; task rows are only read when that UPDATE fell short. Fan-out
+    parents never match it; their stored rows are returned with their indexes for
+    record_fanout_results to handle per host after the commit.
+
+    Redelivered results that RecentKeys missed, e.g. after a restart, still go through
+    the idempotent writes but publish no events, so dashboards do not see them twice.
+    """
+    outcomes = [True] * len(results)
+    kept: List[int] = []
+    keys: Set[str] = set()
+    for index, result in enumerate(results):
+        key = result.get("idempotency_key")
+        if not result["task_id"] or key in keys:
+            continue
+        if key in recent_results:
+            logger.debug(f"Dropped duplicate result {key} of task {result['task_id']}")
+            continue
+        if key:
+            keys.add(key)
+        kept.append(index)
+    if not kept:
+        return outcomes, []
+    stored = crud.existing_result_uids(db, keys)
+    rows = crud.insert_task_results(db, [results[index] for index in kept])
+    fresh = [row for row in rows if row["result_uid"] not in stored]
+    indexes_by_task: Dict[str, List[int]] = {}
+    for index in kept:
+        indexes_by_task.setdefault(results[index]["task_id"], []).append(index)
+    task_ids = list(indexes_by_task)
+    completed = task_ids
+    fanout: List[int] = []
+    stmt = crud.transition_tasks_stmt(task_ids, "done", RESULT_DONE_FROM, FANOUT_TARGETS)
+    if db.execute(stmt).rowcount != len(task_ids):
+        states = crud.task_states(db, task_ids)
+        completed = []
+        for task_id in task_ids:
+            status, target_type = states.get(task_id, (None, None))
+            if target_type in FANOUT_TARGETS:
+                fanout.extend(indexes_by_task[task_id])
+            elif transition_miss(status, task_id, "done"):
+                completed.append(task_id)
+            else:
+                for index in indexes_by_task[task_id]:
+                    outcomes[index] = False
+    db.commit()
+    recent_results.add_many(keys)
+
+    for row in fresh:
+        event_bus.publish("result", schemas.TaskResultOut.model_validate(row))
+    fresh_tasks = {row["task_id"] for row in fresh}
+    for task_id in completed:
+        if task_id in fresh_tasks:
+            event_bus.publish("task_status", {"task_id": task_id, "status": "done"})
+    stored_by_index = dict(zip(kept, rows))
+    return outcomes, [(index, stored_by_index[index]) for index in fanout]
+
+
+def record_fanout_results(
+    db: Session,
+    outcomes: List[bool],
+    fanout: List[Tuple[int, Dict[str, Any]]],
+) -> List[bool]:
+    for index, stored in fanout:
+        outcomes[index] = record_fanout_result(
+            db, stored["task_id"], stored["hostname"], stored["exit_code"], stored["result_uid"]
+        )
+    return outcomes
+
+
+def record_fanout_result(
+    db: Session,
+    task_id: str,
+    hostname: Optional[str],
+    exit_code: Optional[int],
+    result_uid: str,
+) -> bool:
+    if not hostname:
+        logger.error(f"Missing hostname in fan-out result: {task_id}")
         return False
+    outcome = crud.record_execution(db, task_id, hostname, exit_code, result_uid)
+    if outcome == "duplicate":
+        return True
+    fanout_progress.record(task_id, exit_code == 0, unexpected=outcome == "unexpected")
+    return True
+
+
+def flush_fanout_progress() -> None:
+    deltas = fanout_progress.drain()
+    finished = fanout_progress.drain_finished()
+    if deltas:
+        try:
+            with SessionLocal() as db:
+                progress = crud.apply_fanout_progress(db, deltas)
+        except Exception:
+            logger.exception("fanout_progress_flush_error")
+            fanout_progress.restore(deltas)
+            progress = []
+        for item in progress:
+            event_bus.publish("task_progress", item)
+        finished.extend(item.task_id for item in progress if item.received >= item.expected)
+    if not finished:
+        return
+    try:
+        with SessionLocal() as db:
+            crud.transition_tasks(db, finished, "done", RESULT_DONE_FROM)
+    except Exception:
+        logger.exception("fanout_finish_error")
+        fanout_progress.retry_finished(finished)
+        return
+    for task_id in finished:
+        event_bus.publish("task_status", {"task_id": task_id, "status": "done"})
+
+
+def store_results(results: List[Dict[str, Any]]) -> None:
+    """Ingests a batch in one transaction, falling back to one transaction per result on failure.
+
+    The fallback keeps a single bad result from sending the whole batch back to the queue.
+    It only runs when the batch failed before its commit: committed results would be
+    dropped as duplicates on a retry, so after the commit only the per-host fan-out
+    recording is retried, which is idempotent.
+    """
+    try:
+        with SessionLocal() as db:
+            outcomes, fanout = commit_results(db, results)
+    except Exception:
+        logger.exception("result_batch_error")
+        for result in results:
+            store_result(result)
+        return
     try:
-        task_id = data.get("task_id")
-        exit_code = data.get("exit_code")
-        stdout = data.get("stdout")
-        stderr = data.get("stderr")
-        ts = data.get("timestamp")
-        timestamp = datetime.fromtimestamp(ts, timezone.utc) if isinstance(ts, (int, float)) else datetime.now(timezone.utc)
-        if task_id:
+        with SessionLocal() as db:
+            record_fanout_results(db, outcomes, fanout)
+        return
+    except Exception:
+        logger.exception("fanout_batch_error")
+    for _, stored in fanout:
+        try:
             with SessionLocal() as db:
-                crud.create_task_result(db, task_id, exit_code, stdout, stderr, timestamp)
-                task = crud.get_task_by_id(db, task_id)
-                if not task:
-                    logger.error(f"Task not found: {task_id}")
-                    return False
-                current_status = task.status
-                if current_status == "done":
-                    return True
-                if current_status not in {"pending", "sent", "received"}:
-                    logger.error(f"Invalid status transition: {current_status} -> done")
-                    return False
-                task.status = "done"
-                db.commit()
+                record_fanout_result(db, stored["task_id"], stored["hostname"], stored["exit_code"], stored["result_uid"])
+        except Exception as exc:
+            logger.error(f"Error recording fan-out result: {exc}")
+
+
+def handle_result_message(body: bytes, properties: Any) -> bool:
+    result = parse_result_message(body, properties)
+    if not result:
+        return False
+    return store_result(result)
+
+
+def store_result(result: Dict[str, Any]) -> bool:
+    try:
+        with SessionLocal() as db:
+            return apply_result(db, result)
     except Exception as exc:
         logger.error(f"Error processing result message: {exc}")
         return False
-    return True
 
 
-def handle_heartbeat_message(body: bytes, properties: Any) -> bool:
+def _usage(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"invalid usage value: {value!r}")
+    return float(value)
+
+
+def parse_heartbeat_message(body: bytes, properties: Any) -> Optional[Dict[str, Any]]:
     data = _decode_json(body)
     if not data:
-        return False
+        return None
     if not _verify_message_if_needed(data, properties, "Failed to verify heartbeat message signature"):
-        return False
+        return None
+    hostname = data.get("hostname")
+    if not hostname:
+        return None
+    status = data.get("status", "unknown")
+    # Values the servers columns reject would fail the whole batch upsert in strict mode.
+    if not isinstance(hostname, str) or len(hostname) > models.Server.hostname.type.length:
+        logger.error(f"Invalid hostname in heartbeat: {str(hostname)[:64]!r}")
+        return None
+    if not isinstance(status, str) or len(status) > models.Server.status.type.length:
+        logger.error(f"Invalid status in heartbeat from {hostname}")
+        return None
+    try:
+        cpu_usage = _usage(data.get("cpu_usage"))
+        memory_usage = _usage(data.get("mem_usage"))
+    except ValueError as exc:
+        logger.error(f"Invalid heartbeat from {hostname}: {exc}")
+        return None
+    ts = data.get("timestamp")
+    return {
+        "hostname": hostname,
+        "status": status,
+        "timestamp": datetime.fromtimestamp(ts, timezone.utc) if isinstance(ts, (int, float)) else datetime.now(timezone.utc),
+        "cpu_usage": cpu_usage,
+        "memory_usage": memory_usage,
+    }
+
+
+def db_outage(exc: Exception) -> bool:
+    """True for database errors not caused by the rows written, e.g. a lost connection or a deadlock."""
+    return isinstance(exc, DBAPIError) and not isinstance(exc, (DataError, IntegrityError))
+
+
+def history_by_host(history: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for heartbeat in history:
+        grouped.setdefault(heartbeat["hostname"], []).append(heartbeat)
+    return grouped
+
+
+def store_heartbeats(heartbeats: List[Dict[str, Any]], history: List[Dict[str, Any]]) -> None:
+    """Upserts a batch in one transaction, falling back to one transaction per host on failure.
+
+    Hosts whose rows are rejected are logged and dropped. Only a database outage is raised,
+    so the caller sends the batch back to the queue.
+    """
     try:
-        hostname = data.get("hostname")
-        status = data.get("status", "unknown")
-        ts = data.get("timestamp")
-        cpu_usage = data.get("cpu_usage")
-        memory_usage = data.get("mem_usage")
-        timestamp = datetime.fromtimestamp(ts, timezone.utc) if isinstance(ts, (int, float)) else datetime.now(timezone.utc)
-        if hostname:
+        with SessionLocal() as db:
+            crud.upsert_heartbeats(db, heartbeats, history)
+        return
+    except Exception as exc:
+        if db_outage(exc):
+            raise
+        logger.exception("heartbeat_batch_error")
+    grouped = history_by_host(history)
+    for heartbeat in heartbeats:
+        try:
             with SessionLocal() as db:
-                crud.update_heartbeat(db, hostname, status, timestamp, cpu_usage, memory_usage)
+                crud.upsert_heartbeats(db, [heartbeat], grouped.get(heartbeat["hostname"], []))
+        except Exception as exc:
+            if db_outage(exc):
+                raise
+            logger.error(f"Dropping heartbeat from {heartbeat['hostname']}: {exc}")
+
+
+def sweep_liveness(retry: Set[str]) -> None:
+    """Marks hosts without a heartbeat for LIVENESS_TIMEOUT seconds offline.
+
+    Hosts whose UPDATE failed stay in ``retry`` and go out with the next sweep.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.liveness_timeout)
+    retry.update(fleet_state.expire(cutoff))
+    if not retry:
+        return
+    hostnames = sorted(retry)
+    with SessionLocal() as db:
+        updated = crud.mark_servers_offline(db, hostnames, cutoff)
+    retry.clear()
+    logger.info(f"Marked {updated} of {len(hostnames)} overdue servers offline")
+
+
+def prune_heartbeat_history() -> None:
+    with SessionLocal() as db:
+        deleted = crud.prune_heartbeat_history(db, datetime.now(timezone.utc), settings.heartbeat_retention_batch)
+    if deleted:
+        logger.info(f"Pruned {deleted} expired heartbeat history rows")
+
+
+def handle_heartbeat_message(body: bytes, properties: Any) -> bool:
+    heartbeat = parse_heartbeat_message(body, properties)
+    if not heartbeat:
+        return False
+    fleet_state.apply_heartbeat(heartbeat)
+    try:
+        with SessionLocal() as db:
+            crud.update_heartbeat(
+                db,
+                heartbeat["hostname"],
+                heartbeat["status"],
+                heartbeat["timestamp"],
+                heartbeat["cpu_usage"],
+                heartbeat["memory_usage"],
+            )
     except Exception as exc:
         logger.error(f"Error processing heartbeat message: {exc}")
         return False
     return True
 
 
-def handle_status_message(body: bytes, properties: Any) -> bool:
+def parse_status_message(body: bytes, properties: Any) -> Optional[Dict[str, Any]]:
     data = _decode_json(body)
     if not data:
-        return False
+        return None
     if not _verify_message_if_needed(data, properties, "Failed to verify status message signature"):
+        return None
+    task_id = data.get("task_id") or data.get("taskID")
+    status = data.get("status")
+    if not task_id or not status:
+        logger.error("Missing task_id or status in status message")
+        return None
+    if status not in TASK_TRANSITIONS:
+        logger.error(f"Invalid status value: {status}")
+        return None
+    return {
+        "task_id": task_id,
+        "status": status,
+        "reason": data.get("reason"),
+    }
+
+
+def status_applied(update: Dict[str, Any]) -> None:
+    event_bus.publish("task_status", {"task_id": update["task_id"], "status": update["status"]})
+    if update["status"] == "rejected" and update["reason"]:
+        logger.info(f"Task {update['task_id']} rejected: {update['reason']}")
+
+
+def apply_status(db: Session, update: Dict[str, Any]) -> bool:
+    task_id = update["task_id"]
+    status = update["status"]
+    if not crud.transition_task(db, task_id, status, TASK_TRANSITION_SOURCES[status]):
+        task = crud.get_task_by_id(db, task_id)
+        return transition_miss(task.status if task else None, task_id, status)
+    status_applied(update)
+    return True
+
+
+def apply_statuses(db: Session, updates: List[Dict[str, Any]]) -> List[bool]:
+    """Applies a batch with one conditional UPDATE per target status and a single commit.
+
+    Rows are only read back for a status whose rowcount fell short. TASK_TRANSITIONS lists
+    states in lifecycle order, so "sent" is applied before "received" for the same task.
+    """
+    outcomes = [False] * len(updates)
+    by_status: Dict[str, Dict[str, List[int]]] = {}
+    for index, update in enumerate(updates):
+        by_status.setdefault(update["status"], {}).setdefault(update["task_id"], []).append(index)
+    applied: List[int] = []
+    for status in TASK_TRANSITIONS:
+        indexes_by_task = by_status.get(status)
+        if not indexes_by_task:
+            continue
+        task_ids = list(indexes_by_task)
+        stmt = crud.transition_tasks_stmt(task_ids, status, TASK_TRANSITION_SOURCES[status])
+        if db.execute(stmt).rowcount == len(task_ids):
+            reached = task_ids
+        else:
+            states = crud.task_states(db, task_ids)
+            reached = [
+                task_id
+                for task_id in task_ids
+                if transition_miss(states.get(task_id, (None, None))[0], task_id, status)
+            ]
+        for task_id in reached:
+            for index in indexes_by_task[task_id]:
+                outcomes[index] = True
+            applied.append(indexes_by_task[task_id][0])
+    db.commit()
+    for index in applied:
+        status_applied(updates[index])
+    return outcomes
+
+
+def store_statuses(updates: List[Dict[str, Any]]) -> None:
+    """Applies a batch in one transaction, falling back to one transaction per update on failure."""
+    try:
+        with SessionLocal() as db:
+            apply_statuses(db, updates)
+        return
+    except Exception:
+        logger.exception("status_batch_error")
+    for update in updates:
+        store_status(update)
+
+
+def handle_status_message(body: bytes, properties: Any) -> bool:
+    update = parse_status_message(body, properties)
+    if not update:
         return False
+    return store_status(update)
+
+
+def store_status(update: Dict[str, Any]) -> bool:
     try:
-        task_id = data.get("task_id") or data.get("taskID")
-        status = data.get("status")
-        reason = data.get("reason")
-        if not task_id or not status:
-            logger.error("Missing task_id or status in status message")
-            return False
-        allowed_statuses = {"pending", "sent", "received", "rejected", "done"}
-        if status not in allowed_statuses:
-            logger.error(f"Invalid status value: {status}")
-            return False
         with SessionLocal() as db:
-            task = crud.get_task_by_id(db, task_id)
-            if not task:
-                logger.error(f"Task not found: {task_id}")
-                return False
-            current_status = task.status
-            if current_status == status:
-                return True
-            transitions = {
-                "pending": {"sent", "received", "rejected"},
-                "sent": {"received", "rejected"},
-                "received": {"done", "rejected"},
-                "rejected": set(),
-                "done": set(),
-            }
-            if status not in transitions.get(current_status, set()):
-                logger.error(f"Invalid status transition: {current_status} -> {status}")
-                return False
-            task.status = status
-            db.commit()
-        if status == "rejected" and reason:
-            logger.info(f"Task {task_id} rejected: {reason}")
+            return apply_status(db, update)
     except Exception as exc:
         logger.error(f"Error processing status message: {exc}")
         return False
-    return True
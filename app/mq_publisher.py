@@ -0,0 +1,208 @@
+import logging
+import queue
+import threading
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import pika
+from pika.adapters.blocking_connection import BlockingChannel
+from pika.exceptions import AMQPChannelError
+from pika.exceptions import AMQPConnectionError
+
+logger = logging.getLogger(__name__)
+
+# Errors after which a channel is unusable; a nack or unroutable return leaves it open.
+_CHANNEL_LOST = (AMQPConnectionError, AMQPChannelError)
+
+
+class _PooledChannel:
+    # pika connections are not thread-safe, so every pooled channel owns its connection.
+    def __init__(self, connection: pika.BlockingConnection, channel: BlockingChannel) -> None:
+        self.connection = connection
+        self.channel = channel
+
+    def is_open(self) -> bool:
+        return self.connection.is_open and self.channel.is_open
+
+    def close(self) -> None:
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            logger.debug("publisher_channel_close_error", exc_info=True)
+
+
+class CommandPublisher:
+    def __init__(
+        self,
+        url: str,
+        exchange: str,
+        pool_size: int = 4,
+        confirm_delivery: bool = False,
+        checkout_timeout: float = 5.0,
+        exchange_type: str = "topic",
+    ) -> None:
+        self._parameters = pika.URLParameters(url)
+        self._exchange = exchange
+        self._exchange_type = exchange_type
+        self._pool_size = max(1, pool_size)
+        self._confirm_delivery = confirm_delivery
+        self._checkout_timeout = checkout_timeout
+        self._idle: "queue.LifoQueue[_PooledChannel]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _open(self) -> _PooledChannel:
+        connection = pika.BlockingConnection(self._parameters)
+        try:
+            channel = connection.channel()
+            channel.exchange_declare(exchange=self._exchange, exchange_type=self._exchange_type, durable=True)
+            if self._confirm_delivery:
+                channel.confirm_delivery()
+        except Exception:
+            connection.close()
+            raise
+        return _PooledChannel(connection, channel)
+
+    def _acquire(self) -> _PooledChannel:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self._pool_size
+            if can_create:
+                self._created += 1
+        if not can_create:
+            try:
+                return self._idle.get(timeout=self._checkout_timeout)
+            except queue.Empty:
+                raise TimeoutError("no publisher channel available") from None
+        return self._open_counted()
+
+    def _open_counted(self) -> _PooledChannel:
+        # The caller has already reserved a slot in _created.
+        try:
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _reopen(self, pooled: _PooledChannel) -> _PooledChannel:
+        """Replaces a dead channel with a new connection and drops the idle ones as well.
+
+        Idle connections do not service broker heartbeats, so after a quiet period they are
+        all likely dead; retrying on the next idle one would fail the same way.
+        """
+        self._discard(pooled)
+        self._drop_idle()
+        with self._lock:
+            self._created += 1
+        return self._open_counted()
+
+    def _release(self, pooled: _PooledChannel) -> None:
+        if pooled.is_open():
+            self._idle.put(pooled)
+            return
+        self._discard(pooled)
+
+    def _discard(self, pooled: _PooledChannel) -> None:
+        pooled.close()
+        with self._lock:
+            self._created -= 1
+
+    def _keep_if_open(self, pooled: _PooledChannel) -> Optional[_PooledChannel]:
+        if pooled.is_open():
+            return pooled
+        self._discard(pooled)
+        return None
+
+    def _drop_idle(self) -> None:
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(pooled)
+
+    def _publish_once(
+        self,
+        pooled: _PooledChannel,
+        routing_key: str,
+        body: bytes,
+        properties: Optional[pika.BasicProperties],
+    ) -> None:
+        # Services heartbeats of an idle connection and surfaces a dead one before publishing.
+        pooled.connection.process_data_events(time_limit=0)
+        pooled.channel.basic_publish(
+            exchange=self._exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=properties,
+        )
+
+    def _send(
+        self,
+        pooled: _PooledChannel,
+        routing_key: str,
+        body: bytes,
+        properties: Optional[pika.BasicProperties],
+    ) -> Tuple[Optional[_PooledChannel], Optional[Exception]]:
+        """Publishes one message, retrying once on a new connection if the channel is dead.
+
+        Returns the channel to keep using, or None if it was discarded, and the publish error if any.
+        """
+        try:
+            self._publish_once(pooled, routing_key, body, properties)
+            return pooled, None
+        except _CHANNEL_LOST:
+            logger.warning("publisher_channel_lost, reconnecting", exc_info=True)
+        except Exception as exc:
+            return self._keep_if_open(pooled), exc
+        try:
+            pooled = self._reopen(pooled)
+        except Exception as exc:
+            return None, exc
+        try:
+            self._publish_once(pooled, routing_key, body, properties)
+            return pooled, None
+        except Exception as exc:
+            return self._keep_if_open(pooled), exc
+
+    def publish(
+        self,
+        routing_key: str,
+        body: bytes,
+        properties: Optional[pika.BasicProperties] = None,
+    ) -> None:
+        pooled, error = self._send(self._acquire(), routing_key, body, properties)
+        if pooled is not None:
+            self._release(pooled)
+        if error is not None:
+            raise error
+
+    def publish_many(
+        self,
+        messages: List[Tuple[str, bytes, Optional[pika.BasicProperties]]],
+    ) -> List[Optional[Exception]]:
+        """Publishes (routing_key, body, properties) messages over one channel and returns per-message errors."""
+        errors: List[Optional[Exception]] = []
+        pooled: Optional[_PooledChannel] = None
+        for index, (routing_key, body, properties) in enumerate(messages):
+            if pooled is None:
+                try:
+                    pooled = self._acquire()
+                except Exception as exc:
+                    # Without a channel the rest of the batch would fail the same way.
+                    errors.extend([exc] * (len(messages) - index))
+                    break
+            pooled, error = self._send(pooled, routing_key, body, properties)
+            errors.append(error)
+        if pooled is not None:
+            self._release(pooled)
+        return errors
+
+    def close(self) -> None:
+        self._drop_idle()
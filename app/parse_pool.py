@@ -0,0 +1,60 @@
+import multiprocessing
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+from app.mq_handlers import parse_heartbeat_message
+from app.mq_handlers import parse_result_message
+from app.mq_handlers import parse_status_message
+from app.mq_handlers import public_key_store
+
+PARSERS: Dict[str, Callable[[bytes, Any], Optional[Dict[str, Any]]]] = {
+    "result": parse_result_message,
+    "status": parse_status_message,
+    "heartbeat": parse_heartbeat_message,
+}
+
+# Invalidation generation of the parent's key store last applied in this worker process.
+_seen_generation: Optional[int] = None
+
+
+def _parse(kind: str, generation: int, body: bytes, headers: Optional[Dict[str, Any]], message_id: Any) -> Any:
+    global _seen_generation
+    if generation != _seen_generation:
+        # Keys changed in the parent since the last message; drop everything cached here.
+        public_key_store.invalidate()
+        _seen_generation = generation
+    return PARSERS[kind](body, SimpleNamespace(headers=headers, message_id=message_id))
+
+
+class ParserPool:
+    """Runs JSON decoding and signature verification for one queue in worker processes.
+
+    Database writes, fleet state and acks stay in the consumer process; only the parsed
+    dict crosses back. Processes are spawned, not forked, because the consumer already
+    runs pika and database threads.
+    """
+
+    def __init__(self, kind: str, processes: int) -> None:
+        self.kind = kind
+        self._executor = ProcessPoolExecutor(
+            max_workers=max(1, processes),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def submit(self, body: bytes, properties: Any) -> "Future[Optional[Dict[str, Any]]]":
+        headers = getattr(properties, "headers", None)
+        message_id = getattr(properties, "message_id", None)
+        return self._executor.submit(
+            _parse, self.kind, public_key_store.generation, body, dict(headers) if headers else None, message_id
+        )
+
+    def parse(self, body: bytes, properties: Any) -> Optional[Dict[str, Any]]:
+        return self.submit(body, properties).result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
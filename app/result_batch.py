@@ -0,0 +1,44 @@
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+class ResultBatch:
+    """Buffers parsed result or status deliveries so they can be stored in one transaction and acked together."""
+
+    def __init__(self, max_size: int, max_delay: float) -> None:
+        self._max_size = max(1, max_size)
+        self._max_delay = max_delay
+        self._results: List[Dict[str, Any]] = []
+        self._count = 0
+        self._last_tag: Optional[int] = None
+        self._first_at = 0.0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, delivery_tag: int, result: Optional[Dict[str, Any]]) -> None:
+        if self._count == 0:
+            self._first_at = time.monotonic()
+        self._count += 1
+        self._last_tag = delivery_tag
+        if result:
+            self._results.append(result)
+
+    def due(self) -> bool:
+        if self._count == 0:
+            return False
+        if self._count >= self._max_size:
+            return True
+        return time.monotonic() - self._first_at >= self._max_delay
+
+    def drain(self) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        results = self._results
+        last_tag = self._last_tag
+        self._results = []
+        self._count = 0
+        self._last_tag = None
+        return results, last_tag
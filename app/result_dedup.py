@@ -0,0 +1,54 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+
+
+def result_key(data: Dict[str, Any], message_id: Optional[str], body: bytes) -> str:
+    """Derives a stable key for one result from task_id, hostname and the agent's sequence number.
+
+    Falls back to the AMQP message id and then to a digest of the body, which is identical
+    on redelivery. The key is the result_uid, so the unique index on it rejects duplicates.
+    """
+    seq = data.get("seq")
+    if seq is not None:
+        token = f"seq:{seq}"
+    elif message_id:
+        token = f"msg:{message_id}"
+    else:
+        token = "body:" + hashlib.sha256(body).hexdigest()
+    raw = f"{data.get('task_id')}\0{data.get('hostname')}\0{token}".encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class RecentKeys:
+    """LRU set of recently stored result keys, so redeliveries are dropped without a DB hit.
+
+    Exact rather than probabilistic: a false positive would silently lose a result.
+    """
+
+    def __init__(self, max_entries: int = 100000) -> None:
+        self._max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._keys: "OrderedDict[str, None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+            return True
+
+    def add_many(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self._max_entries:
+                self._keys.popitem(last=False)
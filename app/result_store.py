@@ -0,0 +1,90 @@
+import zlib
+from typing import AsyncIterator
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from sqlalchemy import Select
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+
+Chunk = Tuple[int, int, bytes]
+
+
+def split_output(
+    text: Optional[str],
+    preview_bytes: int,
+    chunk_bytes: int,
+) -> Tuple[Optional[str], Optional[int], List[Chunk]]:
+    """Splits an output into a preview, its UTF-8 size and compressed (offset, raw_size, data) chunks.
+
+    Outputs that fit in the preview are kept inline and produce no chunks.
+    """
+    if text is None:
+        return None, None, []
+    raw = text.encode("utf-8")
+    if len(raw) <= preview_bytes:
+        return text, len(raw), []
+    preview = raw[:preview_bytes].decode("utf-8", errors="ignore")
+    chunks = []
+    for offset in range(0, len(raw), chunk_bytes):
+        piece = raw[offset:offset + chunk_bytes]
+        chunks.append((offset, len(piece), zlib.compress(piece)))
+    return preview, len(raw), chunks
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parses a single-range ``bytes=`` header into an inclusive (start, end).
+
+    Returns None when the whole body should be sent and raises ValueError when
+    the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                raise ValueError("empty suffix range")
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        raise ValueError(f"invalid range: {header}") from None
+    if start >= size or start > end:
+        raise ValueError(f"unsatisfiable range: {header}")
+    return start, end
+
+
+def _output_stmt(result_uid: str, stream: str, start: int, end: int) -> Select:
+    return (
+        select(models.TaskResultChunk.offset, models.TaskResultChunk.data)
+        .where(
+            models.TaskResultChunk.result_uid == result_uid,
+            models.TaskResultChunk.stream == stream,
+            models.TaskResultChunk.offset <= end,
+            models.TaskResultChunk.offset + models.TaskResultChunk.raw_size > start,
+        )
+        .order_by(models.TaskResultChunk.seq)
+        .execution_options(yield_per=4)
+    )
+
+
+async def iter_output(
+    session_factory: Callable[[], AsyncSession],
+    result_uid: str,
+    stream: str,
+    start: int,
+    end: int,
+) -> AsyncIterator[bytes]:
+    """Yields bytes start..end (inclusive) of a chunked output, one decompressed chunk at a time."""
+    async with session_factory() as db:
+        rows = await db.stream(_output_stmt(result_uid, stream, start, end))
+        async for offset, data in rows:
+            piece = zlib.decompress(data)
+            yield piece[max(0, start - offset):end - offset + 1]
@@ -0,0 +1,72 @@
+"""Brings tables created by an older release up to the current models.
+
+    python -m app.schema_upgrade [--dry-run]
+
+create_all only creates missing tables, so columns and indexes added to an existing table
+never reach a database that already has it. The API and workers run upgrade_schema on
+startup; run this module by hand to apply or review the DDL ahead of a deploy.
+"""
+import argparse
+import logging
+from typing import List
+from typing import Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.schema import CreateIndex
+
+from app import models  # noqa: F401  (registers the tables on Base.metadata)
+from app.db import Base
+from app.db import engine as default_engine
+
+logger = logging.getLogger(__name__)
+
+
+def pending_ddl(engine: Engine) -> List[str]:
+    """DDL for columns and indexes the models define but existing tables lack.
+
+    Changes are additive only; nothing is dropped or altered in place.
+    """
+    inspector = inspect(engine)
+    dialect = engine.dialect
+    statements: List[str] = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        table_name = dialect.identifier_preparer.format_table(table)
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if not column.nullable and column.server_default is None:
+                raise RuntimeError(f"cannot add NOT NULL column {table.name}.{column.name} without a server default")
+            statements.append(f"ALTER TABLE {table_name} ADD COLUMN {CreateColumn(column).compile(dialect=dialect)}")
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in indexes:
+                statements.append(str(CreateIndex(index).compile(dialect=dialect)))
+    return statements
+
+
+def upgrade_schema(engine: Engine) -> List[str]:
+    statements = pending_ddl(engine)
+    with engine.begin() as connection:
+        for statement in statements:
+            logger.info(f"schema_upgrade: {statement}")
+            connection.exec_driver_sql(statement)
+    return statements
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.schema_upgrade", description="Add missing columns and indexes.")
+    parser.add_argument("--dry-run", action="store_true", help="print the DDL without running it")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    statements = pending_ddl(default_engine) if args.dry_run else upgrade_schema(default_engine)
+    for statement in statements:
+        print(f"{statement};")
+
+
+if __name__ == "__main__":
+    main()
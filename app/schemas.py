@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import List
 from typing import Optional
 
 from pydantic import BaseModel
@@ -23,6 +24,38 @@ class ServerOut(BaseModel):
         from_attributes = True
 
 
+class GroupSummary(BaseModel):
+    group: Optional[str]
+    hosts: int
+    stale: int
+    offline: int
+    cpu_avg: Optional[float]
+    cpu_p95: Optional[float]
+    memory_avg: Optional[float]
+    memory_p95: Optional[float]
+
+
+class FleetSummary(BaseModel):
+    fleet: GroupSummary
+    groups: List[GroupSummary]
+
+
+class HeartbeatPoint(BaseModel):
+    bucket: datetime
+    samples: int
+    cpu_avg: float
+    cpu_max: float
+    memory_avg: float
+    memory_max: float
+
+
+class HeartbeatSeries(BaseModel):
+    hostname: Optional[str] = None
+    group: Optional[str] = None
+    resolution: int
+    points: List[HeartbeatPoint]
+
+
 class CommandCreate(BaseModel):
     target_type: str
     target: Optional[str] = None
@@ -31,6 +64,24 @@ class CommandCreate(BaseModel):
     user: Optional[str] = None
 
 
+class CommandBatchCreate(BaseModel):
+    items: List[CommandCreate]
+
+
+class CommandBatchItemOut(BaseModel):
+    index: int
+    task_id: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+
+
+class CommandBatchOut(BaseModel):
+    total: int
+    sent: int
+    failed: int
+    items: List[CommandBatchItemOut]
+
+
 class TaskOut(BaseModel):
     task_id: str
     target_type: str
@@ -45,17 +96,61 @@ class TaskOut(BaseModel):
         from_attributes = True
 
 
+class TaskPage(BaseModel):
+    items: List[TaskOut]
+    next_cursor: Optional[str] = None
+
+
 class TaskResultOut(BaseModel):
     task_id: str
+    hostname: Optional[str] = None
+    result_uid: Optional[str] = None
     exit_code: Optional[int]
     stdout: Optional[str]
     stderr: Optional[str]
+    stdout_size: Optional[int] = None
+    stderr_size: Optional[int] = None
+    stdout_truncated: bool = False
+    stderr_truncated: bool = False
     timestamp: datetime
 
     class Config:
         from_attributes = True
 
 
+class TaskWithResults(TaskOut):
+    result_count: int = 0
+    failed_count: int = 0
+    results: List[TaskResultOut] = []
+
+
+class TaskWithResultsPage(BaseModel):
+    items: List[TaskWithResults]
+    next_cursor: Optional[str] = None
+
+
+class TaskExecutionOut(BaseModel):
+    hostname: str
+    status: str
+    exit_code: Optional[int]
+    result_uid: Optional[str]
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class TaskProgressOut(BaseModel):
+    task_id: str
+    expected: int
+    received: int
+    done: int
+    failed: int
+
+    class Config:
+        from_attributes = True
+
+
 class ClientPublicKeyIn(BaseModel):
     public_key_pem: str
 
@@ -1,5 +1,8 @@
 import threading
-from typing import Dict, Optional, Tuple
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional
 
 from cryptography.hazmat.primitives.asymmetric import rsa
 from sqlalchemy.orm import Session
@@ -8,24 +11,86 @@ from app import crud
 from app.util.sign_util import load_public_key_from_pem
 
 
+class _CachedKey:
+    __slots__ = ("public_key", "updated_at", "expires_at", "checked_at")
+
+    def __init__(
+        self,
+        public_key: Optional[rsa.RSAPublicKey],
+        updated_at: Optional[datetime],
+        expires_at: float,
+        checked_at: float,
+    ) -> None:
+        self.public_key = public_key
+        self.updated_at = updated_at
+        self.expires_at = expires_at
+        self.checked_at = checked_at
+
+
 class PublicKeyStore:
-    def __init__(self) -> None:
+    """TTL/LRU cache of client public keys; hosts without a key are cached as misses too.
+
+    With a positive ``version_check_interval`` a cached entry is revalidated against
+    ``updated_at`` at most once per interval, which picks up keys changed on other nodes.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        ttl: float = 300.0,
+        max_entries: int = 10000,
+        version_check_interval: float = 0.0,
+    ) -> None:
+        self._session_factory = session_factory
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._version_check_interval = version_check_interval
         self._lock = threading.Lock()
-        self._cache: Dict[str, Tuple[str, rsa.RSAPublicKey]] = {}
+        self._cache: "OrderedDict[str, _CachedKey]" = OrderedDict()
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        """Bumped on every invalidation, so caches held by other processes can follow."""
+        return self._generation
 
-    def get_public_key(self, db: Session, hostname: str) -> Optional[rsa.RSAPublicKey]:
+    def get_public_key(self, hostname: str) -> Optional[rsa.RSAPublicKey]:
         if not hostname:
             return None
-        record = crud.get_client_public_key(db, hostname)
-        if not record:
-            return None
-        pem = record.public_key_pem
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(hostname)
+            if entry and now < entry.expires_at:
+                self._cache.move_to_end(hostname)
+                if not self._version_check_interval or now - entry.checked_at < self._version_check_interval:
+                    return entry.public_key
+            else:
+                entry = None
+        if entry is not None:
+            with self._session_factory() as db:
+                updated_at = crud.get_client_public_key_updated_at(db, hostname)
+            if updated_at == entry.updated_at:
+                entry.checked_at = now
+                return entry.public_key
+        return self._load(hostname, now)
+
+    def _load(self, hostname: str, now: float) -> Optional[rsa.RSAPublicKey]:
+        with self._session_factory() as db:
+            record = crud.get_client_public_key(db, hostname)
+            pem = record.public_key_pem if record else None
+            updated_at = record.updated_at if record else None
+        public_key = load_public_key_from_pem(pem) if pem else None
         with self._lock:
-            cached = self._cache.get(hostname)
-            if cached and cached[0] == pem:
-                return cached[1]
-        public_key = load_public_key_from_pem(pem)
-        if public_key:
-            with self._lock:
-                self._cache[hostname] = (pem, public_key)
+            self._cache[hostname] = _CachedKey(public_key, updated_at, now + self._ttl, now)
+            self._cache.move_to_end(hostname)
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
         return public_key
+
+    def invalidate(self, hostname: Optional[str] = None) -> None:
+        with self._lock:
+            self._generation += 1
+            if hostname is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(hostname, None)
@@ -1,7 +1,11 @@
 import json
 import base64
+import hashlib
 import logging
-from typing import Any, Dict, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.exceptions import InvalidSignature
@@ -21,6 +25,8 @@ class RSASigner:
         self._enabled = enabled
         self._private_key: Optional[rsa.RSAPrivateKey] = None
         self._public_key: Optional[rsa.RSAPublicKey] = None
+        self._header_lock = threading.Lock()
+        self._header_signatures: Dict[Tuple[str, int], str] = {}
 
         # 加载私钥
         if private_key_path:
@@ -61,6 +67,23 @@ class RSASigner:
         # 3. Base64 编码
         return base64.b64encode(signature).decode('utf-8')
 
+    def sign_header(self, hostname: str, timestamp: int) -> str:
+        """生成 {hostname, timestamp} 的签名，同一主机同一秒内复用"""
+        cache_key = (hostname, timestamp)
+        with self._header_lock:
+            cached = self._header_signatures.get(cache_key)
+        if cached is not None:
+            return cached
+
+        signature = self.sign({"hostname": hostname, "timestamp": timestamp})
+        if signature:
+            with self._header_lock:
+                # 只保留最近一秒内的签名
+                for stale in [k for k in self._header_signatures if k[1] < timestamp - 1]:
+                    del self._header_signatures[stale]
+                self._header_signatures[cache_key] = signature
+        return signature
+
     def verify(self, params: Dict[str, Any], signature_str: str) -> bool:
         """验证签名"""
         if not self._enabled or not self._public_key:
@@ -129,6 +152,55 @@ def verify_with_public_key(
         logger.error(f"Signature verification failed: {e}")
         return False
 
+
+class SignatureVerifier:
+    """带缓存的签名验证器
+
+    签名内容只有 {hostname, timestamp}，同一主机同一秒内的消息签名完全相同，
+    因此验证成功的结果在时间窗口内复用，避免重复的 RSA 验证。
+    """
+
+    def __init__(self, window: float = 60.0, max_entries: int = 100000, enabled: bool = True):
+        self._window = window
+        self._max_entries = max_entries
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[Any, Any, bytes], Tuple[rsa.RSAPublicKey, float]]" = OrderedDict()
+
+    def verify(
+        self,
+        params: Dict[str, Any],
+        signature_str: str,
+        public_key: Optional[rsa.RSAPublicKey],
+    ) -> bool:
+        if not self._enabled:
+            return True
+        if not public_key:
+            return False
+        if not signature_str:
+            raise ValueError("missing signature")
+
+        # 缓存键包含签名内容与签名本身的摘要；缓存项记录验证时所用的公钥对象，
+        # 公钥轮换或删除后 public_key_store 返回新对象或 None，旧缓存项不会再命中，过期后被淘汰
+        digest = hashlib.sha256(_build_sorted_json(params) + signature_str.encode("utf-8")).digest()
+        cache_key = (params.get("hostname"), params.get("timestamp"), digest)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached and cached[0] is public_key and now < cached[1]:
+                self._cache.move_to_end(cache_key)
+                return True
+
+        verified = verify_with_public_key(params, signature_str, public_key, True)
+        if verified:
+            with self._lock:
+                self._cache[cache_key] = (public_key, now + self._window)
+                self._cache.move_to_end(cache_key)
+                while len(self._cache) > self._max_entries:
+                    self._cache.popitem(last=False)
+        return verified
+
+
 # --- 使用示例 ---
 if __name__ == "__main__":
     # 假设你已经有了 pem 文件
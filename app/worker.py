@@ -0,0 +1,77 @@
+"""Runs the message consumers and background flushers apart from the API.
+
+    python -m app.worker [--result-processes N] [--status-processes N] [--heartbeat-processes N]
+
+Start the API with EMBEDDED_CONSUMERS=false so only workers consume, and set
+CLUSTER_BROADCAST=true on every node so change events and key updates reach all of them.
+With N > 0 a queue decodes and verifies messages in N processes; database writes and acks
+stay in this one. SIGTERM or SIGINT stops consuming, lets in-flight messages finish and
+acks them, waiting at most CONSUMER_SHUTDOWN_TIMEOUT seconds.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+from typing import List
+from typing import Optional
+
+from app import crud
+from app.cluster import cluster_bus
+from app.cluster import join_cluster
+from app.config import settings
+from app.db import Base
+from app.db import SessionLocal
+from app.db import engine
+from app.fleet_state import fleet_state
+from app.fleet_state import pump_server_changes
+from app.mq import batch_publisher
+from app.mq import drain_consumers
+from app.mq import publisher
+from app.mq import start_consumers
+from app.schema_upgrade import upgrade_schema
+
+logger = logging.getLogger(__name__)
+
+
+async def run() -> None:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    with SessionLocal() as db:
+        fleet_state.load(crud.get_servers(db))
+    if settings.cluster_broadcast:
+        join_cluster(reload_fleet=False)
+    # The liveness sweep and heartbeats update this node's fleet view; the pump shares the changes.
+    pump = asyncio.create_task(pump_server_changes())
+    start_consumers()
+    logger.info("worker_started")
+
+    await stop.wait()
+    logger.info("worker_stopping")
+    await drain_consumers(settings.consumer_shutdown_timeout)
+    pump.cancel()
+    publisher.close()
+    batch_publisher.close()
+    cluster_bus.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.worker", description="Run the message consumers.")
+    parser.add_argument("--result-processes", type=int, default=settings.result_processes)
+    parser.add_argument("--status-processes", type=int, default=settings.status_processes)
+    parser.add_argument("--heartbeat-processes", type=int, default=settings.heartbeat_processes)
+    args = parser.parse_args(argv)
+    settings.result_processes = args.result_processes
+    settings.status_processes = args.status_processes
+    settings.heartbeat_processes = args.heartbeat_processes
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
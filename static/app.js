@@ -1,11 +1,21 @@
 const serversBody = document.getElementById("servers-body");
 const tasksBody = document.getElementById("tasks-body");
+const servers = new Map();
+let tasks = [];
+// Same size as the first page, so live updates never grow the list past it.
+const TASK_PAGE_SIZE = 50;
 
 async function loadServers() {
   const res = await fetch("/api/servers");
   const data = await res.json();
+  servers.clear();
+  data.forEach((s) => servers.set(s.hostname, s));
+  renderServers();
+}
+
+function renderServers() {
   serversBody.innerHTML = "";
-  data.forEach((s) => {
+  servers.forEach((s) => {
     const tr = document.createElement("tr");
     tr.innerHTML = `
       <td>${s.hostname || ""}</td>
@@ -44,10 +54,15 @@ serversBody.addEventListener('click', async (e) => {
 });
 
 async function loadTasks() {
-  const res = await fetch("/api/tasks");
-  const data = await res.json();
+  const res = await fetch(`/api/tasks/with-results?limit=${TASK_PAGE_SIZE}`);
+  const page = await res.json();
+  tasks = page.items;
+  renderTasks();
+}
+
+function renderTasks() {
   tasksBody.innerHTML = "";
-  data.forEach((t) => {
+  tasks.forEach((t) => {
     const tr = document.createElement("tr");
     const target = t.target_type === "all" ? "all" : `${t.target_type}:${t.target || ""}`;
     const btn = `<button data-task="${t.task_id}">查看</button>`;
@@ -59,10 +74,8 @@ async function loadTasks() {
       <td>${t.created_at}</td>
       <td>${btn}</td>
     `;
-    tr.querySelector("button").addEventListener("click", async () => {
-      const res2 = await fetch(`/api/tasks/${t.task_id}/results`);
-      const results = await res2.json();
-      alert(JSON.stringify(results, null, 2));
+    tr.querySelector("button").addEventListener("click", () => {
+      alert(JSON.stringify(t.results || [], null, 2));
     });
     tasksBody.appendChild(tr);
   });
@@ -110,10 +123,46 @@ document.getElementById("send-command").addEventListener("click", async () => {
   await loadTasks();
 });
 
-loadServers();
-loadTasks();
-setInterval(loadServers, 5000);
-setInterval(loadTasks, 5000);
+// 通过 SSE 接收服务器与任务的增量更新，连接（重连）成功后重新加载一次全量数据
+function connectStream() {
+  const source = new EventSource("/api/stream");
+  source.onopen = () => {
+    loadServers();
+    loadTasks();
+  };
+  source.addEventListener("servers", (e) => {
+    JSON.parse(e.data).forEach((s) => servers.set(s.hostname, s));
+    renderServers();
+  });
+  source.addEventListener("task", (e) => {
+    const task = { results: [], ...JSON.parse(e.data) };
+    tasks = [task, ...tasks.filter((t) => t.task_id !== task.task_id)].slice(0, TASK_PAGE_SIZE);
+    renderTasks();
+  });
+  source.addEventListener("task_status", (e) => {
+    const update = JSON.parse(e.data);
+    const task = tasks.find((t) => t.task_id === update.task_id);
+    if (task) {
+      task.status = update.status;
+      renderTasks();
+    }
+  });
+  source.addEventListener("result", (e) => {
+    const result = JSON.parse(e.data);
+    const task = tasks.find((t) => t.task_id === result.task_id);
+    if (task) {
+      // A redelivered result carries the same result_uid; replace it instead of adding a row.
+      const others = (task.results || []).filter((r) => !result.result_uid || r.result_uid !== result.result_uid);
+      task.results = [...others, result];
+    }
+  });
+  source.addEventListener("resync", () => {
+    loadServers();
+    loadTasks();
+  });
+}
+
+connectStream();
 
 // 模态框控制
 const keyModal = document.getElementById('key-modal');
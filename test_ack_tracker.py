@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Test script for batched multiple=True acknowledgements
+"""
+
+from app.ack_tracker import AckTracker
+
+
+def test_ack_waits_for_contiguous_prefix():
+    """Out-of-order completions are only acked once the prefix is done"""
+    print('=== Testing contiguous ack prefix ===')
+    tracker = AckTracker(batch_size=2)
+    for tag in (1, 2, 3, 4):
+        tracker.delivered(tag)
+    assert tracker.completed(2) is None
+    assert tracker.completed(3) is None
+    assert tracker.completed(1) == 3
+    assert tracker.completed(4) == 4
+
+
+def test_ack_flushes_when_idle():
+    """A partial batch is acked once nothing else is in flight"""
+    print('\n=== Testing idle ack flush ===')
+    tracker = AckTracker(batch_size=10)
+    tracker.delivered(1)
+    tracker.delivered(2)
+    assert tracker.completed(1) is None
+    assert tracker.completed(2) == 2
+
+
+if __name__ == '__main__':
+    test_ack_waits_for_contiguous_prefix()
+    test_ack_flushes_when_idle()
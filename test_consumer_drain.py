@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test script for graceful consumer shutdown
+"""
+
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from app import mq
+from app.metrics import mq_handler_seconds
+
+
+class FakeConnection:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def add_callback_threadsafe(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def process_data_events(self, time_limit=None):
+        with self._lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class FakeChannel:
+    """Hands out deliveries like BlockingChannel.consume and requests shutdown at `stop_at`"""
+
+    def __init__(self, tags, stop_at):
+        self.prefetched = deque(tags)
+        self.stop_at = stop_at
+        self.acked = []
+        self.requeued = []
+        self.cancelled = False
+
+    def basic_qos(self, prefetch_count):
+        pass
+
+    def consume(self, queue, inactivity_timeout=None):
+        while self.prefetched:
+            tag = self.prefetched.popleft()
+            if tag == self.stop_at:
+                mq._stopping.set()
+            yield SimpleNamespace(delivery_tag=tag), None, b'{}'
+
+    def cancel(self):
+        # pika rejects the deliveries it still buffers with requeue=True.
+        self.cancelled = True
+        self.requeued.extend(self.prefetched)
+        self.prefetched.clear()
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked.append((delivery_tag, multiple))
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        assert requeue
+        self.requeued.append(delivery_tag)
+
+
+def test_worker_pool_drain():
+    """In-flight deliveries finish and are acked; the rest go back to the queue"""
+    print('=== Testing worker pool drain ===')
+    connection = FakeConnection()
+    channel = FakeChannel(range(1, 9), stop_at=4)
+    applied = []
+
+    def apply(parsed):
+        time.sleep(0.05)
+        applied.append(parsed)
+        return True
+
+    try:
+        mq._run_worker_pool(connection, channel, 'cmd.result', lambda body, properties: {'ok': True},
+                            apply, workers=4, prefetch=8, error_log='test_error')
+    finally:
+        mq._stopping.clear()
+    assert len(applied) == 3
+    assert channel.acked[-1] == (3, True)
+    assert channel.cancelled
+    assert sorted(channel.requeued) == [4, 5, 6, 7, 8]
+    print('✓ In-flight messages acked, prefetched ones requeued')
+
+
+def test_batch_drain():
+    """A batch consumer flushes what it collected and requeues the rest"""
+    print('\n=== Testing batch drain ===')
+    channel = FakeChannel(range(1, 7), stop_at=3)
+    stored = []
+    try:
+        mq._consume_batches(channel, 'task.status', None, lambda body, properties: {'ok': True},
+                            stored.append, batch_size=10, flush_interval=60, error_log='test_error')
+    finally:
+        mq._stopping.clear()
+    assert stored == [[{'ok': True}, {'ok': True}]]
+    assert channel.acked == [(2, True)]
+    assert sorted(channel.requeued) == [3, 4, 5, 6]
+    print('✓ Collected batch stored and acked before exit')
+
+
+def test_batch_handler_time_includes_parse():
+    """In-process parsing in a batch consumer is counted as handler time"""
+    print('\n=== Testing batch handler timing ===')
+    channel = FakeChannel(range(1, 4), stop_at=3)
+
+    def parse(body, properties):
+        time.sleep(0.02)
+        return {'ok': True}
+
+    try:
+        mq._consume_batches(channel, 'timed.status', None, parse, lambda items: None,
+                            batch_size=10, flush_interval=60, error_log='test_error')
+    finally:
+        mq._stopping.clear()
+    series = mq_handler_seconds._series(('timed.status',))
+    assert sum(series[:-1]) == 2
+    assert series[-1] >= 0.04
+    print('✓ Parse time recorded per message')
+
+
+if __name__ == '__main__':
+    test_worker_pool_drain()
+    test_batch_drain()
+    test_batch_handler_time_includes_parse()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Test script for connection pool instrumentation
+"""
+
+from sqlalchemy import create_engine
+
+from app.db_pool import InstrumentedQueuePool
+from app.db_pool import count_overflow
+
+
+def _engine():
+    engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=2)
+    count_overflow(engine)
+    return engine
+
+
+def test_overflow_connections_are_counted():
+    """Only connections opened beyond pool_size count as overflow"""
+    print('=== Testing overflow counting ===')
+    engine = _engine()
+    connections = [engine.connect() for _ in range(3)]
+    stats = engine.pool.stats()
+    assert stats['overflow_events'] == 2 and stats['overflow'] == 2
+    assert stats['checked_out'] == 3 and stats['checkouts'] == 3
+    for connection in connections:
+        connection.close()
+    # A checkout served from the pool opens nothing new.
+    engine.connect().close()
+    assert engine.pool.stats()['overflow_events'] == 2
+    print('✓ Overflow counted per new connection')
+
+
+def test_counting_survives_dispose():
+    """The replacement pool from dispose() is counted once, by the same listener"""
+    print('\n=== Testing overflow counting after dispose ===')
+    engine = _engine()
+    engine.dispose()
+    connections = [engine.connect() for _ in range(2)]
+    assert engine.pool.stats()['overflow_events'] == 1
+    for connection in connections:
+        connection.close()
+    print('✓ New pool counted without duplicates')
+
+
+if __name__ == '__main__':
+    test_overflow_connections_are_counted()
+    test_counting_survives_dispose()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test script for in-memory fan-out progress counters
+"""
+
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+from app import models
+from app import mq_handlers
+from app import schemas
+from app.db import Base
+from app.fanout_progress import FanoutProgress
+
+
+def _progress_db(**counts):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as db:
+        for task_id, expected in counts.items():
+            db.add(models.TaskProgress(task_id=task_id, expected=expected))
+        db.commit()
+    return factory
+
+
+def test_record_and_drain():
+    """Results are counted per task and drained in one batch"""
+    print('=== Testing fan-out counters ===')
+    progress = FanoutProgress()
+    progress.record('t1', succeeded=True)
+    progress.record('t1', succeeded=False)
+    progress.record('t2', succeeded=True, unexpected=True)
+    assert progress.pending('t1') == {'expected': 0, 'received': 2, 'done': 1, 'failed': 1}
+    deltas = progress.drain()
+    assert deltas['t2'] == {'expected': 1, 'received': 1, 'done': 1, 'failed': 0}
+    assert len(progress) == 0
+    assert progress.pending('t1') is None
+
+
+def test_restore_merges_failed_flush():
+    """Deltas from a failed flush are merged with newer counts"""
+    print('\n=== Testing restore after failed flush ===')
+    progress = FanoutProgress()
+    progress.record('t1', succeeded=True)
+    deltas = progress.drain()
+    progress.record('t1', succeeded=False)
+    progress.restore(deltas)
+    assert progress.pending('t1') == {'expected': 0, 'received': 2, 'done': 1, 'failed': 1}
+
+
+def test_failed_flush_is_applied_once():
+    """A flush that fails before its commit is restored and applied exactly once on retry"""
+    print('\n=== Testing flush retry without double counting ===')
+    factory = _progress_db(t1=3)
+    progress = FanoutProgress()
+    progress.record('t1', succeeded=True)
+    progress.record('t1', succeeded=False)
+    validate = schemas.TaskProgressOut.model_validate
+    with mock.patch.object(mq_handlers, 'SessionLocal', factory), \
+            mock.patch.object(mq_handlers, 'fanout_progress', progress), \
+            mock.patch.object(mq_handlers, 'event_bus'):
+        with mock.patch.object(schemas.TaskProgressOut, 'model_validate', side_effect=RuntimeError('boom')):
+            mq_handlers.flush_fanout_progress()
+        assert progress.pending('t1') == {'expected': 0, 'received': 2, 'done': 1, 'failed': 1}
+        mq_handlers.flush_fanout_progress()
+    assert len(progress) == 0
+    with factory() as db:
+        row = validate(crud.get_task_progress(db, 't1'))
+    assert (row.received, row.done, row.failed) == (2, 1, 1)
+    print('✓ Counters applied once')
+
+
+def test_failed_done_transition_is_retried():
+    """A fully received task whose move to done fails is retried by the next flush"""
+    print('\n=== Testing done transition retry ===')
+    factory = _progress_db(t1=1)
+    progress = FanoutProgress()
+    progress.record('t1', succeeded=True)
+    transition = mock.Mock(side_effect=[RuntimeError('lock wait timeout'), 1])
+    with mock.patch.object(mq_handlers, 'SessionLocal', factory), \
+            mock.patch.object(mq_handlers, 'fanout_progress', progress), \
+            mock.patch.object(mq_handlers, 'event_bus') as event_bus, \
+            mock.patch.object(mq_handlers.crud, 'transition_tasks', transition):
+        mq_handlers.flush_fanout_progress()
+        assert len(progress) == 0
+        assert event_bus.publish.call_args.args[0] == 'task_progress'
+        mq_handlers.flush_fanout_progress()
+    assert [call.args[1] for call in transition.call_args_list] == [['t1'], ['t1']]
+    event_bus.publish.assert_called_with('task_status', {'task_id': 't1', 'status': 'done'})
+    assert progress.drain_finished() == []
+    print('✓ Task moved to done on the next flush')
+
+
+if __name__ == '__main__':
+    test_record_and_drain()
+    test_restore_merges_failed_flush()
+    test_failed_flush_is_applied_once()
+    test_failed_done_transition_is_retried()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Test script for vectorized fleet statistics
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from app.fleet_columns import FleetColumns
+
+
+def test_group_statistics():
+    """Averages, nearest-rank p95 and stale/offline counts per group"""
+    print('=== Testing per-group statistics ===')
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    columns = FleetColumns(capacity=2)
+    for index in range(20):
+        columns.set(f'web-{index}', 'web', 'online', now, float(index + 1), 50.0)
+    columns.set('db-1', 'db', 'offline', now - timedelta(minutes=10), None, 80.0)
+    columns.set('db-2', 'db', 'online', now - timedelta(minutes=10), 40.0, 20.0)
+    columns.set('new-1', None, 'unknown', None, None, None)
+
+    fleet, groups = columns.summarize(now.timestamp(), stale_after=60)
+    by_name = {group['group']: group for group in groups}
+    assert fleet['hosts'] == 23 and fleet['stale'] == 2 and fleet['offline'] == 1
+    assert by_name['web']['cpu_avg'] == 10.5
+    assert by_name['web']['cpu_p95'] == 19.0
+    assert by_name['db']['cpu_p95'] == 40.0 and by_name['db']['memory_avg'] == 50.0
+    assert by_name[None]['cpu_avg'] is None
+
+
+def test_update_replaces_host_values():
+    """Setting a known host overwrites its slot instead of adding one"""
+    print('\n=== Testing host updates ===')
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    columns = FleetColumns()
+    columns.set('web-1', 'web', 'online', now, 90.0, 10.0)
+    columns.set('web-1', 'web', 'online', now, 30.0, 10.0)
+    fleet, _ = columns.summarize(now.timestamp(), stale_after=60)
+    assert len(columns) == 1 and fleet['cpu_avg'] == 30.0
+
+
+if __name__ == '__main__':
+    test_group_statistics()
+    test_update_replaces_host_values()
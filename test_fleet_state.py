@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Test script for the in-process fleet view and its reload fallback
+"""
+
+from datetime import datetime, timezone
+from unittest import mock
+
+from app import main
+from app import models
+from app.fleet_state import FleetState
+
+
+def _server(hostname, cpu):
+    return models.Server(
+        hostname=hostname,
+        ip='10.0.0.1',
+        group='web',
+        status='online',
+        last_heartbeat=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        cpu_usage=cpu,
+        memory_usage=0.5,
+    )
+
+
+def test_reload_streams_only_changed_servers():
+    """Reloading from the database queues change events only for servers that differ"""
+    print('=== Testing fleet reload ===')
+    fleet = FleetState()
+    fleet.load([_server('web-01', 0.1), _server('web-02', 0.2)])
+    assert sorted(server.hostname for server in fleet.drain_changes()) == ['web-01', 'web-02']
+    fleet.load([_server('web-01', 0.1), _server('web-02', 0.9)])
+    assert [server.cpu_usage for server in fleet.drain_changes()] == [0.9]
+    assert fleet.get('web-02').cpu_usage == 0.9
+    print('✓ Only changed servers streamed')
+
+
+def test_reload_needed_without_heartbeat_source():
+    """Processes that cannot see every heartbeat fall back to reloading from the database"""
+    print('\n=== Testing reload fallback decision ===')
+    cases = [
+        (False, True, 1, False),
+        (False, False, 1, True),
+        (False, True, 4, True),
+        (True, False, 4, False),
+    ]
+    for cluster_broadcast, embedded_consumers, web_concurrency, expected in cases:
+        with mock.patch.multiple(
+            main.settings,
+            cluster_broadcast=cluster_broadcast,
+            embedded_consumers=embedded_consumers,
+            web_concurrency=web_concurrency,
+        ):
+            assert main.fleet_reload_needed() is expected
+    print('✓ Reload used only when heartbeats are missed')
+
+
+if __name__ == '__main__':
+    test_reload_streams_only_changed_servers()
+    test_reload_needed_without_heartbeat_source()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Test script for heartbeat batching and coalescing
+"""
+
+import json
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+from sqlalchemy.dialects import mysql
+from sqlalchemy.exc import DataError
+from sqlalchemy.exc import OperationalError
+
+from app import crud
+from app import mq_handlers
+from app.heartbeat_batch import HeartbeatBatch
+
+
+def _heartbeat(hostname, ts, cpu):
+    return {
+        "hostname": hostname,
+        "status": "online",
+        "timestamp": datetime.fromtimestamp(ts, timezone.utc),
+        "cpu_usage": cpu,
+        "memory_usage": 0.5,
+    }
+
+
+def test_batch_keeps_latest_per_hostname():
+    """Only the newest heartbeat of each host is flushed"""
+    print('=== Testing heartbeat coalescing ===')
+    batch = HeartbeatBatch(max_size=10, max_delay=60)
+    batch.add(1, _heartbeat("a", 100, 0.1))
+    batch.add(2, _heartbeat("b", 100, 0.2))
+    batch.add(3, _heartbeat("a", 102, 0.3))
+    batch.add(4, _heartbeat("a", 101, 0.9))
+    batch.add(5, None)
+
+    heartbeats, history, last_tag = batch.drain()
+    by_host = {hb["hostname"]: hb for hb in heartbeats}
+    assert last_tag == 5
+    assert len(heartbeats) == 2
+    assert by_host["a"]["cpu_usage"] == 0.3
+    assert [hb["cpu_usage"] for hb in history] == [0.1, 0.2, 0.3, 0.9]
+    assert len(batch) == 0
+
+
+def test_batch_due_on_size():
+    """A full batch is due without waiting for the delay"""
+    print('\n=== Testing heartbeat batch size limit ===')
+    batch = HeartbeatBatch(max_size=2, max_delay=60)
+    assert not batch.due()
+    batch.add(1, _heartbeat("a", 100, 0.1))
+    assert not batch.due()
+    batch.add(2, _heartbeat("a", 101, 0.1))
+    assert batch.due()
+
+
+def test_batch_due_on_delay():
+    """A partial batch is due once the delay has passed"""
+    print('\n=== Testing heartbeat batch delay ===')
+    batch = HeartbeatBatch(max_size=100, max_delay=0)
+    batch.add(1, _heartbeat("a", 100, 0.1))
+    assert batch.due()
+
+
+def test_parse_rejects_bad_values():
+    """Heartbeats the servers columns would reject are dropped at parse time"""
+    print('\n=== Testing heartbeat validation ===')
+
+    def parse(**fields):
+        body = {"hostname": "web-01", "status": "online", "timestamp": 100, "cpu_usage": 0.5, "mem_usage": 0.5}
+        body.update(fields)
+        return mq_handlers.parse_heartbeat_message(json.dumps(body).encode(), None)
+
+    assert parse()["cpu_usage"] == 0.5
+    assert parse(cpu_usage=None, mem_usage=1)["memory_usage"] == 1.0
+    assert parse(cpu_usage="high") is None
+    assert parse(mem_usage={"used": 1}) is None
+    assert parse(cpu_usage=True) is None
+    assert parse(hostname="h" * 129) is None
+    assert parse(hostname=["web-01"]) is None
+    assert parse(status="s" * 33) is None
+    print('✓ Invalid types and lengths rejected')
+
+
+def _db_error(kind):
+    return kind("INSERT INTO servers ...", {}, Exception("boom"))
+
+
+def test_store_falls_back_per_host():
+    """A rejected batch is retried host by host and only the bad host is dropped"""
+    print('\n=== Testing heartbeat store fallback ===')
+    heartbeats = [_heartbeat("a", 100, 0.1), _heartbeat("b", 100, 0.2)]
+    history = heartbeats + [_heartbeat("a", 99, 0.3)]
+    calls = []
+
+    def upsert(db, batch, samples):
+        calls.append(([hb["hostname"] for hb in batch], len(samples)))
+        if len(batch) > 1 or batch[0]["hostname"] == "a":
+            raise _db_error(DataError)
+
+    with mock.patch.object(mq_handlers, 'SessionLocal'), \
+            mock.patch.object(mq_handlers.crud, 'upsert_heartbeats', side_effect=upsert):
+        mq_handlers.store_heartbeats(heartbeats, history)
+    assert calls == [(["a", "b"], 3), (["a"], 2), (["b"], 1)]
+    print('✓ Bad host dropped, others stored')
+
+
+def test_store_raises_on_outage():
+    """Connection-level failures still go back to the caller for a requeue"""
+    print('\n=== Testing heartbeat store outage ===')
+    with mock.patch.object(mq_handlers, 'SessionLocal'), \
+            mock.patch.object(mq_handlers.crud, 'upsert_heartbeats', side_effect=_db_error(OperationalError)):
+        with pytest.raises(OperationalError):
+            mq_handlers.store_heartbeats([_heartbeat("a", 100, 0.1)], [])
+    print('✓ Outage raised')
+
+
+def test_upsert_never_moves_heartbeat_back():
+    """Every column is guarded by the stored heartbeat time, which is assigned last"""
+    print('\n=== Testing heartbeat upsert guard ===')
+    sql = str(crud.heartbeat_upsert_stmt([_heartbeat("a", 100, 0.1)]).compile(dialect=mysql.dialect()))
+    updates = sql.split("ON DUPLICATE KEY UPDATE ")[1].split(" END, ")
+    assert [update.split(" = ")[0] for update in updates] == ["status", "cpu_usage", "memory_usage", "last_heartbeat"]
+    assert all("VALUES(last_heartbeat) >= servers.last_heartbeat" in update for update in updates)
+    print('✓ Older beats leave the row untouched')
+
+
+if __name__ == '__main__':
+    test_batch_keeps_latest_per_hostname()
+    test_batch_due_on_size()
+    test_batch_due_on_delay()
+    test_parse_rejects_bad_values()
+    test_store_falls_back_per_host()
+    test_store_raises_on_outage()
+    test_upsert_never_moves_heartbeat_back()
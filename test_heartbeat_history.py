@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Test script for heartbeat rollup pre-aggregation
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy import insert
+from sqlalchemy.dialects import mysql
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session
+
+from app import crud
+from app import models
+from app.db import Base
+from app.heartbeat_history import bucket_start
+from app.heartbeat_history import choose_resolution
+from app.heartbeat_history import rollup_rows
+from app.heartbeat_history import sample_rows
+from app.heartbeat_history import unseen_samples
+from app.main import load_heartbeat_series
+
+
+def _heartbeat(hostname, timestamp, cpu, memory):
+    return {
+        'hostname': hostname,
+        'status': 'online',
+        'timestamp': timestamp,
+        'cpu_usage': cpu,
+        'memory_usage': memory,
+    }
+
+
+def test_rollup_rows_merge_batch_per_bucket():
+    """A batch collapses into one row per resolution, host and bucket"""
+    print('=== Testing rollup pre-aggregation ===')
+    base = datetime(2024, 1, 1, 12, 0, 10, tzinfo=timezone.utc)
+    rows = rollup_rows(sample_rows([
+        _heartbeat('web-01', base, 10.0, 40.0),
+        _heartbeat('web-01', base + timedelta(seconds=30), 30.0, 60.0),
+        _heartbeat('web-01', base + timedelta(seconds=60), 20.0, 50.0),
+        _heartbeat('web-02', base, None, 10.0),
+    ]))
+    minute = [row for row in rows if row['resolution'] == 60]
+    assert [row['samples'] for row in minute] == [2, 1]
+    assert minute[0]['bucket'] == datetime(2024, 1, 1, 12, 0)
+    assert minute[0]['cpu_sum'] == 40.0 and minute[0]['cpu_max'] == 30.0
+    hour = [row for row in rows if row['resolution'] == 3600]
+    assert len(hour) == 1 and hour[0]['samples'] == 3 and hour[0]['memory_max'] == 60.0
+
+
+def test_redelivered_samples_are_skipped():
+    """Samples already stored, or repeated within a batch, are not counted again"""
+    print('\n=== Testing sample de-duplication ===')
+    base = datetime(2024, 1, 1, 12, 0, 10, 250000, tzinfo=timezone.utc)
+    first = [_heartbeat('web-01', base, 10.0, 40.0), _heartbeat('web-01', base + timedelta(seconds=5), 20.0, 50.0)]
+    samples = sample_rows(first + first[:1])
+    assert len(samples) == 2 and samples[0]['ts'] == datetime(2024, 1, 1, 12, 0, 10)
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.execute(insert(models.HeartbeatSample), samples)
+        redelivered = sample_rows(first + [_heartbeat('web-01', base + timedelta(seconds=10), 30.0, 60.0)])
+        new = unseen_samples(redelivered, db.execute(crud.stored_samples_stmt(redelivered)))
+    assert [sample['cpu_usage'] for sample in new] == [30.0]
+    assert rollup_rows(new)[0]['samples'] == 1
+    print('✓ Only the new beat reaches the rollups')
+
+
+def test_batch_with_missing_metrics():
+    """Heartbeats without numeric usage are kept out of samples and rollups instead of failing the flush"""
+    print('\n=== Testing missing metrics ===')
+    base = datetime(2024, 1, 1, 12, 0, 10, tzinfo=timezone.utc)
+    batch = [
+        _heartbeat('web-01', base, 10.0, 40.0),
+        _heartbeat('web-02', base, None, None),
+        _heartbeat('web-03', base, 'high', 20.0),
+        _heartbeat('web-04', base, 5.0, float('nan')),
+    ]
+    samples = sample_rows(batch)
+    assert [sample['hostname'] for sample in samples] == ['web-01']
+    rows = rollup_rows([dict(samples[0], hostname='web-02', cpu_usage=None)] + samples)
+    assert {row['hostname'] for row in rows} == {'web-01'}
+    assert {row['samples'] for row in rows} == {1}
+    for stmt in crud.heartbeat_history_stmts(samples) + [crud.heartbeat_upsert_stmt(batch)]:
+        stmt.compile(dialect=mysql.dialect())
+    print('✓ Flush statements build for a batch with missing metrics')
+
+
+def test_bucket_and_resolution_choice():
+    """Buckets align to UTC and the finest fitting rollup is chosen"""
+    print('\n=== Testing bucket alignment and resolution choice ===')
+    local = datetime(2024, 1, 1, 20, 7, 30, tzinfo=timezone(timedelta(hours=8)))
+    assert bucket_start(local, 300) == datetime(2024, 1, 1, 12, 5)
+    end = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    assert choose_resolution(end - timedelta(hours=1), end, 300) == 60
+    assert choose_resolution(end - timedelta(hours=24), end, 300) == 300
+    assert choose_resolution(end - timedelta(days=30), end, 300) == 3600
+
+
+def test_series_accepts_naive_and_mixed_bounds():
+    """Naive query bounds are read as UTC and can be mixed with aware ones"""
+    print('\n=== Testing heartbeat series bounds ===')
+    # The async sqlite driver is a test-only dependency and not in requirements.txt.
+    pytest.importorskip('aiosqlite')
+
+    async def run():
+        engine = create_async_engine('sqlite+aiosqlite://')
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        async with AsyncSession(engine) as db:
+            naive = await load_heartbeat_series(
+                db, datetime(2024, 1, 1), datetime(2024, 1, 1, 2), None, hostname='web-01'
+            )
+            mixed = await load_heartbeat_series(
+                db, datetime(2024, 1, 1), datetime(2024, 1, 1, 2, tzinfo=timezone.utc), None, hostname='web-01'
+            )
+            recent = await load_heartbeat_series(
+                db, datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=30), None, None, hostname='web-01'
+            )
+        await engine.dispose()
+        return naive, mixed, recent
+
+    naive, mixed, recent = asyncio.run(run())
+    assert naive.resolution == mixed.resolution == 60
+    assert recent.resolution == 60 and recent.points == []
+    print('✓ Naive and aware bounds compare cleanly')
+
+
+if __name__ == '__main__':
+    test_rollup_rows_merge_batch_per_bucket()
+    test_redelivered_samples_are_skipped()
+    test_batch_with_missing_metrics()
+    test_bucket_and_resolution_choice()
+    test_series_accepts_naive_and_mixed_bounds()
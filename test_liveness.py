@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Test script for the liveness deadline index
+"""
+
+from app.liveness import DeadlineIndex
+
+
+def test_pop_expired_returns_only_overdue_hosts():
+    """Hosts that beat after the cutoff are rescheduled, not expired"""
+    print('=== Testing deadline expiry ===')
+    index = DeadlineIndex()
+    index.touch("web-1", 100.0)
+    index.touch("web-2", 110.0)
+    index.touch("web-3", 200.0)
+    index.touch("web-1", 150.0)
+
+    assert index.pop_expired(120.0) == ["web-2"]
+    assert len(index) == 2
+    assert index.pop_expired(120.0) == []
+    assert sorted(index.pop_expired(300.0)) == ["web-1", "web-3"]
+    assert len(index) == 0
+    print('✓ only overdue hosts expire')
+
+
+def test_discarded_hosts_do_not_expire():
+    """Discarded hosts are dropped and can be tracked again later"""
+    print('=== Testing discard ===')
+    index = DeadlineIndex()
+    index.touch("db-1", 100.0)
+    index.discard("db-1")
+    assert index.pop_expired(500.0) == []
+
+    index.touch("db-1", 600.0)
+    index.touch("db-1", 90.0)
+    assert index.pop_expired(700.0) == ["db-1"]
+    print('✓ discard and re-touch behave')
+
+
+if __name__ == '__main__':
+    test_pop_expired_returns_only_overdue_hosts()
+    test_discarded_hosts_do_not_expire()
+    print('\nAll liveness tests passed!')
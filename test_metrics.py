@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Test script for per-thread metric aggregation and text exposition
+"""
+
+import threading
+
+from app.metrics import Counter
+from app.metrics import Histogram
+from app.metrics import _Metric
+
+
+def test_counter_sums_thread_shards():
+    """Increments from several threads are summed on render"""
+    print('=== Testing counter aggregation ===')
+    counter = Counter('test_events', 'Events.', ['queue'])
+
+    def work():
+        for _ in range(1000):
+            counter.inc('q1')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc('q2', amount=2)
+    lines = counter.render()
+    assert lines[:2] == ['# HELP test_events_total Events.', '# TYPE test_events_total counter']
+    assert 'test_events_total{queue="q1"} 4000' in lines
+    assert 'test_events_total{queue="q2"} 2' in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    """Bucket counts are cumulative and +Inf equals the observation count"""
+    print('\n=== Testing histogram exposition ===')
+    histogram = Histogram('test_latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    lines = histogram.render()
+    assert 'test_latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'test_latency_seconds_bucket{le="1"} 3' in lines
+    assert 'test_latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'test_latency_seconds_count 4' in lines
+    assert 'test_latency_seconds_sum 3.65' in lines
+
+
+def test_metric_base_is_abstract():
+    """Metric kinds must implement series storage and rendering"""
+    print('\n=== Testing abstract metric base ===')
+    try:
+        _Metric('test_abstract', 'Abstract.')
+    except TypeError:
+        pass
+    else:
+        raise AssertionError('_Metric should not be instantiable')
+
+
+if __name__ == '__main__':
+    test_counter_sums_thread_shards()
+    test_histogram_buckets_are_cumulative()
+    test_metric_base_is_abstract()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Test script for the process-pool message parser
+"""
+
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+from app import parse_pool
+from app.mq_handlers import public_key_store
+from app.parse_pool import ParserPool
+
+
+def test_pool_round_trip():
+    """Bodies parsed in a worker process come back as the same dicts as in-process parsing"""
+    print('=== Testing parser pool round trip ===')
+    result = json.dumps({'task_id': 't1', 'hostname': 'web-01', 'exit_code': 0, 'stdout': 'ok', 'seq': 1, 'timestamp': 1694582400}).encode()
+    status = json.dumps({'task_id': 't1', 'status': 'received'}).encode()
+    properties = SimpleNamespace(headers=None, message_id='m-1')
+    result_pool = ParserPool('result', 1)
+    status_pool = ParserPool('status', 1)
+    try:
+        parsed = result_pool.parse(result, properties)
+        assert parsed == parse_pool.PARSERS['result'](result, properties)
+        assert parsed['hostname'] == 'web-01' and parsed['stdout'] == 'ok'
+        assert result_pool.parse(b'not json', properties) is None
+        assert status_pool.parse(status, properties) == {'task_id': 't1', 'status': 'received', 'reason': None}
+    finally:
+        result_pool.shutdown()
+        status_pool.shutdown()
+    print('✓ Worker processes return parsed messages')
+
+
+def test_submit_passes_key_generation():
+    """Each submission carries the parent's current key-store generation"""
+    print('\n=== Testing generation hand-off ===')
+    pool = ParserPool.__new__(ParserPool)
+    pool.kind = 'heartbeat'
+    pool._executor = mock.Mock()
+    pool.submit(b'{}', SimpleNamespace(headers={'x-timestamp': 1}, message_id=None))
+    before = pool._executor.submit.call_args.args[2]
+    public_key_store.invalidate('web-01')
+    pool.submit(b'{}', SimpleNamespace(headers=None, message_id=None))
+    assert pool._executor.submit.call_args.args[2] == before + 1
+    print('✓ Generation follows invalidations')
+
+
+def test_worker_invalidates_on_new_generation():
+    """A worker clears its key cache once per generation change, not per message"""
+    print('\n=== Testing worker cache invalidation ===')
+    body = json.dumps({'task_id': 't1', 'status': 'sent'}).encode()
+    with mock.patch.object(parse_pool, '_seen_generation', None), \
+            mock.patch.object(public_key_store, 'invalidate') as invalidate:
+        parse_pool._parse('status', 5, body, None, None)
+        parse_pool._parse('status', 5, body, None, None)
+        assert invalidate.call_count == 1
+        assert parse_pool._parse('status', 6, body, None, None)['status'] == 'sent'
+        assert invalidate.call_count == 2
+    print('✓ Cache dropped only when the generation moves')
+
+
+if __name__ == '__main__':
+    test_pool_round_trip()
+    test_submit_passes_key_generation()
+    test_worker_invalidates_on_new_generation()
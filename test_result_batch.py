@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test script for batched result ingestion and its fallback
+"""
+
+from datetime import datetime, timezone
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import Session
+
+from app import crud
+from app import models
+from app import mq_handlers
+from app.db import Base
+from app.result_batch import ResultBatch
+from app.result_dedup import RecentKeys
+
+
+class SqliteInsert:
+    """Stands in for the MySQL insert so ON DUPLICATE KEY UPDATE no-ops run on sqlite"""
+
+    def __init__(self, model):
+        self.stmt = sqlite.insert(model)
+        self.inserted = self.stmt.excluded
+
+    def on_duplicate_key_update(self, **values):
+        return self.stmt.on_conflict_do_nothing()
+
+
+def _result(task_id):
+    return {'task_id': task_id, 'hostname': 'web-01', 'exit_code': 0, 'idempotency_key': f'key-{task_id}'}
+
+
+def test_batch_due_and_drain():
+    """A batch is due on size or delay and drains parsed results with the last tag"""
+    print('=== Testing result batch ===')
+    batch = ResultBatch(max_size=3, max_delay=60)
+    assert not batch.due()
+    batch.add(1, _result('t1'))
+    batch.add(2, None)
+    assert not batch.due()
+    batch.add(3, _result('t2'))
+    assert batch.due()
+    results, last_tag = batch.drain()
+    assert [result['task_id'] for result in results] == ['t1', 't2']
+    assert last_tag == 3
+    assert len(batch) == 0 and batch.drain() == ([], None)
+
+    batch = ResultBatch(max_size=100, max_delay=0)
+    batch.add(1, _result('t1'))
+    assert batch.due()
+    print('✓ Size and delay triggers work')
+
+
+def test_failure_before_commit_falls_back_per_result():
+    """Nothing was committed, so every result is retried on its own"""
+    print('\n=== Testing pre-commit fallback ===')
+    results = [_result('t1'), _result('t2')]
+    with mock.patch.object(mq_handlers, 'SessionLocal'), \
+            mock.patch.object(mq_handlers, 'commit_results', side_effect=RuntimeError('deadlock')), \
+            mock.patch.object(mq_handlers, 'store_result') as store_result, \
+            mock.patch.object(mq_handlers, 'record_fanout_result') as record_fanout_result:
+        mq_handlers.store_results(results)
+    assert [call.args[0] for call in store_result.call_args_list] == results
+    record_fanout_result.assert_not_called()
+    print('✓ Each result retried in its own transaction')
+
+
+def test_failure_after_commit_retries_only_fanout():
+    """Committed results are not re-ingested; only their fan-out recording is retried"""
+    print('\n=== Testing post-commit fan-out retry ===')
+    stored = {'task_id': 'parent', 'hostname': 'web-02', 'exit_code': 1, 'result_uid': 'key-parent'}
+    with mock.patch.object(mq_handlers, 'SessionLocal'), \
+            mock.patch.object(mq_handlers, 'commit_results', return_value=([True], [(0, stored)])), \
+            mock.patch.object(mq_handlers, 'record_fanout_results', side_effect=RuntimeError('lost connection')), \
+            mock.patch.object(mq_handlers, 'store_result') as store_result, \
+            mock.patch.object(mq_handlers, 'record_fanout_result') as record_fanout_result:
+        mq_handlers.store_results([_result('parent')])
+    store_result.assert_not_called()
+    assert record_fanout_result.call_args.args[1:] == ('parent', 'web-02', 1, 'key-parent')
+    print('✓ Fan-out recorded on retry without re-ingesting')
+
+
+def test_redelivered_results_publish_no_events():
+    """Results already stored, e.g. redelivered after a restart, are not streamed again"""
+    print('\n=== Testing events for redelivered results ===')
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    results = [dict(_result(task_id), stdout='ok', stderr='', timestamp=datetime.now(timezone.utc)) for task_id in ('t1', 't2')]
+    with Session(engine) as db:
+        for task_id in ('t1', 't2'):
+            db.add(models.Task(task_id=task_id, target_type='node', target='web-01', command='uptime',
+                               timeout=30, status='sent', created_at=datetime.now(timezone.utc)))
+        db.commit()
+        with mock.patch.object(crud, 'mysql_insert', SqliteInsert), \
+                mock.patch.object(mq_handlers, 'event_bus') as event_bus:
+            with mock.patch.object(mq_handlers, 'recent_results', RecentKeys(10)):
+                mq_handlers.commit_results(db, results[:1])
+            event_bus.reset_mock()
+            # A fresh process: the in-memory cache has forgotten t1.
+            with mock.patch.object(mq_handlers, 'recent_results', RecentKeys(10)):
+                outcomes, _ = mq_handlers.commit_results(db, results)
+        assert outcomes == [True, True]
+        result_event, status_event = event_bus.publish.call_args_list
+        assert result_event.args[0] == 'result' and result_event.args[1].task_id == 't2'
+        assert status_event.args == ('task_status', {'task_id': 't2', 'status': 'done'})
+        assert len(crud.list_task_results(db, 't1')) == 1
+    print('✓ Only the new result is published')
+
+
+if __name__ == '__main__':
+    test_batch_due_and_drain()
+    test_failure_before_commit_falls_back_per_result()
+    test_failure_after_commit_retries_only_fanout()
+    test_redelivered_results_publish_no_events()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Test script for result idempotency keys and the recently-seen filter
+"""
+
+from app.result_dedup import RecentKeys
+from app.result_dedup import result_key
+
+
+def test_result_key_is_stable_across_redelivery():
+    """The same result maps to the same key; a new sequence number does not"""
+    print('=== Testing result keys ===')
+    data = {"task_id": "t1", "hostname": "web-1", "seq": 7}
+    assert result_key(data, "m1", b"a") == result_key(data, "m2", b"b")
+    assert result_key(data, None, b"a") != result_key(dict(data, seq=8), None, b"a")
+
+    unsequenced = {"task_id": "t1", "hostname": "web-1"}
+    assert result_key(unsequenced, None, b"body") == result_key(unsequenced, None, b"body")
+    assert result_key(unsequenced, None, b"body") != result_key(unsequenced, None, b"other")
+    assert result_key(unsequenced, "m1", b"body") == result_key(unsequenced, "m1", b"other")
+    assert len(result_key(data, None, b"")) == 32
+    print('✓ keys are stable')
+
+
+def test_recent_keys_evicts_least_recent():
+    """The filter keeps the most recently seen keys up to its size"""
+    print('=== Testing recently-seen filter ===')
+    recent = RecentKeys(max_entries=2)
+    recent.add_many(["a", "b"])
+    assert "a" in recent
+    recent.add_many(["c"])
+    assert "a" in recent
+    assert "b" not in recent
+    assert "c" in recent
+    assert len(recent) == 2
+    print('✓ least recent key evicted')
+
+
+if __name__ == '__main__':
+    test_result_key_is_stable_across_redelivery()
+    test_recent_keys_evicts_least_recent()
+    print('\nAll result dedup tests passed!')
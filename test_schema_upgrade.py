@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Test script for adding new columns and indexes to existing tables
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy import inspect
+
+from app.schema_upgrade import pending_ddl
+from app.schema_upgrade import upgrade_schema
+
+
+def test_upgrade_adds_result_columns_to_old_table():
+    """A task_results table from an older release gains the new columns and unique index"""
+    print('=== Testing schema upgrade ===')
+    engine = create_engine('sqlite://')
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'CREATE TABLE task_results (id INTEGER PRIMARY KEY, task_id VARCHAR(64) NOT NULL, '
+            'exit_code INTEGER, stdout TEXT, stderr TEXT, timestamp DATETIME NOT NULL)'
+        )
+        connection.exec_driver_sql("INSERT INTO task_results (task_id, timestamp) VALUES ('t1', '2024-01-01')")
+
+    upgrade_schema(engine)
+    inspector = inspect(engine)
+    columns = {column['name'] for column in inspector.get_columns('task_results')}
+    assert {'hostname', 'result_uid', 'stdout_truncated', 'stderr_truncated'} <= columns
+    indexes = {index['name']: index['unique'] for index in inspector.get_indexes('task_results')}
+    assert indexes['ix_task_results_result_uid']
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT stdout_truncated FROM task_results').scalar() == 0
+    assert pending_ddl(engine) == []
+    print('✓ Old table upgraded in place')
+
+
+if __name__ == '__main__':
+    test_upgrade_adds_result_columns_to_old_table()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Test script for the memoizing signature verifier
+"""
+
+import base64
+from datetime import datetime, timezone
+from unittest import mock
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from app.util import sign_util
+from app.util.sign_util import SignatureVerifier
+
+
+def _sign(private_key, params):
+    content = sign_util._build_sorted_json(params)
+    return base64.b64encode(private_key.sign(content, padding.PKCS1v15(), hashes.SHA256())).decode("utf-8")
+
+
+def test_verifier_reuses_successful_verification():
+    """A repeated signature is verified once within the window"""
+    print('=== Testing verification cache ===')
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_key = private_key.public_key()
+    params = {"hostname": "test-server", "timestamp": int(datetime.now(timezone.utc).timestamp())}
+    signature = _sign(private_key, params)
+    verifier = SignatureVerifier(window=60)
+
+    with mock.patch.object(sign_util, "verify_with_public_key", wraps=sign_util.verify_with_public_key) as spy:
+        assert verifier.verify(params, signature, public_key)
+        assert verifier.verify(params, signature, public_key)
+        assert spy.call_count == 1
+
+        other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key()
+        assert not verifier.verify(params, signature, other_key)
+        assert spy.call_count == 2
+
+
+def test_verifier_does_not_cache_failures():
+    """A bad signature is rejected every time"""
+    print('\n=== Testing failed verification is not cached ===')
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    params = {"hostname": "test-server", "timestamp": 1}
+    signature = _sign(private_key, params)
+    verifier = SignatureVerifier(window=60)
+    wrong = {"hostname": "test-server", "timestamp": 2}
+    assert not verifier.verify(wrong, signature, private_key.public_key())
+    assert not verifier.verify(wrong, signature, private_key.public_key())
+
+
+if __name__ == '__main__':
+    test_verifier_reuses_successful_verification()
+    test_verifier_does_not_cache_failures()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Test script for per-task result counts
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import crud
+from app import models
+from app.db import Base
+
+
+def test_failed_count_matches_in_both_modes():
+    """Summary counts and full results agree on NULL exit codes"""
+    print('=== Testing failed_count rules ===')
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        for exit_code in (0, 1, None, 2):
+            db.add(models.TaskResult(task_id='t1', exit_code=exit_code))
+        db.commit()
+
+        total, failed = crud.count_results_by_task(db, ['t1'])['t1']
+        results = crud.list_results_by_task(db, ['t1'])['t1']
+        assert total == len(results) == 4
+        assert failed == sum(1 for result in results if crud.result_failed(result.exit_code)) == 2
+    print('✓ NULL exit code is not counted as failed')
+
+
+if __name__ == '__main__':
+    test_failed_count_matches_in_both_modes()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test script for conditional task status transitions
+"""
+
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import crud
+from app import models
+from app.db import Base
+from app.mq_handlers import TASK_TRANSITION_SOURCES
+from app.mq_handlers import apply_statuses
+from app.mq_handlers import transition_miss
+
+
+def _session(*tasks):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db = Session(engine)
+    for task_id, status in tasks:
+        db.add(models.Task(
+            task_id=task_id,
+            target_type='node',
+            target='web-01',
+            command='uptime',
+            timeout=30,
+            status=status,
+            created_at=datetime.now(timezone.utc),
+        ))
+    db.commit()
+    return db
+
+
+def test_transition_task_follows_state_machine():
+    """Allowed steps move the row; others match nothing and are explained by transition_miss"""
+    print('=== Testing single transitions ===')
+    db = _session(('t1', 'pending'), ('t2', 'done'))
+    assert crud.transition_task(db, 't1', 'sent', TASK_TRANSITION_SOURCES['sent'])
+    # Repeating the current status matches no row but is accepted.
+    assert not crud.transition_task(db, 't1', 'sent', TASK_TRANSITION_SOURCES['sent'])
+    assert transition_miss(crud.task_states(db, ['t1'])['t1'][0], 't1', 'sent')
+    # A terminal task never moves back.
+    assert not crud.transition_task(db, 't2', 'received', TASK_TRANSITION_SOURCES['received'])
+    assert not transition_miss(crud.task_states(db, ['t2'])['t2'][0], 't2', 'received')
+    assert not transition_miss(None, 't3', 'sent')
+    assert crud.get_task_by_id(db, 't2').status == 'done'
+    db.close()
+    print('✓ Transitions match the state machine')
+
+
+def test_apply_statuses_reads_back_only_on_rowcount_miss():
+    """A batch applies in lifecycle order and reports per-update outcomes"""
+    print('\n=== Testing batched transitions ===')
+    db = _session(('t1', 'pending'), ('t2', 'done'), ('t3', 'pending'))
+    outcomes = apply_statuses(db, [
+        {'task_id': 't1', 'status': 'received', 'reason': None},
+        {'task_id': 't1', 'status': 'sent', 'reason': None},
+        {'task_id': 't2', 'status': 'received', 'reason': None},
+        {'task_id': 't3', 'status': 'rejected', 'reason': 'busy'},
+        {'task_id': 'missing', 'status': 'sent', 'reason': None},
+    ])
+    assert outcomes == [True, True, False, True, False]
+    states = crud.task_states(db, ['t1', 't2', 't3'])
+    assert {task_id: state[0] for task_id, state in states.items()} == {
+        't1': 'received',
+        't2': 'done',
+        't3': 'rejected',
+    }
+    db.close()
+    print('✓ Batch outcomes and final states are correct')
+
+
+if __name__ == '__main__':
+    test_transition_task_follows_state_machine()
+    test_apply_statuses_reads_back_only_on_rowcount_miss()